@@ -0,0 +1,403 @@
+"""benchmark - measure throughput of simulator and pipeline building blocks"""
+# run with cpython, e.g. python benchmark.py --simulator -p 100000
+
+import os
+import sys
+import argparse
+import json
+import logging
+import time
+import tempfile
+
+from util import setup_logging, add_logging_argument
+
+from simulator_core import Simulator
+from topology import Topology, DEFAULT_TOPOLOGY
+from event_codec import CODECS, get_codec
+from deadline_index import DeadlineIndex
+from const import SORTING_CENTER_CODES
+
+SIMULATED_START_TIME = 1600000000
+
+
+def measure(name, count_events):
+    """call count_events(), log and return events per second"""
+    start_time = time.time()
+    event_count = count_events()
+    elapsed_time = time.time() - start_time
+    events_per_second = event_count / elapsed_time if elapsed_time else 0
+    logging.info(
+        "%-36s %10d events %8.2fs %12.0f events/sec",
+        name,
+        event_count,
+        elapsed_time,
+        events_per_second,
+    )
+    return events_per_second
+
+
+def simulator_arguments(options):
+    """return Simulator keyword arguments for the benchmark"""
+    return dict(
+        simulated_run_time=options.simulated_run_time,
+        intake_run_time=options.intake_run_time,
+        package_count=options.package_count,
+        simulated_start_time=SIMULATED_START_TIME,
+        delayed_package_count=options.package_count // 100,
+        lost_package_count=options.package_count // 400,
+    )
+
+
+def benchmark_simulator(options):
+    """compare event generation rate of the simulator engines"""
+    from simulator_batch import BatchSimulator  # requires numpy
+
+    results = {}
+    results["event_source"] = measure(
+        "Simulator.event_source",
+        lambda: sum(1 for _ in Simulator(**simulator_arguments(options)).event_source()),
+    )
+    results["event_source json"] = measure(
+        "Simulator.event_source + json.dumps",
+        lambda: sum(
+            1
+            for _ in map(
+                json.dumps, Simulator(**simulator_arguments(options)).event_source()
+            )
+        ),
+    )
+    results["event_blocks"] = measure(
+        "BatchSimulator.event_blocks",
+        lambda: sum(
+            len(_)
+            for _ in BatchSimulator(**simulator_arguments(options)).event_blocks()
+        ),
+    )
+    results["event_source batch"] = measure(
+        "BatchSimulator.event_source",
+        lambda: sum(
+            1 for _ in BatchSimulator(**simulator_arguments(options)).event_source()
+        ),
+    )
+    with open(os.devnull, "wb") as null_file:
+        results["json_lines"] = measure(
+            "BatchSimulator.write_json_lines",
+            lambda: BatchSimulator(**simulator_arguments(options)).write_json_lines(
+                null_file
+            ),
+        )
+    logging.info(
+        "speedup: columns %.1fx, dicts %.1fx, json %.1fx",
+        results["event_blocks"] / results["event_source"],
+        results["event_source batch"] / results["event_source"],
+        results["json_lines"] / results["event_source json"],
+    )
+    return results
+
+
+class NullEventWriter:
+    """stands in for a pravega EventStreamWriter, counts events and bytes"""
+
+    def __init__(self):
+        self.event_count = 0
+        self.byte_count = 0
+
+    def noteTime(self, timestamp):
+        pass
+
+    def writeEvent(self, routing_key, event):
+        self.event_count += 1
+        self.byte_count += len(event)
+        return COMPLETED_FUTURE
+
+    def flush(self):
+        pass
+
+
+class CompletedFuture:
+    """stands in for the CompletableFuture returned by writeEvent"""
+
+    def join(self):
+        return None
+
+
+COMPLETED_FUTURE = CompletedFuture()
+
+
+def benchmark_topology_sizes(options):
+    """measure simulator and import throughput for different sorting center counts"""
+    try:
+        from simulator_batch import BatchSimulator
+    except ImportError:
+        BatchSimulator = None
+        logging.info("numpy is not available, skipping batch simulator")
+    try:
+        from import_events import write_to_streams
+    except ImportError:
+        write_to_streams = None
+        logging.info("pravega client is not available (run with jython), skipping import")
+
+    for sorting_center_count in options.topology_sizes:
+        if sorting_center_count == len(DEFAULT_TOPOLOGY):
+            topology = DEFAULT_TOPOLOGY
+        else:
+            topology = Topology.generate(sorting_center_count)
+        arguments = dict(simulator_arguments(options), topology=topology)
+        logging.info("%d sorting centers", sorting_center_count)
+
+        measure(
+            "Simulator.event_source",
+            lambda: sum(1 for _ in Simulator(**arguments).event_source()),
+        )
+        if BatchSimulator:
+            measure(
+                "BatchSimulator.event_blocks",
+                lambda: sum(len(_) for _ in BatchSimulator(**arguments).event_blocks()),
+            )
+
+        if write_to_streams:
+            with tempfile.TemporaryFile(mode="w+") as input_file:
+                for event in Simulator(**arguments).ordered_event_source():
+                    input_file.write("%s\n" % json.dumps(event))
+                input_file.seek(0)
+                measure(
+                    "import_events.write_to_streams",
+                    lambda: import_to_null_writers(
+                        write_to_streams, input_file, topology
+                    ),
+                )
+
+
+def import_to_null_writers(write_to_streams, input_file, topology):
+    """route events from input_file to NullEventWriters, return event count"""
+    sorting_center_to_stream_map = {
+        _: NullEventWriter() for _ in topology.sorting_center_codes
+    }
+    write_to_streams(input_file, sorting_center_to_stream_map)
+    return sum(_.event_count for _ in sorting_center_to_stream_map.values())
+
+
+def benchmark_codecs(options):
+    """compare encode and decode time and size of event codecs"""
+    events = list(Simulator(**simulator_arguments(options)).event_source())
+    package_attributes = [
+        {
+            "intake_time": _["event_time"],
+            "origin": _["sorting_center"],
+            "destination": _["destination"],
+            "declared_value": _["declared_value"],
+            "estimated_delivery_time": _["estimated_delivery_time"],
+            "weight": 20,
+        }
+        for _ in events
+        if _["scanner_id"] == "intake"
+    ]
+    package_events = [
+        [
+            {
+                "event_time": _["event_time"] + idx * 3600,
+                "sorting_center": _["sorting_center"],
+                "scanner_id": scanner_id,
+            }
+            for idx, scanner_id in enumerate(("intake", "holding_B", "output"))
+        ]
+        for _ in events
+        if _["scanner_id"] == "intake"
+    ]
+    records = (
+        ("scan events", "encode_event", events),
+        ("package attributes", "encode_package_attributes", package_attributes),
+        ("package event lists", "encode_package_events", package_events),
+    )
+    for codec_name in sorted(CODECS):
+        codec = get_codec(codec_name)
+        for record_name, encode_name, values in records:
+            encode = getattr(codec, encode_name)
+            encoded = []
+
+            def encode_values():
+                encoded.extend(encode(_) for _ in values)
+                return len(encoded)
+
+            measure("%s encode %s" % (codec_name, record_name), encode_values)
+            measure(
+                "%s decode %s" % (codec_name, record_name),
+                lambda: sum(1 for _ in map(codec.decode, encoded)),
+            )
+            logging.info(
+                "%s %s %.1f bytes/record",
+                codec_name,
+                record_name,
+                sum(len(_) for _ in encoded) / float(len(encoded)),
+            )
+
+
+def benchmark_redis_updates(options):
+    """compare update_next_event_time with and without redis pipelining
+
+    requires jython and a scratch redis server, sorting center keys are overwritten
+    """
+    try:
+        from sorting_center import update_next_event_time, NextEventTimeBatch
+        from redis_util import get_redis_server_from_options
+    except ImportError:
+        logging.info("sorting_center requires jython, skipping redis benchmark")
+        return
+
+    redis = get_redis_server_from_options(options)
+    if not redis:
+        logging.info("no redis server (--rs), skipping redis benchmark")
+        return
+
+    events = list(Simulator(**simulator_arguments(options)).ordered_event_source())
+    for name, next_event_times in (
+        ("update_next_event_time", None),
+        (
+            "update_next_event_time pipelined",
+            NextEventTimeBatch(redis, SORTING_CENTER_CODES[0]),
+        ),
+    ):
+        measure(
+            name,
+            lambda: sum(
+                1
+                for _ in update_next_event_time(
+                    iter(events), redis=redis, next_event_times=next_event_times
+                )
+            ),
+        )
+
+
+def benchmark_deadlines(options):
+    """measure the in-process deadline index, schedule or cancel per event and a sweep per minute"""
+    events = list(Simulator(**simulator_arguments(options)).ordered_event_source())
+    deadlines = DeadlineIndex()
+    counts = {"expired": 0, "maximum": 0}
+
+    def replay():
+        sweep_minute = None
+        for event in events:
+            next_event_time = event.get("next_event_time")
+            if next_event_time:
+                deadlines.schedule(
+                    event["package_id"], next_event_time, event.get("next_scanner_id")
+                )
+            else:
+                deadlines.cancel(event["package_id"])
+            minute = event["event_time"] // 60
+            if minute != sweep_minute:
+                sweep_minute = minute
+                counts["expired"] += len(deadlines.expire(event["event_time"] - 60))
+                counts["maximum"] = max(counts["maximum"], len(deadlines))
+        return len(events)
+
+    measure("DeadlineIndex schedule/cancel/expire", replay)
+    logging.info(
+        "%d packages scheduled at most, %d expired", counts["maximum"], counts["expired"]
+    )
+
+
+def get_argument_parser():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--simulator",
+        help="benchmark simulator engines",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--codecs",
+        help="benchmark event codecs",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--redis",
+        help="benchmark sorting center redis updates (jython, requires --rs)",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--deadlines",
+        help="benchmark the in-process deadline index of standalone sorting centers",
+        action="store_true",
+        default=False,
+    )
+
+    # same as redis_util.add_redis_argparse_argument, redis_util needs a redis client
+    parser.add_argument("--rs", dest="redis_server", help="redis host[:port]")
+
+    parser.add_argument(
+        "--topology_sizes",
+        type=lambda _: [int(size) for size in _.split(",")],
+        help="benchmark simulator and import for these sorting center counts, e.g. 4,16,64",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-s",
+        "--simulated_run_time",
+        type=int,
+        default=10080,
+        help="total simulated running time (minutes)",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--intake_run_time",
+        type=int,
+        default=480,
+        help="total simulated running time to intake packages (minutes)",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--package_count",
+        type=int,
+        default=100000,
+        help="total number of packages to be simulated",
+    )
+
+    return parser
+
+
+def main():
+    """main"""
+    parser = get_argument_parser()
+    add_logging_argument(parser)
+    args = parser.parse_args()
+    setup_logging(args)
+
+    handled_params = False
+    if args.simulator:
+        benchmark_simulator(args)
+        handled_params = True
+
+    if args.topology_sizes:
+        benchmark_topology_sizes(args)
+        handled_params = True
+
+    if args.codecs:
+        benchmark_codecs(args)
+        handled_params = True
+
+    if args.redis:
+        benchmark_redis_updates(args)
+        handled_params = True
+
+    if args.deadlines:
+        benchmark_deadlines(args)
+        handled_params = True
+
+    if not handled_params:
+        parser.print_help()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""checkpoint - restart points of a sorting center process"""
+# to be used from jython
+#
+# a checkpoint is initiated on the reader group every interval wall-clock
+# seconds. Each reader reads it between two events and passes it through the
+# pipeline as a marker event, stages flush their buffered writes when they see
+# it. At the end of the pipeline a reader waits until all readers reached the
+# marker, so no event after the checkpoint has been processed, and the local
+# state is captured. Once the checkpoint has completed, its StreamCut is saved
+# with the state in checkpoint_file.
+#
+# a restarted process resets its reader group to the saved StreamCut and
+# restores the state. Events after the checkpoint are processed again, kvt and
+# redis updates are repeated with the same values, trouble events since the
+# checkpoint may be reported twice
+
+import time
+import logging
+import threading
+import contextlib
+
+from java.util.concurrent import Executors
+
+from deadline_index import save_snapshot, load_snapshot
+
+CHECKPOINT_INTERVAL = 60.0  # wall-clock seconds between checkpoints
+CHECKPOINT_SCANNER_ID = "checkpoint"  # scanner_id of checkpoint marker events
+
+
+def checkpoint_marker(checkpoint_name, event_time):
+    """return marker event of a checkpoint read after events up to event_time"""
+    return {
+        "event_time": event_time,
+        "scanner_id": CHECKPOINT_SCANNER_ID,
+        "package_id": "none",
+        "checkpoint_name": checkpoint_name,
+    }
+
+
+class Checkpoints:
+    """periodic checkpoints of a reader group, saved with local state
+
+    reached and finish are called by the reader threads of the reader group
+    """
+
+    def __init__(self, checkpoint_file, interval=CHECKPOINT_INTERVAL):
+        self.checkpoint_file = checkpoint_file
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.reader_group = None
+        self.executor = None
+        self.capture_state = None
+        self.reader_count = 0  # readers that haven't finished
+        self.arrived = 0  # readers at the marker of the pending checkpoint
+        self.event_time = None  # latest event_time before the pending checkpoint
+        self.pending_name = None
+        self.captured_name = None
+        self.future = None
+        self.state = None  # captured at the pending checkpoint
+        self.checkpoint_time = time.time()
+        self.failed = False
+
+    def load(self):
+        """return StreamCut text and state of the last checkpoint, None if there is none"""
+        saved = load_snapshot(self.checkpoint_file)
+        if saved is None:
+            return None, None
+        logging.info(
+            "resuming from checkpoint %s, last event_time %s",
+            saved["checkpoint_name"],
+            saved["state"].get("event_time"),
+        )
+        return saved["stream_cut"], saved["state"]
+
+    def poll(self):
+        """initiate a checkpoint when it is due, save a completed one"""
+        if self.failed or (
+            self.future is None and time.time() - self.checkpoint_time < self.interval
+        ):
+            return
+        with self.condition:
+            if self.future is None:
+                if time.time() - self.checkpoint_time >= self.interval:
+                    self.initiate()
+            elif self.future.isDone() and (
+                self.state is not None or self.future.isCompletedExceptionally()
+            ):
+                self.save()
+
+    def initiate(self):
+        """ask the readers to checkpoint"""
+        self.pending_name = "checkpoint-%d" % int(time.time() * 1000)
+        self.arrived = 0
+        self.event_time = None
+        self.future = self.reader_group.initiateCheckpoint(
+            self.pending_name, self.executor
+        )
+        logging.debug("initiated %s", self.pending_name)
+
+    def reached(self, event):
+        """wait until all readers reached the checkpoint of marker event"""
+        checkpoint_name = event["checkpoint_name"]
+        with self.condition:
+            if self.failed or checkpoint_name != self.pending_name:
+                # not initiated by this process
+                return
+            self.arrived += 1
+            event_time = event["event_time"]
+            if event_time is not None and (
+                self.event_time is None or event_time > self.event_time
+            ):
+                self.event_time = event_time
+            if self.arrived >= self.reader_count:
+                self.capture()
+            while self.captured_name != checkpoint_name:
+                self.condition.wait()
+
+    def finish(self, failed=False):
+        """stop waiting for a reader that has no more events
+
+        if the reader failed, its state at the checkpoint is unknown and no
+        more checkpoints are saved
+        """
+        with self.condition:
+            self.reader_count -= 1
+            if failed:
+                self.failed = True
+                self.state = None
+                self.captured_name = self.pending_name
+                self.condition.notify_all()
+            elif (
+                self.pending_name != self.captured_name
+                and self.arrived
+                and self.arrived >= self.reader_count
+            ):
+                self.capture()
+
+    def capture(self):
+        """capture local state at the pending checkpoint, release waiting readers"""
+        self.state = dict(self.capture_state(), event_time=self.event_time)
+        self.captured_name = self.pending_name
+        self.condition.notify_all()
+
+    def save(self):
+        """save StreamCut and state of the completed checkpoint"""
+        try:
+            checkpoint = self.future.join()
+        except Exception as error:
+            logging.warn("checkpoint %s failed: %s", self.pending_name, error)
+        else:
+            for stream_cut in checkpoint.asImpl().getPositions().values():
+                save_snapshot(
+                    self.checkpoint_file,
+                    {
+                        "checkpoint_name": self.pending_name,
+                        "stream_cut": stream_cut.asText(),
+                        "state": self.state,
+                    },
+                )
+            logging.info(
+                "saved %s, event_time %s", self.pending_name, self.state["event_time"]
+            )
+        self.future = None
+        self.state = None
+        self.checkpoint_time = time.time()
+
+
+@contextlib.contextmanager
+def checkpointReaderGroup(checkpoints, reader_group, reader_count, capture_state):
+    """take checkpoints of reader_group while in context, capture_state() returns local state
+
+    checkpoints may be None, to take none
+    """
+    if checkpoints is None:
+        yield None
+        return
+    checkpoints.reader_group = reader_group
+    checkpoints.reader_count = reader_count
+    checkpoints.capture_state = capture_state
+    checkpoints.checkpoint_time = time.time()
+    checkpoints.executor = Executors.newScheduledThreadPool(1)
+    try:
+        yield checkpoints
+    finally:
+        checkpoints.executor.shutdown()
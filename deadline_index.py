@@ -0,0 +1,107 @@
+"""deadline_index - in-process index of keys by deadline, a bucketed heap"""
+# keys are kept in buckets of bucket_width seconds. A heap of bucket numbers
+# finds the earliest bucket, so expiring only visits buckets that are due.
+# Scheduling and cancelling a key are dict operations. The heap may contain
+# numbers of buckets that have since been emptied, they are skipped.
+
+import os
+import json
+import heapq
+
+BUCKET_WIDTH = 60  # seconds
+
+
+class DeadlineIndex:
+    """keys with a deadline and a value, expired in deadline order"""
+
+    def __init__(self, bucket_width=BUCKET_WIDTH):
+        self.bucket_width = bucket_width
+        self.buckets = {}  # bucket number: {key: (deadline, value)}
+        self.bucket_numbers = []  # heap
+        self.key_bucket = {}  # key: bucket number
+
+    def __len__(self):
+        return len(self.key_bucket)
+
+    def __contains__(self, key):
+        return key in self.key_bucket
+
+    def get(self, key, default=None):
+        """return (deadline, value) of key"""
+        bucket_number = self.key_bucket.get(key)
+        if bucket_number is None:
+            return default
+        return self.buckets[bucket_number][key]
+
+    def schedule(self, key, deadline, value=None):
+        """set deadline of key, replacing an earlier deadline"""
+        self.cancel(key)
+        bucket_number = int(deadline // self.bucket_width)
+        bucket = self.buckets.get(bucket_number)
+        if bucket is None:
+            bucket = self.buckets[bucket_number] = {}
+            heapq.heappush(self.bucket_numbers, bucket_number)
+        bucket[key] = (deadline, value)
+        self.key_bucket[key] = bucket_number
+
+    def cancel(self, key):
+        """remove key, return True if it was scheduled"""
+        bucket_number = self.key_bucket.pop(key, None)
+        if bucket_number is None:
+            return False
+        bucket = self.buckets[bucket_number]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[bucket_number]
+        return True
+
+    def expire(self, now):
+        """remove keys with deadline <= now, return sorted list of (deadline, key, value)"""
+        result = []
+        last_bucket_number = int(now // self.bucket_width)
+        bucket_numbers = self.bucket_numbers
+        while bucket_numbers and bucket_numbers[0] <= last_bucket_number:
+            bucket_number = bucket_numbers[0]
+            bucket = self.buckets.get(bucket_number)
+            if bucket is None:
+                # emptied since it was pushed
+                heapq.heappop(bucket_numbers)
+                continue
+
+            if bucket_number < last_bucket_number:
+                expired = list(bucket.items())
+            else:
+                # last bucket may be partly due
+                expired = [_ for _ in bucket.items() if _[1][0] <= now]
+            for key, _ in expired:
+                del bucket[key]
+                del self.key_bucket[key]
+            result.extend((deadline, key, value) for key, (deadline, value) in expired)
+            if bucket:
+                break
+            del self.buckets[bucket_number]
+            heapq.heappop(bucket_numbers)
+        result.sort()
+        return result
+
+    def items(self):
+        """yield (key, deadline, value) for all keys"""
+        for bucket in self.buckets.values():
+            for key, (deadline, value) in bucket.items():
+                yield key, deadline, value
+
+
+def save_snapshot(file_name, state):
+    """write json state to file_name, replacing it atomically"""
+    temporary_file_name = file_name + ".tmp"
+    with open(temporary_file_name, "w") as snapshot_file:
+        json.dump(state, snapshot_file)
+    os.rename(temporary_file_name, file_name)
+
+
+def load_snapshot(file_name):
+    """return json state from file_name, None if there is no snapshot"""
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "r") as snapshot_file:
+        return json.load(snapshot_file)
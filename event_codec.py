@@ -0,0 +1,307 @@
+"""event_codec - encode events and package records for streams and kvt tables"""
+# two codecs share the same interface:
+#
+#   JsonCodec   json text, as used so far, readable for debugging
+#   BinaryCodec fixed-field binary records, sorting center codes, scanner ids and
+#               event types are interned as 2 byte indexes
+#
+# a binary record starts with a version byte and a record type byte, json
+# always starts with { or [, so BinaryCodec.decode reads both. Records that
+# don't fit a binary layout (unknown fields, values out of range) are encoded
+# as json. Interned strings depend on the topology, so every process must use
+# the same topology and codec.
+#
+# binary layout, big endian:
+#
+#   version       B
+#   record type   B
+#   field mask    H   bit n is set when field n of the record type is present
+#   fixed fields      times and counts I, interned strings H, in field order
+#   text fields       length B, utf-8, in field order, for text fields and
+#                     interned fields that are not in the string table
+#
+# package event lists have the event count in place of the field mask, followed
+# by event_time I, sorting_center H, scanner_id H for each event
+
+import json
+import struct
+
+from topology import DEFAULT_TOPOLOGY
+
+VERSION = 1
+
+# record types
+SCAN_EVENT = 1
+TROUBLE_EVENT = 2
+PACKAGE_ATTRIBUTES = 3
+PACKAGE_EVENTS = 4
+
+# field kinds
+NUMBER = "I"  # whole number, e.g. a time in seconds
+INTERNED = "H"  # index into the string table
+TEXT = None  # length prefixed utf-8
+
+ESCAPE_INDEX = 0xFFFF  # interned field value follows as text
+NULL_INDEX = 0xFFFE  # interned field value is None
+NULL_LENGTH = 0xFF  # text field value is None
+
+RECORD_FIELDS = {
+    SCAN_EVENT: (
+        ("sorting_center", INTERNED),
+        ("scanner_id", INTERNED),
+        ("event_time", NUMBER),
+        ("next_scanner_id", INTERNED),
+        ("next_event_time", NUMBER),
+        ("next_sorting_center", INTERNED),
+        ("destination", INTERNED),
+        ("declared_value", NUMBER),
+        ("estimated_delivery_time", NUMBER),
+        ("weight", NUMBER),
+        ("package_id", TEXT),
+    ),
+    TROUBLE_EVENT: (
+        ("event_type", INTERNED),
+        ("event_time", NUMBER),
+        ("expected_event_time", NUMBER),
+        ("sorting_center", INTERNED),
+        ("package_id", TEXT),
+        ("next_scanner_id", TEXT),
+    ),
+    PACKAGE_ATTRIBUTES: (
+        ("intake_time", NUMBER),
+        ("origin", INTERNED),
+        ("destination", INTERNED),
+        ("declared_value", NUMBER),
+        ("estimated_delivery_time", NUMBER),
+        ("weight", NUMBER),
+        ("delivered_time", NUMBER),
+    ),
+}
+
+SCANNER_IDS = (
+    "intake",
+    "weighing",
+    "pre-routing",
+    "routing",
+    "holding",
+    "receiving",
+    "output",
+    "end-of-stream",
+)
+EVENT_TYPES = ("delayed_package", "late_delivery", "lost_package")
+
+HEADER_FORMAT = ">BBH"
+HEADER = struct.Struct(HEADER_FORMAT)
+PACKAGE_EVENT = struct.Struct(">IHH")
+JSON_MARKERS = (b"{", b"[")
+
+
+class JsonCodec:
+    """events and package records as json text"""
+
+    name = "json"
+    binary = False
+
+    def __init__(self, topology=DEFAULT_TOPOLOGY):
+        pass
+
+    def encode_event(self, event):
+        """return encoded scan or trouble event"""
+        return json.dumps(event)
+
+    def encode_package_attributes(self, package_attributes):
+        """return encoded dict of package attributes"""
+        return json.dumps(package_attributes)
+
+    def encode_package_events(self, package_events):
+        """return encoded list of public package events"""
+        return json.dumps(package_events)
+
+    def decode(self, data):
+        """return event or package record"""
+        return json.loads(data)
+
+
+class BinaryCodec(JsonCodec):
+    """events and package records as fixed-field binary records"""
+
+    name = "binary"
+    binary = True
+
+    def __init__(self, topology=DEFAULT_TOPOLOGY):
+        self.strings = (
+            SCANNER_IDS
+            + EVENT_TYPES
+            + topology.sorting_center_codes
+            + tuple("holding_%s" % _ for _ in topology.sorting_center_codes)
+        )
+        if len(self.strings) >= NULL_INDEX:
+            raise ValueError("too many interned strings")
+        self.string_index = {_: idx for idx, _ in enumerate(self.strings)}
+        self.layouts = {}
+
+    def encode_event(self, event):
+        if "event_type" in event:
+            return self.encode_record(TROUBLE_EVENT, event)
+        return self.encode_record(SCAN_EVENT, event)
+
+    def encode_package_attributes(self, package_attributes):
+        return self.encode_record(PACKAGE_ATTRIBUTES, package_attributes)
+
+    def encode_package_events(self, package_events):
+        string_index = self.string_index
+        try:
+            if any(len(_) != 3 for _ in package_events):
+                raise KeyError("unknown package event field")
+            return HEADER.pack(VERSION, PACKAGE_EVENTS, len(package_events)) + b"".join(
+                PACKAGE_EVENT.pack(
+                    _["event_time"],
+                    string_index[_["sorting_center"]],
+                    string_index[_["scanner_id"]],
+                )
+                for _ in package_events
+            )
+        except (KeyError, struct.error):
+            return self.encode_json(package_events)
+
+    def encode_record(self, record_type, record):
+        """return binary record, or json if the record doesn't fit record_type"""
+        mask = 0
+        values = []
+        texts = []
+        field_count = 0
+        string_index = self.string_index
+        for bit, (name, kind) in enumerate(RECORD_FIELDS[record_type]):
+            if name not in record:
+                continue
+            value = record[name]
+            mask |= 1 << bit
+            field_count += 1
+            if kind is TEXT:
+                texts.append(value)
+            elif kind is INTERNED:
+                if value is None:
+                    values.append(NULL_INDEX)
+                elif value in string_index:
+                    values.append(string_index[value])
+                else:
+                    values.append(ESCAPE_INDEX)
+                    texts.append(value)
+            else:
+                values.append(value)
+        if field_count != len(record):
+            # has fields without a binary layout
+            return self.encode_json(record)
+
+        fixed_struct = self.layout(record_type, mask)[0]
+        try:
+            result = [fixed_struct.pack(VERSION, record_type, mask, *values)]
+            for text in texts:
+                if text is None:
+                    result.append(struct.pack(">B", NULL_LENGTH))
+                    continue
+                text = text.encode("utf-8")
+                if len(text) >= NULL_LENGTH:
+                    raise struct.error("text too long")
+                result.append(struct.pack(">B", len(text)))
+                result.append(text)
+        except struct.error:
+            return self.encode_json(record)
+        return b"".join(result)
+
+    def encode_json(self, data):
+        """return data as utf-8 json"""
+        return json.dumps(data).encode("utf-8")
+
+    def layout(self, record_type, mask):
+        """return (struct for header and fixed fields, list of (name, kind)) for mask"""
+        layout = self.layouts.get((record_type, mask))
+        if layout is None:
+            fields = [
+                _
+                for bit, _ in enumerate(RECORD_FIELDS[record_type])
+                if mask & (1 << bit)
+            ]
+            layout = self.layouts[(record_type, mask)] = (
+                struct.Struct(
+                    HEADER_FORMAT
+                    + "".join(kind for _, kind in fields if kind is not TEXT)
+                ),
+                fields,
+            )
+        return layout
+
+    def decode(self, data):
+        if data[:1] in JSON_MARKERS:
+            if not isinstance(data, str):
+                data = data.decode("utf-8")
+            return json.loads(data)
+
+        version, record_type, mask = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError("unsupported binary record version %r" % version)
+        strings = self.strings
+        if record_type == PACKAGE_EVENTS:
+            return [
+                {
+                    "event_time": event_time,
+                    "sorting_center": strings[sorting_center],
+                    "scanner_id": strings[scanner_id],
+                }
+                for event_time, sorting_center, scanner_id in (
+                    PACKAGE_EVENT.unpack_from(data, HEADER.size + idx * PACKAGE_EVENT.size)
+                    for idx in range(mask)
+                )
+            ]
+
+        fixed_struct, fields = self.layout(record_type, mask)
+        values = iter(fixed_struct.unpack_from(data)[3:])
+        offset = fixed_struct.size
+        result = {}
+        for name, kind in fields:
+            if kind is not TEXT:
+                value = next(values)
+                if kind is NUMBER:
+                    result[name] = value
+                    continue
+                elif value == NULL_INDEX:
+                    result[name] = None
+                    continue
+                elif value != ESCAPE_INDEX:
+                    result[name] = strings[value]
+                    continue
+            # text follows
+            length = struct.unpack_from(">B", data, offset)[0]
+            offset += 1
+            if length == NULL_LENGTH:
+                result[name] = None
+            else:
+                result[name] = data[offset : offset + length].decode("utf-8")
+                offset += length
+        return result
+
+
+CODECS = {
+    "json": JsonCodec,
+    "binary": BinaryCodec,
+}
+
+
+def get_codec(name, topology=DEFAULT_TOPOLOGY):
+    """return codec by name"""
+    return CODECS[name](topology)
+
+
+def add_codec_argument(parser):
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default="json",
+        help="encoding of events and package records, all processes must use the same codec",
+    )
+
+    return parser
+
+
+def get_codec_from_options(options, topology=DEFAULT_TOPOLOGY):
+    return get_codec(options.codec, topology)
@@ -0,0 +1,179 @@
+"""event_file - read, sort and split json event files, one event per line"""
+# files larger than memory are sorted by writing sorted runs of run_size bytes
+# to temporary files, then merging the runs. Runs and merges work on lines,
+# prefixed with a sort key, events are not decoded except to find the key
+
+import os
+import re
+import json
+import heapq
+import shutil
+import logging
+import tempfile
+
+READ_BLOCK_SIZE = 4 * 1024 * 1024  # bytes of input lines read at once
+RUN_SIZE = 64 * 1024 * 1024  # bytes of input lines sorted in memory at once
+MERGE_WIDTH = 64  # maximum number of run files merged at once
+SORTING_CENTER_FILE_NAME = "events-%s.json"
+
+# fields needed for routing are found without decoding the whole event, the
+# leading quote keeps next_sorting_center and next_event_time from matching
+SORTING_CENTER_PATTERN = re.compile(r'"sorting_center":\s*"([^"]*)"')
+PACKAGE_ID_PATTERN = re.compile(r'"package_id":\s*"([^"]*)"')
+EVENT_TIME_PATTERN = re.compile(r'"event_time":\s*([-+.0-9eE]+)')
+
+
+def read_event_lines(input_file, block_size=READ_BLOCK_SIZE):
+    """yield (sorting_center, package_id, event_time, line) for json input lines"""
+    search_sorting_center = SORTING_CENTER_PATTERN.search
+    search_package_id = PACKAGE_ID_PATTERN.search
+    search_event_time = EVENT_TIME_PATTERN.search
+    while 1:
+        lines = input_file.readlines(block_size)
+        if not lines:
+            return
+
+        for line in lines:
+            line = line.rstrip()
+            if not line:
+                continue
+            sorting_center = search_sorting_center(line)
+            package_id = search_package_id(line)
+            event_time = search_event_time(line)
+            if sorting_center and package_id and event_time:
+                yield (
+                    sorting_center.group(1),
+                    package_id.group(1),
+                    int(float(event_time.group(1))),
+                    line,
+                )
+            else:
+                # e.g. escaped characters, decode the event
+                event = json.loads(line)
+                yield (
+                    event["sorting_center"],
+                    event["package_id"],
+                    int(event["event_time"]),
+                    line,
+                )
+
+
+def sort_key(line):
+    """return line prefixed with a key that sorts by (event_time, sorting_center)"""
+    event_time = EVENT_TIME_PATTERN.search(line)
+    sorting_center = SORTING_CENTER_PATTERN.search(line)
+    if event_time and sorting_center:
+        event_time, sorting_center = (
+            float(event_time.group(1)),
+            sorting_center.group(1),
+        )
+    else:
+        event = json.loads(line)
+        event_time, sorting_center = event["event_time"], event["sorting_center"]
+    # space sorts before any sorting center code character, so A sorts before AA
+    return "%020.6f %s %s" % (event_time, sorting_center, line)
+
+
+def strip_sort_key(keyed_line):
+    """return (sorting_center, line) from a line prefixed by sort_key"""
+    _, sorting_center, line = keyed_line.split(" ", 2)
+    return sorting_center, line
+
+
+def write_runs(input_file, run_directory, run_size=RUN_SIZE):
+    """write sorted runs of keyed lines from input_file, return run file names"""
+    run_file_names = []
+    while 1:
+        keyed_lines = []
+        byte_count = 0
+        while byte_count < run_size:
+            lines = input_file.readlines(READ_BLOCK_SIZE)
+            if not lines:
+                break
+            for line in lines:
+                line = line.strip()
+                if line:
+                    keyed_lines.append(sort_key(line) + "\n")
+                    byte_count += len(line)
+        if not keyed_lines:
+            return run_file_names
+
+        keyed_lines.sort()
+        run_file_name = os.path.join(run_directory, "run-%06d" % len(run_file_names))
+        with open(run_file_name, "w") as run_file:
+            run_file.writelines(keyed_lines)
+        logging.debug("wrote run %s, %d events", run_file_name, len(keyed_lines))
+        run_file_names.append(run_file_name)
+
+
+def merge_runs(run_file_names, run_directory, merge_width=MERGE_WIDTH):
+    """merge runs until at most merge_width remain, return run file names"""
+    merge_count = 0
+    while len(run_file_names) > merge_width:
+        merged_file_names = []
+        for idx in range(0, len(run_file_names), merge_width):
+            merged_file_name = os.path.join(run_directory, "merge-%06d" % merge_count)
+            merge_count += 1
+            with open(merged_file_name, "w") as merged_file:
+                merged_file.writelines(
+                    merged_lines(run_file_names[idx : idx + merge_width])
+                )
+            merged_file_names.append(merged_file_name)
+        for run_file_name in run_file_names:
+            os.remove(run_file_name)
+        run_file_names = merged_file_names
+    return run_file_names
+
+
+def merged_lines(run_file_names):
+    """yield keyed lines from sorted run files, in order"""
+    run_files = [open(_, "r") for _ in run_file_names]
+    try:
+        for keyed_line in heapq.merge(*run_files):
+            yield keyed_line
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def sort_events(
+    input_file,
+    output_file=None,
+    output_directory=None,
+    run_size=RUN_SIZE,
+    merge_width=MERGE_WIDTH,
+    temporary_directory=None,
+):
+    """sort events in input_file by (event_time, sorting_center), return event count
+
+    sorted events are written to output_file or, if output_directory is set,
+    to one file per sorting center in output_directory
+    """
+    run_directory = tempfile.mkdtemp(prefix="event-sort-", dir=temporary_directory)
+    output_files = {}
+    event_count = 0
+    try:
+        run_file_names = write_runs(input_file, run_directory, run_size=run_size)
+        run_file_names = merge_runs(
+            run_file_names, run_directory, merge_width=merge_width
+        )
+        logging.debug("merging %d runs", len(run_file_names))
+        for keyed_line in merged_lines(run_file_names):
+            sorting_center, line = strip_sort_key(keyed_line)
+            if output_directory:
+                if sorting_center not in output_files:
+                    output_files[sorting_center] = open(
+                        os.path.join(
+                            output_directory, SORTING_CENTER_FILE_NAME % sorting_center
+                        ),
+                        "w",
+                    )
+                output_files[sorting_center].write(line)
+            else:
+                output_file.write(line)
+            event_count += 1
+    finally:
+        for sorting_center_file in output_files.values():
+            sorting_center_file.close()
+        shutil.rmtree(run_directory)
+    return event_count
@@ -1,69 +1,92 @@
 """import_events - import events from json file into pravega"""
 
 import sys
+import time
 import argparse
 import json
 import logging
+import operator
+import collections
 import cgitb
 
 
-from io.pravega.client.stream.impl import UTF8StringSerializer
-
 from pravega_interface import (
     streamConfiguration,
     streamManager,
     eventStreamClientFactory,
-    eventWriter,
+    eventWriters,
+    PayloadCodec,
 )
 
 from util import setup_logging, add_logging_argument
-from const import SORTING_CENTER_TO_STREAM_NAME, SORTING_CENTER_CODES
+from pacing import add_pacing_arguments, get_pacer_from_options
+from event_file import read_event_lines
+from event_codec import JsonCodec, add_codec_argument, get_codec_from_options
+from topology import (
+    add_topology_argument,
+    get_topology_from_options,
+    DEFAULT_TOPOLOGY,
+)
 from pravega_util import purge_scope, purge_redis
 from redis_util import add_redis_argparse_argument, get_redis_server_from_options
+from const import INPUT_STREAM_SEGMENT_COUNT
+from metrics import (
+    REGISTRY,
+    Throughput,
+    add_metrics_argument,
+    serve_metrics_from_options,
+)
 
 cgitb.enable(format="text")
 
+MAXIMUM_IN_FLIGHT = 1000  # unacknowledged writes per stream
+REPORT_INTERVAL = 10.0  # seconds between throughput reports
+
+throughput = Throughput("import_events")
+imported_bytes = REGISTRY.counter("import_events_bytes_total", "bytes of events read")
+
 
-def import_events(uri, scope, input_file):
-    """import stream of events into per sorting-center streams"""
-    serializer = UTF8StringSerializer()
+def import_events(
+    uri,
+    scope,
+    input_file,
+    topology=DEFAULT_TOPOLOGY,
+    pacer=None,
+    codec=None,
+    segments=INPUT_STREAM_SEGMENT_COUNT,
+):
+    """import stream of events into per sorting-center streams
+
+    if pacer is set, events are written in real time rather than as fast as possible.
+    codec is a PayloadCodec (default json). Streams that don't exist yet are
+    created with segments segments, events are routed to them by package_id
+    """
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    stream_names = topology.stream_names()
     with streamManager(uri=uri) as stream_manager:
         stream_manager.createScope(scope)
         with eventStreamClientFactory(uri, scope) as event_stream_client_factory:
             # ensure destination streams have already been created
-            create_streams(stream_manager, scope)
-            # ugly python to get context manager to work properly
-            # since contextlib.nested is deprecated
-            with eventWriter(
-                event_stream_client_factory,
-                SORTING_CENTER_TO_STREAM_NAME["A"],
-                serializer,
-            ) as stream_A, eventWriter(
-                event_stream_client_factory,
-                SORTING_CENTER_TO_STREAM_NAME["B"],
-                serializer,
-            ) as stream_B, eventWriter(
-                event_stream_client_factory,
-                SORTING_CENTER_TO_STREAM_NAME["C"],
-                serializer,
-            ) as stream_C, eventWriter(
-                event_stream_client_factory,
-                SORTING_CENTER_TO_STREAM_NAME["D"],
-                serializer,
-            ) as stream_D:
+            create_streams(stream_manager, scope, topology, segments)
+            with eventWriters(
+                event_stream_client_factory, stream_names.values(), codec.serializer
+            ) as event_writers:
                 sorting_center_to_stream_map = {
-                    "A": stream_A,
-                    "B": stream_B,
-                    "C": stream_C,
-                    "D": stream_D,
+                    sorting_center_code: event_writers[stream_name]
+                    for sorting_center_code, stream_name in stream_names.items()
                 }
                 last_event_time = write_to_streams(
-                    input_file, sorting_center_to_stream_map
+                    input_file,
+                    sorting_center_to_stream_map,
+                    pacer=pacer,
+                    # json lines are written as they are
+                    codec=codec if codec.binary else None,
                 )
 
                 # write a end of stream markers
                 last_event_time = last_event_time + 84600  # one day
-                for sorting_center_code in SORTING_CENTER_CODES:
+                for sorting_center_code in topology.sorting_center_codes:
                     event = {
                         "event_time": last_event_time,
                         "sorting_center": sorting_center_code,
@@ -71,32 +94,96 @@ def import_events(uri, scope, input_file):
                         "package_id": "none",
                     }
                     stream = sorting_center_to_stream_map[sorting_center_code]
-                    stream.writeEvent(event["package_id"], json.dumps(event))
+                    stream.writeEvent(event["package_id"], codec.encode_event(event))
+
 
+def write_to_streams(
+    input_file,
+    sorting_center_to_stream_map,
+    pacer=None,
+    maximum_in_flight=MAXIMUM_IN_FLIGHT,
+    codec=None,
+):
+    """route json input lines to the correct stream, return last event_time
 
-def write_to_streams(input_file, sorting_center_to_stream_map):
-    """parse json input file line-by-line, route to correct stream"""
+    lines are written as they are, without decoding and encoding the event,
+    unless codec is set. At most maximum_in_flight writes per stream are
+    waiting to be acknowledged
+    """
+    events = read_event_lines(input_file)
+    if pacer:
+        events = pacer.paced(events, event_time=operator.itemgetter(2))
+    in_flight = {_: collections.deque() for _ in sorting_center_to_stream_map}
+    REGISTRY.gauge(
+        "import_events_writes_in_flight",
+        "writes waiting to be acknowledged",
+        function=lambda: sum(len(_) for _ in in_flight.values()),
+    )
+    if pacer:
+        REGISTRY.gauge(
+            "import_events_pacing_lag_seconds",
+            "wall-clock seconds the import is behind its pace",
+            function=lambda: pacer.lag,
+        )
     last_event_time = None
-    while 1:
-        line = input_file.readline()
-        if not line:
-            return last_event_time
+    event_count = byte_count = 0
+    start_time = report_time = time.time()
+    report_event_count = report_byte_count = 0
+    for sorting_center, package_id, last_event_time, line in events:
+        futures = in_flight[sorting_center]
+        if len(futures) >= maximum_in_flight:
+            # wait for the oldest write to be acknowledged
+            futures.popleft().join()
+        futures.append(
+            sorting_center_to_stream_map[sorting_center].writeEvent(
+                package_id,
+                codec.encode_event(json.loads(line)) if codec else line,
+            )
+        )
+        event_count += 1
+        byte_count += len(line)
+        throughput.add(last_event_time)
+        imported_bytes.inc(len(line))
+        if not event_count % 10000:
+            now = time.time()
+            if now - report_time >= REPORT_INTERVAL:
+                report_throughput(
+                    now - report_time,
+                    event_count - report_event_count,
+                    byte_count - report_byte_count,
+                )
+                report_time = now
+                report_event_count, report_byte_count = event_count, byte_count
+
+    for sorting_center, stream in sorting_center_to_stream_map.items():
+        if last_event_time is not None:
+            stream.noteTime(last_event_time)  # this turned out to not be useful
+        stream.flush()
+        for future in in_flight[sorting_center]:
+            future.join()
+        in_flight[sorting_center].clear()
+    report_throughput(time.time() - start_time, event_count, byte_count, final=True)
+    return last_event_time
 
-        event = json.loads(line)
-        stream = sorting_center_to_stream_map[event["sorting_center"]]
-        last_event_time = int(event["event_time"])
-        stream.noteTime(last_event_time)  # this turned out to not be useful
-        stream.writeEvent(
-            event["package_id"], json.dumps(event)
-        )  # this appears to serialize to a rather large amount of data
 
+def report_throughput(elapsed_time, event_count, byte_count, final=False):
+    """log events/sec and bytes/sec"""
+    elapsed_time = elapsed_time or 1e-9
+    logging.info(
+        "%s %d events, %.0f events/sec, %.1f MB/sec",
+        "imported" if final else "importing",
+        event_count,
+        event_count / elapsed_time,
+        byte_count / elapsed_time / 1e6,
+    )
 
-def create_streams(stream_manager, scope):
+
+def create_streams(
+    stream_manager, scope, topology=DEFAULT_TOPOLOGY, segments=INPUT_STREAM_SEGMENT_COUNT
+):
     """create input streams as needed"""
-    stream_configuration = streamConfiguration(
-        scaling_policy=1
-    )  # might need to use different policy
-    for stream_name in SORTING_CENTER_TO_STREAM_NAME.values():
+    stream_configuration = streamConfiguration(scaling_policy=segments)
+    for stream_name in topology.stream_names().values():
         created = stream_manager.createStream(scope, stream_name, stream_configuration)
         logging.debug(
             "stream %s/%s %s",
@@ -123,6 +210,13 @@ def get_argument_parser():
         "-i", "--import_file", help="json file to import (- = stdin)", default=None,
     )
 
+    parser.add_argument(
+        "--segments",
+        type=int,
+        help="create sorting center input streams with this many segments",
+        default=INPUT_STREAM_SEGMENT_COUNT,
+    )
+
     parser.add_argument(
         "-p",
         "--purge_scope",
@@ -147,14 +241,23 @@ def main():
     parser = get_argument_parser()
     add_logging_argument(parser)
     add_redis_argparse_argument(parser)
+    add_topology_argument(parser)
+    add_pacing_arguments(parser)
+    add_codec_argument(parser)
+    add_metrics_argument(parser)
     args = parser.parse_args()
     setup_logging(args)
+    serve_metrics_from_options(args)
+    if args.speedup and args.events_per_second:
+        parser.error("use either --speedup or --events_per_second")
 
     if all((args.purge_scope, args.uri, args.scope)):
         purge_scope(uri=args.uri, scope=args.scope)
 
     if args.purge_redis and args.redis_server:
-        purge_redis(get_redis_server_from_options(args))
+        purge_redis(
+            get_redis_server_from_options(args), get_topology_from_options(args)
+        )
 
     if args.import_file:
         # import events from file
@@ -163,7 +266,16 @@ def main():
         else:
             input_file = open(args.import_file, "r")
 
-        import_events(uri=args.uri, scope=args.scope, input_file=input_file)
+        topology = get_topology_from_options(args)
+        import_events(
+            uri=args.uri,
+            scope=args.scope,
+            input_file=input_file,
+            topology=topology,
+            pacer=get_pacer_from_options(args, name="import_events"),
+            codec=PayloadCodec(get_codec_from_options(args, topology)),
+            segments=args.segments,
+        )
         return 0
     else:
         parser.print_help()
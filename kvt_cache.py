@@ -0,0 +1,274 @@
+"""kvt_cache - read-through, write-behind cache of kvt records"""
+# to be used from jython
+#
+# records are dicts, read from the kvt on first use and kept in a bounded lru
+# cache. Updates are applied to the cached record and the updated fields are
+# collected per key, so several updates of a record become one write. Pending
+# writes are sent when flush_size keys are pending or the oldest update is
+# flush_interval seconds old, without waiting for them. This is checked on each
+# get, prefetch and update, and by flush_if_due for events that use no record.
+# Writes are completed at the next flush, so one batch is in flight while the
+# next batch collects updates.
+#
+# prefetch starts reading a record that isn't cached, get waits for it. Records
+# of upcoming events can be prefetched, while earlier events are processed
+#
+# writes are conditional on the key version last read or written. If another
+# process changed the record meanwhile, the record is read again, the pending
+# fields are applied to it and the write is retried
+#
+# hits, misses, kvt reads, writes, conflicts and flush lag are kept in metrics,
+# labelled by the name of the cache, and logged every report_interval
+
+import time
+import logging
+import collections
+
+from java.util.concurrent import CompletionException
+
+from pravega_interface import conditionalUpdateFailed
+from metrics import REGISTRY
+
+CACHE_SIZE = 100000  # records
+FLUSH_SIZE = 100  # keys with pending updates written at once
+FLUSH_INTERVAL = 1.0  # wall-clock seconds an update may stay pending
+MAXIMUM_RETRIES = 10  # conflicting writes of one key before giving up
+REPORT_INTERVAL = 60.0  # wall-clock seconds between statistics reports
+
+
+class KeyValueTableCache:
+    """bounded lru cache of dict records in front of a kvt
+
+    encode and decode convert records to and from kvt values. Records returned
+    by get must not be modified, use update
+    """
+
+    def __init__(
+        self,
+        kvt_table,
+        encode,
+        decode,
+        cache_size=CACHE_SIZE,
+        flush_size=FLUSH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        report_interval=REPORT_INTERVAL,
+        name="kvt cache",
+    ):
+        self.kvt_table = kvt_table
+        self.encode = encode
+        self.decode = decode
+        self.cache_size = cache_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.logger = logging.getLogger(name)
+        self.records = collections.OrderedDict()  # key: record, least recent first
+        self.versions = {}  # key: kvt version of the record, None if not in kvt
+        self.loading = {}  # key: future of a prefetch read
+        self.pending = {}  # key: fields updated since the last write
+        self.pending_time = None  # wall-clock time of the oldest pending update
+        self.in_flight = []  # (key, fields, future) of the last flush
+        self.in_flight_time = None
+        self.start_time = self.report_time = time.time()
+        self.hits = REGISTRY.counter(
+            "kvt_cache_hits_total", "records found in the cache", cache=name
+        )
+        self.misses = REGISTRY.counter(
+            "kvt_cache_misses_total", "records not found in the cache", cache=name
+        )
+        self.reads = REGISTRY.counter(
+            "kvt_cache_reads_total", "records read from the kvt", cache=name
+        )
+        self.writes = REGISTRY.counter(
+            "kvt_cache_writes_total", "records written to the kvt", cache=name
+        )
+        self.conflicts = REGISTRY.counter(
+            "kvt_cache_conflicts_total",
+            "writes retried because another process changed the record",
+            cache=name,
+        )
+        # counters are shared by caches of the same name, report counts from here
+        self.report_counts = self.counts()
+        self.flush_lag = REGISTRY.gauge(
+            "kvt_cache_flush_lag_seconds",
+            "wall-clock seconds from the oldest update to its completed write, last flush",
+            cache=name,
+        )
+        self.flush_lag.set(0.0)
+        self.maximum_flush_lag = 0.0
+        REGISTRY.gauge(
+            "kvt_cache_pending_seconds",
+            "wall-clock seconds the oldest unwritten update is pending",
+            function=self.pending_age,
+            cache=name,
+        )
+        REGISTRY.gauge(
+            "kvt_cache_records",
+            "records in the cache",
+            function=lambda: len(self.records),
+            cache=name,
+        )
+
+    def get(self, key):
+        """return record for key, {} if there is none"""
+        self.flush_if_due()
+        record = self.records.pop(key, None)
+        if record is None:
+            self.misses.inc()
+            record = self.read(key)
+        else:
+            self.hits.inc()
+        self.records[key] = record
+        self.evict()
+        return record
+
+    def prefetch(self, key):
+        """start reading the record for key from the kvt, unless it is cached"""
+        self.flush_if_due()
+        if key not in self.records and key not in self.loading:
+            self.reads.inc()
+            self.loading[key] = self.kvt_table.get(None, key)
+
+    def update(self, key, fields):
+        """update fields of the record for key, written to the kvt later"""
+        record = self.records.get(key)
+        if record is None:
+            record = self.get(key)
+        record.update(fields)
+        self.pending.setdefault(key, {}).update(fields)
+        if self.pending_time is None:
+            self.pending_time = time.time()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """flush if flush_size keys are pending or the oldest update is due"""
+        if self.pending_time is None:
+            return
+        if (
+            len(self.pending) >= self.flush_size
+            or time.time() - self.pending_time >= self.flush_interval
+        ):
+            self.flush()
+
+    def pending_age(self):
+        """return wall-clock seconds since the oldest pending update, 0 if none"""
+        pending_time = self.pending_time
+        return 0.0 if pending_time is None else time.time() - pending_time
+
+    def flush(self, wait=False):
+        """complete the writes of the last flush and send pending updates
+
+        with wait, also complete the writes just sent
+        """
+        self.complete()
+        if self.pending:
+            self.in_flight = [
+                (key, fields, self.write(key)) for key, fields in self.pending.items()
+            ]
+            self.in_flight_time = self.pending_time
+            self.pending = {}
+            self.pending_time = None
+        if wait:
+            self.complete()
+        self.evict()
+        if time.time() - self.report_time >= self.report_interval:
+            self.report()
+
+    def close(self):
+        """write all pending updates"""
+        self.flush(wait=True)
+        self.report()
+
+    def read(self, key):
+        """return record for key from the kvt, remember its version"""
+        future = self.loading.pop(key, None)
+        if future is None:
+            self.reads.inc()
+            future = self.kvt_table.get(None, key)
+        entry = future.join()
+        if entry is None:
+            self.versions[key] = None
+            return {}
+        self.versions[key] = entry.getKey().getVersion()
+        return self.decode(entry.getValue())
+
+    def write(self, key):
+        """return future of a write of the cached record, conditional on its version"""
+        self.writes.inc()
+        value = self.encode(self.records[key])
+        version = self.versions.get(key)
+        if version is None:
+            return self.kvt_table.putIfAbsent(None, key, value)
+        return self.kvt_table.replace(None, key, value, version)
+
+    def complete(self):
+        """wait for writes in flight, retry writes that conflict"""
+        for key, fields, future in self.in_flight:
+            retries = 0
+            while True:
+                try:
+                    self.versions[key] = future.join()
+                    break
+                except CompletionException as error:
+                    if not conditionalUpdateFailed(error) or retries >= MAXIMUM_RETRIES:
+                        raise
+                # changed by another process, apply our updates to its record
+                retries += 1
+                self.conflicts.inc()
+                record = self.read(key)
+                record.update(fields)
+                record.update(self.pending.get(key, {}))
+                self.records[key] = record
+                future = self.write(key)
+
+        if self.in_flight:
+            flush_lag = time.time() - self.in_flight_time
+            self.flush_lag.set(flush_lag)
+            self.maximum_flush_lag = max(self.maximum_flush_lag, flush_lag)
+            self.in_flight = []
+
+    def evict(self):
+        """remove least recently used records beyond cache_size, except unwritten ones"""
+        excess = len(self.records) - self.cache_size
+        if excess <= 0:
+            return
+
+        in_flight = set(_[0] for _ in self.in_flight)
+        evicted = []
+        for key in self.records:
+            if key not in self.pending and key not in in_flight:
+                evicted.append(key)
+                if len(evicted) >= excess:
+                    break
+        for key in evicted:
+            del self.records[key]
+            del self.versions[key]
+
+    def counts(self):
+        """return hits, misses, reads, writes and conflicts counted so far"""
+        return [
+            _.value
+            for _ in (self.hits, self.misses, self.reads, self.writes, self.conflicts)
+        ]
+
+    def report(self):
+        """log hit rate, kvt operations and flush lag"""
+        now = time.time()
+        elapsed_time = now - self.start_time
+        hits, misses, reads, writes, conflicts = [
+            count - start_count
+            for count, start_count in zip(self.counts(), self.report_counts)
+        ]
+        lookups = hits + misses
+        self.logger.info(
+            "%d records, hit rate %.1f%%, %d reads %d writes %d conflicts, %.0f kvt ops/sec, flush lag %.2fs (maximum %.2fs)",
+            len(self.records),
+            100.0 * hits / lookups if lookups else 0,
+            reads,
+            writes,
+            conflicts,
+            (reads + writes) / elapsed_time if elapsed_time else 0,
+            self.flush_lag.value,
+            self.maximum_flush_lag,
+        )
+        self.report_time = now
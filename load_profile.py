@@ -0,0 +1,260 @@
+"""load_profile - package intake arrival rate profiles"""
+# a profile is the relative package arrival rate during the intake period. The
+# intake time of a package is found by inverting the cumulative arrival rate at
+# the package's position in the package id sequence, so it only depends on the
+# package id. That keeps generation streaming and lets shards of package ids be
+# generated independently.
+#
+# profiles are given on the command line as name:parameters, several profiles
+# joined with + are multiplied, e.g. a 5pm peak with random bursts:
+#
+#   diurnal:17,3+bursts:2,10,4
+
+import math
+import bisect
+import random
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+PROFILE_RESOLUTION = 60  # seconds, the arrival rate is constant within an interval
+
+
+class LoadProfile:
+    """uniform package arrival rate"""
+
+    def rates(self, start_time, interval_count, resolution=PROFILE_RESOLUTION):
+        """return list of relative arrival rates for consecutive intervals"""
+        return [1.0] * interval_count
+
+
+class PiecewiseProfile(LoadProfile):
+    """arrival rate that changes at given minutes after intake starts
+
+    points is a sequence of (minute, rate), the rate holds until the next point
+    """
+
+    def __init__(self, points):
+        self.points = sorted((float(minute), float(rate)) for minute, rate in points)
+        if not self.points or any(rate < 0 for _, rate in self.points):
+            raise ValueError("piecewise profile needs rates >= 0")
+
+    def rates(self, start_time, interval_count, resolution=PROFILE_RESOLUTION):
+        minutes = [minute for minute, _ in self.points]
+        result = []
+        for interval in range(interval_count):
+            point = bisect.bisect_right(
+                minutes, interval * resolution / float(SECONDS_PER_MINUTE)
+            )
+            result.append(self.points[max(point - 1, 0)][1])
+        return result
+
+
+class DiurnalProfile(LoadProfile):
+    """daily arrival rate cycle, peaking at peak_hour (utc)
+
+    the rate follows exp(k * cos(time of day)), k is chosen so that the
+    ratio of the peak rate to the mean rate over a day is peak_to_mean
+    """
+
+    def __init__(self, peak_hour=17, peak_to_mean=2.0):
+        if peak_to_mean < 1:
+            raise ValueError("peak_to_mean must be >= 1")
+        self.peak_hour = peak_hour
+        self.peak_to_mean = peak_to_mean
+        self.concentration = von_mises_concentration(peak_to_mean)
+
+    def rates(self, start_time, interval_count, resolution=PROFILE_RESOLUTION):
+        peak_time = self.peak_hour * SECONDS_PER_HOUR
+        return [
+            math.exp(
+                self.concentration
+                * math.cos(
+                    2
+                    * math.pi
+                    * (start_time + (interval + 0.5) * resolution - peak_time)
+                    / SECONDS_PER_DAY
+                )
+            )
+            for interval in range(interval_count)
+        ]
+
+
+class PoissonBurstProfile(LoadProfile):
+    """flat arrival rate with bursts starting at random (poisson process)
+
+    during a burst of burst_minutes the arrival rate is burst_factor times the
+    base rate. Bursts are drawn from random_seed, so every shard of a
+    simulation sees the same bursts
+    """
+
+    def __init__(
+        self, bursts_per_hour=1.0, burst_minutes=10, burst_factor=4.0, random_seed=0
+    ):
+        self.bursts_per_hour = bursts_per_hour
+        self.burst_minutes = burst_minutes
+        self.burst_factor = burst_factor
+        self.random_seed = random_seed
+
+    def rates(self, start_time, interval_count, resolution=PROFILE_RESOLUTION):
+        result = [1.0] * interval_count
+        random_source = random.Random(self.random_seed)
+        burst_intervals = max(
+            1, int(round(self.burst_minutes * SECONDS_PER_MINUTE / float(resolution)))
+        )
+        burst_time = 0.0
+        while self.bursts_per_hour > 0:
+            burst_time += random_source.expovariate(
+                self.bursts_per_hour / float(SECONDS_PER_HOUR)
+            )
+            first_interval = int(burst_time // resolution)
+            if first_interval >= interval_count:
+                break
+            for interval in range(
+                first_interval, min(first_interval + burst_intervals, interval_count)
+            ):
+                result[interval] = self.burst_factor
+        return result
+
+
+class ProductProfile(LoadProfile):
+    """product of several profiles"""
+
+    def __init__(self, profiles):
+        self.profiles = list(profiles)
+
+    def rates(self, start_time, interval_count, resolution=PROFILE_RESOLUTION):
+        result = [1.0] * interval_count
+        for profile in self.profiles:
+            result = [
+                a * b
+                for a, b in zip(
+                    result, profile.rates(start_time, interval_count, resolution)
+                )
+            ]
+        return result
+
+
+class IntakeSchedule:
+    """intake times for package_count packages arriving according to a profile"""
+
+    def __init__(
+        self,
+        profile,
+        start_time,
+        intake_run_time,
+        package_count,
+        resolution=PROFILE_RESOLUTION,
+    ):
+        self.start_time = start_time
+        self.resolution = resolution
+        self.package_count = package_count
+        self.intake_seconds = intake_seconds = intake_run_time * SECONDS_PER_MINUTE
+        interval_count = max(1, int(math.ceil(intake_seconds / float(resolution))))
+        self.rates = profile.rates(start_time, interval_count, resolution)
+        # cumulative arrivals at the start of each interval, the last interval
+        # may be shorter than resolution
+        self.cumulative = [0.0]
+        for interval, rate in enumerate(self.rates):
+            width = min(resolution, intake_seconds - interval * resolution)
+            self.cumulative.append(self.cumulative[-1] + rate * width)
+        if not self.cumulative[-1] > 0:
+            raise ValueError("load profile has no arrivals during intake")
+        self.arrivals_per_package = self.cumulative[-1] / package_count
+
+    def intake_time(self, package_index):
+        """return intake time of the package_index'th package (from 0)"""
+        target = package_index * self.arrivals_per_package
+        interval = bisect.bisect_right(self.cumulative, target) - 1
+        return (
+            self.start_time
+            + interval * self.resolution
+            + (target - self.cumulative[interval]) / self.rates[interval]
+        )
+
+    def peak_to_mean(self):
+        """return ratio of peak to mean arrival rate during intake"""
+        return max(self.rates) / (self.cumulative[-1] / self.intake_seconds)
+
+
+def von_mises_concentration(peak_to_mean):
+    """return k so that exp(k * cos(x)) has the given peak to mean ratio"""
+    # peak to mean is exp(k) / I0(k), which increases with k, solve by bisection
+    low, high = 0.0, 1.0
+    while von_mises_peak_to_mean(high) < peak_to_mean:
+        high *= 2
+    for _ in range(60):
+        middle = (low + high) / 2
+        if von_mises_peak_to_mean(middle) < peak_to_mean:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def von_mises_peak_to_mean(concentration):
+    """return exp(k) / I0(k), using the series for the bessel function I0"""
+    term = total = 1.0
+    k = 1
+    while term > total * 1e-16:
+        term *= (concentration / 2) ** 2 / (k * k)
+        total += term
+        k += 1
+    return math.exp(concentration) / total
+
+
+def parse_load_profile(spec, random_seed=0):
+    """return LoadProfile for a profile spec, or None for flat intake
+
+    flat
+    piecewise:MINUTE=RATE,MINUTE=RATE,...
+    diurnal:PEAK_HOUR,PEAK_TO_MEAN
+    bursts:BURSTS_PER_HOUR,BURST_MINUTES,BURST_FACTOR
+    """
+    profiles = []
+    for part in spec.split("+"):
+        name, _, parameters = part.strip().partition(":")
+        parameters = [_ for _ in parameters.split(",") if _]
+        if name == "flat":
+            continue
+        elif name == "piecewise":
+            if not all("=" in _ for _ in parameters):
+                raise ValueError("piecewise takes MINUTE=RATE,...")
+            profiles.append(
+                PiecewiseProfile([_.split("=", 1) for _ in parameters])
+            )
+        elif name == "diurnal":
+            if len(parameters) > 2:
+                raise ValueError("diurnal takes PEAK_HOUR,PEAK_TO_MEAN")
+            profiles.append(DiurnalProfile(*[float(_) for _ in parameters]))
+        elif name == "bursts":
+            if len(parameters) > 3:
+                raise ValueError(
+                    "bursts takes BURSTS_PER_HOUR,BURST_MINUTES,BURST_FACTOR"
+                )
+            profiles.append(
+                PoissonBurstProfile(
+                    *[float(_) for _ in parameters], random_seed=random_seed
+                )
+            )
+        else:
+            raise ValueError("unknown load profile %r" % name)
+    if not profiles:
+        return None
+    if len(profiles) == 1:
+        return profiles[0]
+    return ProductProfile(profiles)
+
+
+def add_load_profile_argument(parser):
+    parser.add_argument(
+        "--load_profile",
+        default="flat",
+        help="package intake rate, flat, piecewise:MINUTE=RATE,..., diurnal:PEAK_HOUR,PEAK_TO_MEAN or bursts:PER_HOUR,MINUTES,FACTOR, join with + to combine",
+    )
+
+    return parser
+
+
+def get_load_profile_from_options(options, random_seed=0):
+    return parse_load_profile(options.load_profile, random_seed=random_seed)
@@ -0,0 +1,373 @@
+"""metrics - counters, gauges and latency histograms served in prometheus text format"""
+#
+# metrics are kept in REGISTRY for the whole process. Updating one takes a
+# lock and an addition, so they are always kept, serving them on a local http
+# endpoint is optional (--metrics_port). Latencies of java futures are taken
+# when the future completes, without waiting for it
+
+import time
+import bisect
+import logging
+import threading
+import collections
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)  # seconds
+RATE_INTERVAL = 10.0  # wall-clock seconds events/sec is averaged over
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def add_metrics_argument(parser):
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="serve metrics in prometheus text format on this port, at /metrics",
+    )
+
+    parser.add_argument(
+        "--metrics_host",
+        default="127.0.0.1",
+        help="address the metrics endpoint listens on (127.0.0.1)",
+    )
+
+    return parser
+
+
+def serve_metrics_from_options(options):
+    if options.metrics_port:
+        return serve_metrics(options.metrics_port, options.metrics_host)
+
+    return None
+
+
+class Counter:
+    """a value that only goes up"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        return [(name, {}, self.value)]
+
+
+class Gauge:
+    """a value that is set, or returned by function when it is collected"""
+
+    def __init__(self, function=None):
+        self.value = None
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name):
+        value = self.function() if self.function else self.value
+        if value is None:
+            return []
+        return [(name, {}, value)]
+
+
+class Histogram:
+    """counts of observed values by bucket upper bound, their sum and count"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.sum += value
+
+    def samples(self, name):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            samples.append((name + "_bucket", {"le": bound}, cumulative))
+        samples.append((name + "_sum", {}, total))
+        samples.append((name + "_count", {}, cumulative))
+        return samples
+
+
+class Family:
+    """metrics of one name and type, one for each set of label values"""
+
+    def __init__(self, name, metric_type, help, collect=None):
+        self.name = name
+        self.metric_type = metric_type
+        self.help = help
+        self.collect = collect
+        self.metrics = collections.OrderedDict()
+
+    def samples(self):
+        if self.collect:
+            return [(self.name, labels, value) for labels, value in self.collect()]
+        samples = []
+        for labels, metric in list(self.metrics.items()):
+            for name, sample_labels, value in metric.samples(self.name):
+                merged = dict(labels)
+                merged.update(sample_labels)
+                samples.append((name, merged, value))
+        return samples
+
+
+class Registry:
+    """all metrics of a process, rendered in prometheus text format"""
+
+    def __init__(self):
+        self.families = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def metric(self, name, metric_type, help, labels, create):
+        """return the metric of name with labels, created by create() if new"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = Family(name, metric_type, help)
+            elif family.metric_type != metric_type:
+                raise ValueError("metric %s is a %s" % (name, family.metric_type))
+            metric = family.metrics.get(key)
+            if metric is None:
+                metric = family.metrics[key] = create()
+            return metric
+
+    def counter(self, name, help, **labels):
+        return self.metric(name, "counter", help, labels, Counter)
+
+    def gauge(self, name, help, function=None, **labels):
+        """return gauge of name with labels, a new function replaces an earlier one"""
+        gauge = self.metric(name, "gauge", help, labels, Gauge)
+        if function:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self.metric(
+            name, "histogram", help, labels, lambda: Histogram(buckets)
+        )
+
+    def collector(self, name, metric_type, help, collect):
+        """add metrics returned by collect() as (labels, value) when rendered"""
+        with self.lock:
+            self.families[name] = Family(name, metric_type, help, collect)
+
+    def render(self):
+        """return all metrics in prometheus text format"""
+        lines = []
+        for family in list(self.families.values()):
+            lines.append("# HELP %s %s" % (family.name, family.help))
+            lines.append("# TYPE %s %s" % (family.name, family.metric_type))
+            for name, labels, value in family.samples():
+                lines.append(
+                    "%s%s %s" % (name, format_labels(labels), format_value(value))
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, format_label_value(value))
+        for name, value in sorted(labels.items())
+    )
+
+
+def format_label_value(value):
+    if isinstance(value, float):
+        return format_value(value)
+    return (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Rate:
+    """events/sec of a counter, averaged over at least the last interval seconds"""
+
+    def __init__(self, counter, interval=RATE_INTERVAL):
+        self.counter = counter
+        self.interval = interval
+        self.samples = collections.deque([(time.time(), counter.value)])
+
+    def __call__(self):
+        now = time.time()
+        self.samples.append((now, self.counter.value))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.interval:
+            self.samples.popleft()
+        start_time, start_value = self.samples[0]
+        if now <= start_time:
+            return 0.0
+        return (self.counter.value - start_value) / (now - start_time)
+
+
+class Throughput:
+    """events processed by a process: count, events/sec and event-time lag"""
+
+    def __init__(self, prefix, registry=REGISTRY):
+        self.events = registry.counter(prefix + "_events_total", "events processed")
+        self.event_time = registry.gauge(
+            prefix + "_event_time_seconds", "event_time of the latest event processed"
+        )
+        registry.gauge(
+            prefix + "_events_per_second",
+            "events processed per wall-clock second, over %ds" % RATE_INTERVAL,
+            function=Rate(self.events),
+        )
+        registry.gauge(
+            prefix + "_event_time_lag_seconds",
+            "wall-clock time less event_time of the latest event processed",
+            function=self.lag,
+        )
+
+    def add(self, event_time, count=1):
+        self.events.inc(count)
+        self.event_time.set(event_time)
+
+    def lag(self):
+        if self.event_time.value is None:
+            return None
+        return time.time() - self.event_time.value
+
+
+def counted(events, counter, batched=False):
+    """yield events, counted by counter, batches of events if batched"""
+    for event in events:
+        counter.inc(len(event) if batched else 1)
+        yield event
+
+
+class TimedCalls:
+    """proxy of target, timing its method calls in a histogram labelled by method
+
+    methods are the names of the methods timed, all of them if None. The
+    results of the methods in result_methods are proxied in turn, timing the
+    methods it names, e.g. sync of a redis pipeline
+    """
+
+    def __init__(
+        self, target, name, help, methods=None, result_methods=None, **labels
+    ):
+        self.target = target
+        self.name = name
+        self.help = help
+        self.methods = methods
+        self.result_methods = result_methods or {}
+        self.labels = labels
+
+    def __getattr__(self, method):
+        attribute = getattr(self.target, method)
+        if method in self.result_methods:
+            attribute = self.proxied(attribute, self.result_methods[method])
+        elif self.methods is None or method in self.methods:
+            attribute = self.timed(
+                attribute,
+                REGISTRY.histogram(self.name, self.help, method=method, **self.labels),
+            )
+        # later calls find it without __getattr__
+        setattr(self, method, attribute)
+        return attribute
+
+    def timed(self, function, histogram):
+        def timed(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                histogram.observe(time.time() - start)
+
+        return timed
+
+    def proxied(self, function, methods):
+        def proxied(*args):
+            return self.__class__(
+                function(*args), self.name, self.help, methods, **self.labels
+            )
+
+        return proxied
+
+
+class TimedFutures(TimedCalls):
+    """proxy of target whose methods return java futures, timed until completion"""
+
+    def timed(self, function, histogram):
+        def timed(*args):
+            start = time.time()
+            future = function(*args)
+            future.whenComplete(
+                lambda result, error: histogram.observe(time.time() - start)
+            )
+            return future
+
+        return timed
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """answer any GET with the metrics of the registry of the server"""
+
+    def do_GET(self):
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger("metrics").debug(format, *args)
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """serve registry over http on a daemon thread, return the server"""
+    server = HTTPServer((host, port), MetricsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name="metrics")
+    thread.daemon = True
+    thread.start()
+    logging.getLogger("metrics").info(
+        "serving metrics on http://%s:%d/metrics", host, server.server_port
+    )
+    return server
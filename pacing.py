@@ -0,0 +1,114 @@
+"""pacing - emit events against wall-clock time for load testing"""
+
+import time
+import logging
+import operator
+
+REPORT_INTERVAL = 10.0  # wall-clock seconds between rate reports
+MINIMUM_SLEEP_TIME = 0.001  # don't bother sleeping for less than this
+
+
+def add_pacing_arguments(parser):
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=None,
+        help="replay events in real time, this many times faster than event_time (e.g. 1, 10, 100)",
+    )
+
+    parser.add_argument(
+        "--events_per_second",
+        type=float,
+        default=None,
+        help="replay events at this fixed rate",
+    )
+
+    return parser
+
+
+def get_pacer_from_options(options, name="replay"):
+    if options.speedup or options.events_per_second:
+        return Pacer(
+            speedup=options.speedup,
+            events_per_second=options.events_per_second,
+            name=name,
+        )
+
+    return None
+
+
+class Pacer:
+    """pace a stream of events at a speedup of event_time, or at a fixed rate
+
+    the achieved rate and the lag behind schedule are logged every
+    report_interval seconds. Lag grows when whatever consumes the events
+    cannot keep up with the requested rate
+    """
+
+    def __init__(
+        self,
+        speedup=None,
+        events_per_second=None,
+        report_interval=REPORT_INTERVAL,
+        name="replay",
+    ):
+        if bool(speedup) == bool(events_per_second):
+            raise ValueError("pace by either speedup or events_per_second")
+        self.speedup = speedup
+        self.events_per_second = events_per_second
+        self.report_interval = report_interval
+        self.logger = logging.getLogger(name)
+        self.event_count = 0
+        self.lag = 0.0
+        self.maximum_lag = 0.0
+
+    def paced(self, events, event_time=operator.itemgetter("event_time")):
+        """yield events, no earlier than their scheduled wall-clock time
+
+        event_time returns the event_time of an event
+        """
+        start_time = None
+        first_event_time = None
+        report_time = None
+        report_event_count = 0
+        for event in events:
+            now = time.time()
+            if start_time is None:
+                start_time = report_time = now
+                first_event_time = event_time(event)
+
+            if self.speedup:
+                scheduled_time = (
+                    start_time + (event_time(event) - first_event_time) / self.speedup
+                )
+            else:
+                scheduled_time = start_time + self.event_count / self.events_per_second
+
+            if scheduled_time - now >= MINIMUM_SLEEP_TIME:
+                time.sleep(scheduled_time - now)
+                self.lag = 0.0
+            else:
+                self.lag = max(0.0, now - scheduled_time)
+                self.maximum_lag = max(self.maximum_lag, self.lag)
+
+            yield event
+            self.event_count += 1
+
+            if now - report_time >= self.report_interval:
+                self.report(now - report_time, self.event_count - report_event_count)
+                report_time = now
+                report_event_count = self.event_count
+
+        if start_time is not None:
+            self.report(time.time() - start_time, self.event_count, final=True)
+
+    def report(self, elapsed_time, event_count, final=False):
+        """log achieved rate and lag"""
+        self.logger.info(
+            "%s %d events at %.0f events/sec, lag %.2fs (maximum %.2fs)",
+            "replayed" if final else "replaying",
+            event_count,
+            event_count / elapsed_time if elapsed_time else 0,
+            self.lag,
+            self.maximum_lag,
+        )
@@ -1,10 +1,12 @@
 """utilities for working with pravega"""
 # to be used from jython
+import array
 import contextlib
 import uuid
 
 
 from java.net import URI
+from java.util.concurrent import CompletionException
 from io.pravega.client import ClientConfig
 from io.pravega.client.stream import Stream
 from io.pravega.client.admin import StreamManager
@@ -19,14 +21,21 @@ from io.pravega.client.stream import StreamConfiguration
 
 from io.pravega.client.stream import EventStreamWriter
 from io.pravega.client.stream import EventWriterConfig
+from io.pravega.client.stream.impl import UTF8StringSerializer
+from io.pravega.client.stream.impl import ByteArraySerializer
 
 from io.pravega.client.admin import KeyValueTableManager
 from io.pravega.client.tables import (
     KeyValueTableClientConfiguration,
     KeyValueTableConfiguration,
+    ConditionalTableUpdateException,
 )
 from io.pravega.client import KeyValueTableFactory
 
+from metrics import TimedFutures
+
+KVT_METHODS = ("get", "put", "putIfAbsent", "replace")  # timed kvt requests
+
 
 @contextlib.contextmanager
 def streamManager(uri):
@@ -39,6 +48,12 @@ def streamManager(uri):
             stream_manager.close()
 
 
+def streamSegmentCount(stream_manager, scope, stream_name):
+    """return the number of segments a stream has now"""
+    stream_info = stream_manager.getStreamInfo(scope, stream_name).join()
+    return len(stream_info.getTailStreamCut().asImpl().getPositions())
+
+
 def streamConfiguration(scaling_policy=1):
     """return a stream configuration object"""
     stream_config = StreamConfiguration.builder()
@@ -73,17 +88,37 @@ def readerGroupManager(uri, scope):
 
 
 @contextlib.contextmanager
-def readerGroup(reader_group_manager, scope, stream_name, reader_group_name=None):
-    """return a ReaderGroup context"""
-    reader_group_config = (
-        ReaderGroupConfig.builder().stream(Stream.of(scope, stream_name)).build()
-    )
+def readerGroup(
+    reader_group_manager,
+    scope,
+    stream_name,
+    reader_group_name=None,
+    start_stream_cut=None,
+    reset=False,
+):
+    """return a ReaderGroup context, reading from start_stream_cut if set
+
+    with reset, an existing reader group of that name is reset to read from
+    start_stream_cut, readers of a previous process are removed from it
+    """
+    if start_stream_cut is None:
+        reader_group_config = (
+            ReaderGroupConfig.builder().stream(Stream.of(scope, stream_name)).build()
+        )
+    else:
+        reader_group_config = (
+            ReaderGroupConfig.builder()
+            .stream(Stream.of(scope, stream_name), start_stream_cut)
+            .build()
+        )
     if reader_group_name is None:
         reader_group_name = str(uuid.uuid4()).replace("-", "")
     try:
         reader_group = None
         reader_group_manager.createReaderGroup(reader_group_name, reader_group_config)
         reader_group = reader_group_manager.getReaderGroup(reader_group_name)
+        if reset:
+            reader_group.resetReaderGroup(reader_group_config)
         yield reader_group
     finally:
         if reader_group:
@@ -115,12 +150,41 @@ def eventWriter(clientFactory, stream_name, serializer):
         event_writer = clientFactory.createEventWriter(
             stream_name, serializer, EventWriterConfig.builder().build()
         )
-        yield event_writer
+        yield timedEventWriter(event_writer, stream_name)
     finally:
         if event_writer:
             event_writer.close()
 
 
+@contextlib.contextmanager
+def eventWriters(clientFactory, stream_names, serializer):
+    """create an event writer for each stream, yields dict of stream name to writer"""
+    event_writers = {}
+    try:
+        for stream_name in stream_names:
+            event_writers[stream_name] = clientFactory.createEventWriter(
+                stream_name, serializer, EventWriterConfig.builder().build()
+            )
+        yield {
+            stream_name: timedEventWriter(event_writer, stream_name)
+            for stream_name, event_writer in event_writers.items()
+        }
+    finally:
+        for event_writer in event_writers.values():
+            event_writer.close()
+
+
+def timedEventWriter(event_writer, stream_name):
+    """return event_writer, the latency of its writes kept in metrics"""
+    return TimedFutures(
+        event_writer,
+        "stream_write_seconds",
+        "stream write latency",
+        methods=("writeEvent",),
+        stream=stream_name,
+    )
+
+
 @contextlib.contextmanager
 def keyValueTableManager(uri):
     """create a kvt table manager"""
@@ -167,7 +231,67 @@ def keyValueTable(kvt_factory, table_name, key_serializer, value_serializer):
             value_serializer,
             KeyValueTableClientConfiguration.builder().build(),
         )
-        yield kvt_table
+        yield TimedFutures(
+            kvt_table,
+            "kvt_request_seconds",
+            "kvt request latency",
+            methods=KVT_METHODS,
+            table=table_name,
+        )
     finally:
         if kvt_table:
             kvt_table.close()
+
+
+def keyFamilyEntries(kvt_table, key_family, batch_size=100):
+    """yield all entries of a kvt key family, in no particular order"""
+    iterator = kvt_table.entryIterator(key_family, batch_size, None)
+    while True:
+        item = iterator.getNext().join()
+        if item is None:
+            return
+        for entry in item.getItems():
+            yield entry
+
+
+def conditionalUpdateFailed(exception):
+    """return True if a kvt future failed because the key version didn't match"""
+    if isinstance(exception, CompletionException):
+        exception = exception.getCause()
+    return isinstance(exception, ConditionalTableUpdateException)
+
+
+class PayloadCodec:
+    """event_codec codec with the matching pravega serializer
+
+    binary codecs use ByteArraySerializer, encoded data is converted to and from
+    java byte arrays
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.binary = codec.binary
+        if codec.binary:
+            self.serializer = ByteArraySerializer()
+        else:
+            self.serializer = UTF8StringSerializer()
+
+    def payload(self, data):
+        """return encoded data as a payload for serializer"""
+        if self.binary:
+            return array.array("b", data)
+        return data
+
+    def encode_event(self, event):
+        return self.payload(self.codec.encode_event(event))
+
+    def encode_package_attributes(self, package_attributes):
+        return self.payload(self.codec.encode_package_attributes(package_attributes))
+
+    def encode_package_events(self, package_events):
+        return self.payload(self.codec.encode_package_events(package_events))
+
+    def decode(self, payload):
+        if self.binary:
+            payload = payload.tostring()
+        return self.codec.decode(payload)
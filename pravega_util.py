@@ -11,7 +11,15 @@ from pravega_interface import (
     keyValueTableManager,
 )
 
-from const import ALL_REDIS_KEYS
+from const import (
+    REDIS_PACKAGE_NEXT_EVENT_KEY_NAME,
+    REDIS_WATERMARK_KEY_NAME,
+    REDIS_WATERMARK_WAITING_KEY_NAME,
+    REDIS_WATERMARK_WAKE_KEY_NAME,
+    REDIS_LATE_PACKAGE_HASH_NAME,
+    REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
+)
+from topology import DEFAULT_TOPOLOGY, add_topology_argument, get_topology_from_options
 
 from util import setup_logging, add_logging_argument
 from redis_util import add_redis_argparse_argument, get_redis_server_from_options
@@ -64,9 +72,27 @@ def purge_scope(uri, scope):
         # will have to figure out later how to directly catch NoSuchScopeException
         pass
 
-def purge_redis(redis):
-    """clear redis data structures"""
-    for redis_key_name in ALL_REDIS_KEYS:
+def redis_key_names(topology=DEFAULT_TOPOLOGY):
+    """return names of all redis keys of the sorting centers of topology"""
+    sorting_center_key_names = tuple(
+        key_name % sorting_center_code
+        for key_name in (
+            REDIS_PACKAGE_NEXT_EVENT_KEY_NAME,
+            REDIS_WATERMARK_WAKE_KEY_NAME,
+        )
+        for sorting_center_code in topology.sorting_center_codes
+    )
+    return sorting_center_key_names + (
+        REDIS_WATERMARK_KEY_NAME,
+        REDIS_WATERMARK_WAITING_KEY_NAME,
+        REDIS_LATE_PACKAGE_HASH_NAME,
+        REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
+    )
+
+
+def purge_redis(redis, topology=DEFAULT_TOPOLOGY):
+    """clear redis data structures of the sorting centers of topology"""
+    for redis_key_name in redis_key_names(topology):
         redis.del(redis_key_name)
         logging.debug("deleted key %r from redis", redis_key_name)
 
@@ -76,6 +102,7 @@ def main():
     parser = get_argument_parser()
     add_logging_argument(parser)
     add_redis_argparse_argument(parser)
+    add_topology_argument(parser)
     args = parser.parse_args()
     setup_logging(args)
 
@@ -85,7 +112,9 @@ def main():
         handled_params = True
         
     if args.purge_redis and args.redis_server:
-        purge_redis(get_redis_server_from_options(args))
+        purge_redis(
+            get_redis_server_from_options(args), get_topology_from_options(args)
+        )
         handled_params = True
 
     if not handled_params:
@@ -1,5 +1,7 @@
 import sys
 
+from metrics import TimedCalls
+
 if "java" in sys.platform:
     from redis.clients.jedis import Jedis
 
@@ -25,8 +27,15 @@ def get_redis_server_from_options(options):
             redis_info["port"] = int(redis_host_port[1])
 
         if is_java:
-            return Jedis(redis_info["host"], redis_info["port"])
+            redis = Jedis(redis_info["host"], redis_info["port"])
         else:
-            return Redis(**redis_info)
+            redis = Redis(**redis_info)
+        # pipelines are timed when they are sent
+        return TimedCalls(
+            redis,
+            "redis_request_seconds",
+            "redis request latency",
+            result_methods={"pipelined": ("sync",), "pipeline": ("execute",)},
+        )
 
     return None
@@ -0,0 +1,524 @@
+"""simulator_batch - vectorized package barcode scan simulator for large package counts"""
+# requires numpy, so this only runs on cpython. Events are computed as columns for
+# whole blocks of packages and only turned into dicts or json at the output edge.
+# json lines are assembled as bytes by numpy, all lines with the same layout (step
+# and digits of each number) at once, without a python loop per event. The lines
+# of a block are grouped by layout, not in package order
+
+import numpy
+
+from simulator_core import (
+    Simulator,
+    SECONDS_PER_MINUTE,
+    STEP_INTAKE,
+    STEP_WEIGHING,
+    STEP_TRUCK,
+    STEP_FINAL,
+    merge_event_sources,
+)
+
+# number columns of an EventBlock in the order they appear in json events
+JSON_COLUMNS = (
+    "event_time",
+    "package_id",
+    "next_event_time",
+    "declared_value",
+    "weight",
+    "estimated_delivery_time",
+)
+STEP_JSON_COLUMNS = {
+    STEP_INTAKE: (
+        "event_time",
+        "package_id",
+        "next_event_time",
+        "declared_value",
+        "estimated_delivery_time",
+    ),
+    STEP_WEIGHING: ("event_time", "package_id", "next_event_time", "weight"),
+    STEP_FINAL: ("event_time", "package_id"),
+}  # other steps have event_time, package_id and next_event_time
+POWERS_OF_TEN = 10 ** numpy.arange(19, dtype=numpy.int64)  # up to the largest int64
+DIGIT_CHUNK = 5  # most digits converted to ascii at once, by table lookup
+DIGIT_CHUNKS = [None] + [
+    (
+        numpy.arange(10 ** _)[:, None] // 10 ** numpy.arange(_ - 1, -1, -1) % 10
+        + ord("0")
+    ).astype(numpy.uint8)
+    for _ in range(1, DIGIT_CHUNK + 1)
+]  # by digit count, zero padded ascii digits of each value with that many digits
+ROW_CHUNK = 4096  # json lines assembled at once, so that they stay in cache
+
+
+class BatchSimulator(Simulator):
+    """package barcode scan simulator that generates blocks of packages at once
+
+    produces the same events, with the same statistical distribution, as
+    Simulator.event_source. Random draws for origin, destination, jitter,
+    declared value and weight are made as arrays for block_size packages at a time
+    """
+
+    def __init__(self, block_size=100000, **kwargs):
+        Simulator.__init__(self, **kwargs)
+        self.block_size = block_size
+        self.package_random = numpy.random.default_rng(self.package_random_seed)
+        self.build_route_tables()
+        self.build_delay_tables()
+
+    def build_route_tables(self):
+        """build per-route step arrays, indexed by route * maximum_route_steps + step"""
+        sorting_center_codes = self.topology.sorting_center_codes
+        center_count = len(sorting_center_codes)
+        route_count = center_count * center_count
+        self.maximum_route_steps = max(len(_.steps) for _ in self.routes.values())
+        shape = (route_count, self.maximum_route_steps)
+        self.route_step_count = numpy.zeros(route_count, dtype=numpy.int64)
+        self.route_estimated_delivery = numpy.zeros(route_count, dtype=numpy.float64)
+        self.route_truck_time = numpy.zeros(route_count, dtype=numpy.float64)
+        self.step_travel_time = numpy.zeros(shape, dtype=numpy.float64)
+        self.step_kind = numpy.full(shape, STEP_FINAL, dtype=numpy.int64)
+        self.steps = [None] * (route_count * self.maximum_route_steps)
+        self.truck_step_indexes = set()
+        # json text of each step around the numbers of JSON_COLUMNS, see
+        # step_json_literals. Unused steps have no columns
+        self.step_json_literals = [(None,) * len(JSON_COLUMNS) + (b"",)] * len(
+            self.steps
+        )
+
+        for origin_index, origin in enumerate(sorting_center_codes):
+            for destination_index, destination in enumerate(sorting_center_codes):
+                route = origin_index * center_count + destination_index
+                route_info = self.routes[(origin, destination)]
+                self.route_step_count[route] = len(route_info.steps)
+                self.route_estimated_delivery[
+                    route
+                ] = route_info.estimated_delivery_offset
+                self.route_truck_time[route] = route_info.truck_travel_time
+                for step_index, route_step in enumerate(route_info.steps):
+                    step = dict(route_step._asdict(), destination=destination)
+                    if route_step.kind == STEP_TRUCK:
+                        step["travel_time"] = 0
+                        step["next_sorting_center"] = destination
+                        self.truck_step_indexes.add(step_index)
+                    self.step_travel_time[route, step_index] = step["travel_time"]
+                    self.step_kind[route, step_index] = route_step.kind
+                    self.steps[route * self.maximum_route_steps + step_index] = step
+                    self.step_json_literals[
+                        route * self.maximum_route_steps + step_index
+                    ] = step_json_literals(step)
+        # True where a step has a json column
+        self.step_json_columns = numpy.array(
+            [
+                [_ is not None for _ in literals[:-1]]
+                for literals in self.step_json_literals
+            ],
+            dtype=bool,
+        )
+
+    def build_delay_tables(self):
+        """convert lost_or_delayed_package_map into sorted arrays"""
+        package_ids = sorted(int(_) for _ in self.lost_or_delayed_package_map)
+        infos = [self.lost_or_delayed_package_map[str(_)] for _ in package_ids]
+        self.delayed_package_ids = numpy.array(package_ids, dtype=numpy.int64)
+        self.delayed_event_index = numpy.array(
+            [_["event_index"] for _ in infos], dtype=numpy.int64
+        )
+        self.delayed_is_lost = numpy.array(
+            [_["type"] == "lost" for _ in infos], dtype=bool
+        )
+        self.delayed_offset = numpy.array(
+            [_["delay"] for _ in infos], dtype=numpy.int64
+        )
+
+    def event_blocks(self):
+        """yield an EventBlock for each block of packages"""
+        for first_package_id in range(
+            self.first_package_id, self.end_package_id, self.block_size
+        ):
+            yield self.simulate_block(
+                first_package_id,
+                min(first_package_id + self.block_size, self.end_package_id),
+            )
+
+    def event_source(self):
+        """yield barcode scanning events for packages"""
+        for event_block in self.event_blocks():
+            for event in event_block.events():
+                yield event
+
+    def ordered_event_source(self):
+        """yield barcode scanning events for all packages in event_time order"""
+        return merge_event_sources(
+            (event_block.start_time, event_block.ordered_events())
+            for event_block in self.event_blocks()
+        )
+
+    def json_lines(self):
+        """yield blocks of json encoded events, one event per line"""
+        for event_block in self.event_blocks():
+            yield event_block.json_lines()
+
+    def write_json_lines(self, output_file):
+        """write json encoded events to binary output_file, return the event count"""
+        event_count = 0
+        for event_block in self.event_blocks():
+            output_file.write(event_block.json_bytes())
+            event_count += len(event_block)
+        return event_count
+
+    def package_intake_time(self, package_ids):
+        """return intake time for an array of package ids"""
+        schedule = self.intake_schedule
+        if schedule is None:
+            return (
+                self.simulated_start_time + (package_ids - 1) * self.seconds_per_package
+            )
+
+        cumulative = numpy.array(schedule.cumulative)
+        rates = numpy.array(schedule.rates)
+        target = (package_ids - 1) * schedule.arrivals_per_package
+        interval = numpy.searchsorted(cumulative, target, side="right") - 1
+        return (
+            schedule.start_time
+            + interval * schedule.resolution
+            + (target - cumulative[interval]) / rates[interval]
+        )
+
+    def simulate_block(self, first_package_id, end_package_id):
+        """return an EventBlock for package ids first_package_id to end_package_id - 1"""
+        random = self.package_random
+        center_count = len(self.topology)
+        maximum_route_steps = self.maximum_route_steps
+        package_ids = numpy.arange(first_package_id, end_package_id, dtype=numpy.int64)
+        package_count = len(package_ids)
+        origin = random.integers(0, center_count, package_count)
+        destination = random.integers(0, center_count, package_count)
+        route = origin * center_count + destination
+        declared_value = random.integers(10, 101, package_count)
+        weight = random.integers(1, 41, package_count)
+        jitter = random.integers(
+            0,
+            SECONDS_PER_MINUTE + 1,
+            (maximum_route_steps, package_count),
+            dtype=numpy.int32,
+        )
+
+        # one row per step, one column per package
+        travel_time = self.step_travel_time.T[:, route]
+        route_step_count = self.route_step_count[route]
+        intake_time = self.package_intake_time(package_ids)
+        event_time = numpy.empty((maximum_route_steps, package_count))
+        next_event_time = numpy.empty((maximum_route_steps, package_count))
+        emitted = numpy.empty((maximum_route_steps, package_count), dtype=bool)
+        in_flight = numpy.ones(package_count, dtype=bool)
+        step_time = intake_time
+        for step_index in range(maximum_route_steps):
+            event_time[step_index] = step_time
+            numpy.less(step_index, route_step_count, out=emitted[step_index])
+            emitted[step_index] &= in_flight
+            next_time = step_time + travel_time[step_index]
+            # next actual scan is always earlier than the expected scan time
+            step_time = next_time - jitter[step_index]
+            if step_index in self.truck_step_indexes:
+                # the truck to the next sorting center leaves at the next
+                # departure, packages on a truck arrive at the same time
+                is_truck = self.step_kind[route, step_index] == STEP_TRUCK
+                truck_arrival_time = (
+                    self.truck_departure_interval
+                    * (
+                        numpy.floor(
+                            event_time[step_index] / self.truck_departure_interval
+                        )
+                        + 1
+                    )
+                    + self.route_truck_time[route]
+                )
+                receiving_time = truck_arrival_time
+                if self.truck_unload_time:
+                    receiving_time = truck_arrival_time + random.integers(
+                        0, self.truck_unload_time + 1, package_count
+                    )
+                next_time = numpy.where(
+                    is_truck, truck_arrival_time + self.truck_unload_time, next_time
+                )
+                step_time = numpy.where(is_truck, receiving_time, step_time)
+                # packages stop once the simulation ends, except while on a truck
+                in_flight &= is_truck | (step_time < self.simulated_end_time)
+            else:
+                in_flight &= step_time < self.simulated_end_time
+            next_event_time[step_index] = next_time
+
+        # back to one row per package, in package order
+        emitted = emitted.T
+        event_time = event_time.T.astype(numpy.int64)
+        next_event_time = next_event_time.T.astype(numpy.int64)
+
+        # delay or lose selected packages after their event_index event
+        delayed = numpy.searchsorted(self.delayed_package_ids, package_ids)
+        delayed_mask = delayed < len(self.delayed_package_ids)
+        delayed_mask[delayed_mask] = (
+            self.delayed_package_ids[delayed[delayed_mask]]
+            == package_ids[delayed_mask]
+        )
+        if delayed_mask.any():
+            rows = numpy.nonzero(delayed_mask)[0]
+            delayed = delayed[rows]
+            after_index = (
+                numpy.arange(maximum_route_steps)
+                > self.delayed_event_index[delayed][:, None]
+            )
+            lost = self.delayed_is_lost[delayed]
+            emitted[rows] &= ~(after_index & lost[:, None])
+            offset = after_index * self.delayed_offset[delayed][:, None]
+            event_time[rows] += offset
+            next_event_time[rows] += offset
+
+        rows, step_index = numpy.nonzero(emitted)
+        return EventBlock(
+            simulator=self,
+            start_time=float(intake_time[0]),
+            package_id=package_ids[rows],
+            step=route[rows] * maximum_route_steps + step_index,
+            event_time=event_time[rows, step_index],
+            next_event_time=next_event_time[rows, step_index],
+            declared_value=declared_value[rows],
+            weight=weight[rows],
+            estimated_delivery_time=(
+                self.route_estimated_delivery[route] + intake_time
+            ).astype(numpy.int64)[rows],
+        )
+
+
+class EventBlock:
+    """columns of events for a block of packages, in package order"""
+
+    def __init__(
+        self,
+        simulator,
+        start_time,
+        package_id,
+        step,
+        event_time,
+        next_event_time,
+        declared_value,
+        weight,
+        estimated_delivery_time,
+    ):
+        self.simulator = simulator
+        self.start_time = start_time
+        self.package_id = package_id
+        self.step = step
+        self.event_time = event_time
+        self.next_event_time = next_event_time
+        self.declared_value = declared_value
+        self.weight = weight
+        self.estimated_delivery_time = estimated_delivery_time
+
+    def __len__(self):
+        return len(self.step)
+
+    def events(self, order=None):
+        """yield events as dicts"""
+        if order is None:
+            columns = (
+                self.package_id,
+                self.step,
+                self.event_time,
+                self.next_event_time,
+                self.declared_value,
+                self.weight,
+                self.estimated_delivery_time,
+            )
+        else:
+            columns = (
+                self.package_id[order],
+                self.step[order],
+                self.event_time[order],
+                self.next_event_time[order],
+                self.declared_value[order],
+                self.weight[order],
+                self.estimated_delivery_time[order],
+            )
+        steps = self.simulator.steps
+        for (
+            package_id,
+            step,
+            event_time,
+            next_event_time,
+            declared_value,
+            weight,
+            estimated_delivery_time,
+        ) in zip(*[_.tolist() for _ in columns]):
+            step = steps[step]
+            kind = step["kind"]
+            event = {
+                "sorting_center": step["sorting_center"],
+                "event_time": event_time,
+                "package_id": str(package_id),
+                "scanner_id": step["scanner_id"],
+            }
+            if kind != STEP_FINAL:
+                event["next_scanner_id"] = step["next_scanner_id"]
+                event["next_event_time"] = next_event_time
+            if kind == STEP_INTAKE:
+                event["declared_value"] = declared_value
+                event["destination"] = step["destination"]
+                event["estimated_delivery_time"] = estimated_delivery_time
+            elif kind == STEP_WEIGHING:
+                event["weight"] = weight
+            elif kind == STEP_TRUCK:
+                event["next_sorting_center"] = step["next_sorting_center"]
+            yield event
+
+    def ordered_events(self):
+        """yield events as dicts in event_time order"""
+        return self.events(order=numpy.argsort(self.event_time, kind="stable"))
+
+    def json_lines(self):
+        """return events as json, one event per line, see json_bytes"""
+        return self.json_bytes().tobytes().decode("ascii")
+
+    def json_bytes(self):
+        """return events as json, one event per line, in a numpy array of bytes
+
+        lines are the same as json.dumps(event) of events(), grouped by layout:
+        the step and the digits of each number. The lines of a layout are
+        assembled at once, a template line is copied to every row and the digits
+        of the numbers are written over it, ROW_CHUNK rows at a time
+        """
+        event_count = len(self)
+        if not event_count:
+            return numpy.empty(0, dtype=numpy.uint8)
+        columns = [getattr(self, _) for _ in JSON_COLUMNS]
+        step_json_columns = self.simulator.step_json_columns
+        # the numbers of a column mostly have the same digits, the layout only
+        # depends on the columns where they don't
+        layout = self.step.astype(numpy.int64)
+        digit_counts = []
+        for column_index, column in enumerate(columns):
+            minimum_digits = len(str(int(column.min())))
+            maximum_digits = len(str(int(column.max())))
+            if minimum_digits == maximum_digits:
+                digit_counts.append(minimum_digits)
+                continue
+            extra_digits = numpy.searchsorted(
+                POWERS_OF_TEN[minimum_digits:maximum_digits], column, side="right"
+            )
+            # the digits don't matter for steps without the column
+            extra_digits *= step_json_columns[:, column_index][self.step]
+            digit_counts.append(minimum_digits + extra_digits)
+            layout = layout * (maximum_digits - minimum_digits + 1) + extra_digits
+        if layout.max() <= numpy.iinfo(numpy.uint16).max:
+            # stable sorts of 16 bit integers are radix sorts
+            layout = layout.astype(numpy.uint16)
+        order = numpy.argsort(layout, kind="stable")
+        layout = layout[order]
+        group_starts = (numpy.flatnonzero(layout[1:] != layout[:-1]) + 1).tolist()
+        groups = [
+            (start, end) + self.json_template(order[start], digit_counts)
+            for start, end in zip([0] + group_starts, group_starts + [event_count])
+        ]
+        lines = numpy.empty(
+            sum((end - start) * len(template) for start, end, template, _ in groups),
+            dtype=numpy.uint8,
+        )
+        offset = 0
+        for start, end, template, numbers in groups:
+            group = lines[offset : offset + (end - start) * len(template)].reshape(
+                end - start, len(template)
+            )
+            offset += group.size
+            pieces = [
+                (number_offset + piece_offset, digits)
+                for column_index, number_offset, digit_count in numbers
+                for piece_offset, digits in ascii_digits(
+                    columns[column_index][order[start:end]], digit_count
+                )
+            ]
+            for row in range(0, end - start, ROW_CHUNK):
+                rows = group[row : row + ROW_CHUNK]
+                rows[:] = template
+                for piece_offset, digits in pieces:
+                    rows[:, piece_offset : piece_offset + digits.shape[1]] = digits[
+                        row : row + ROW_CHUNK
+                    ]
+        return lines
+
+    def json_template(self, row, digit_counts):
+        """return the json line of the event at row with zero digits, and its numbers
+
+        numbers are (column index, offset, digit count) of the numbers in the line
+        """
+        literals = self.simulator.step_json_literals[self.step[row]]
+        pieces = []
+        numbers = []
+        offset = 0
+        for column_index, literal in enumerate(literals[:-1]):
+            if literal is None:
+                continue
+            digit_count = digit_counts[column_index]
+            if isinstance(digit_count, numpy.ndarray):
+                digit_count = int(digit_count[row])
+            offset += len(literal)
+            numbers.append((column_index, offset, digit_count))
+            offset += digit_count
+            pieces.extend((literal, b"0" * digit_count))
+        pieces.append(literals[-1])
+        return numpy.frombuffer(b"".join(pieces), dtype=numpy.uint8), numbers
+
+
+def ascii_digits(numbers, digit_count):
+    """return non-negative numbers as ascii digits, digit_count for each number
+
+    in pieces of up to DIGIT_CHUNK digits, (offset, digits with one row per number)
+    """
+    pieces = []
+    end = digit_count
+    while end > 0:
+        start = max(end - DIGIT_CHUNK, 0)
+        if start:
+            numbers, chunk = numpy.divmod(numbers, 10 ** DIGIT_CHUNK)
+        else:
+            chunk = numbers
+        pieces.append((start, DIGIT_CHUNKS[end - start].take(chunk, axis=0)))
+        end = start
+    return pieces
+
+
+def step_json_format(step):
+    """return a % format string that produces the same json as json.dumps(event)"""
+    kind = step["kind"]
+    result = '{"sorting_center": "%s", "event_time": %%d, "package_id": "%%d", "scanner_id": "%s"' % (
+        step["sorting_center"],
+        step["scanner_id"],
+    )
+    if kind != STEP_FINAL:
+        result += ', "next_scanner_id": "%s", "next_event_time": %%d' % (
+            step["next_scanner_id"],
+        )
+    if kind == STEP_INTAKE:
+        result += ', "declared_value": %%d, "destination": "%s", "estimated_delivery_time": %%d' % (
+            step["destination"],
+        )
+    elif kind == STEP_WEIGHING:
+        result += ', "weight": %d'
+    elif kind == STEP_TRUCK:
+        result += ', "next_sorting_center": "%s"' % (step["next_sorting_center"],)
+    return result + "}"
+
+
+def step_json_literals(step):
+    """return the json text of an event at step around its numbers
+
+    one literal before each of JSON_COLUMNS, None if the event does not have
+    that column, and the text after the last number, including the newline.
+    Joined with the numbers, the same json as json.dumps(event)
+    """
+    columns = STEP_JSON_COLUMNS.get(
+        step["kind"], ("event_time", "package_id", "next_event_time")
+    )
+    texts = iter(step_json_format(step).split("%d"))
+    literals = [
+        next(texts).encode("ascii") if _ in columns else None for _ in JSON_COLUMNS
+    ]
+    return tuple(literals) + ((next(texts) + "\n").encode("ascii"),)
+
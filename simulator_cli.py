@@ -8,8 +8,14 @@ import sys
 import argparse
 import time
 import json
+import random
+import logging
 
 from util import setup_logging, add_logging_argument
+from topology import add_topology_argument, get_topology_from_options
+from pacing import add_pacing_arguments, get_pacer_from_options
+from load_profile import add_load_profile_argument, get_load_profile_from_options
+from event_file import sort_events
 
 from simulator_core import Simulator
 
@@ -57,6 +63,20 @@ def get_argument_parser():
         help="total number of packages to be lost enroute (must be less than delayed_package_count)",
     )
 
+    parser.add_argument(
+        "--truck_interval",
+        type=int,
+        default=60,
+        help="minutes between truck departures to other sorting centers",
+    )
+
+    parser.add_argument(
+        "--unload_time",
+        type=int,
+        default=0,
+        help="minutes to unload a truck, packages reach receiving spread over this time",
+    )
+
     parser.add_argument(
         "-t",
         "--test",
@@ -70,6 +90,77 @@ def get_argument_parser():
         "-j", "--json_output", help="output json", action="store_true", default=False,
     )
 
+    parser.add_argument(
+        "-o",
+        "--ordered",
+        help="output events in event_time order (no external sort needed)",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="use the vectorized batch simulator (requires numpy)",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=100000,
+        help="number of packages simulated at once by the batch simulator",
+    )
+
+    parser.add_argument(
+        "--start_time",
+        type=int,
+        default=0,
+        help="simulated start time (unix timestamp, default is now)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="random seed, the same seed and start_time reproduce the same events",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=0,
+        help="generate events with this many processes, output is in event_time order",
+    )
+
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=250000,
+        help="number of packages generated by a worker at once",
+    )
+
+    parser.add_argument(
+        "--output_directory",
+        default=None,
+        help="write json events to one file per sorting center in this directory (requires --workers or --sort_file)",
+    )
+
+    parser.add_argument(
+        "--sort_file",
+        default=None,
+        help="sort json events in this file (- = stdin) by event_time and sorting center, write to stdout",
+    )
+
+    parser.add_argument(
+        "--run_size",
+        type=int,
+        default=64,
+        help="MB of events sorted in memory at once by --sort_file",
+    )
+
     return parser
 
 
@@ -77,22 +168,97 @@ def main():
     """main"""
     parser = get_argument_parser()
     add_logging_argument(parser)
+    add_topology_argument(parser)
+    add_pacing_arguments(parser)
+    add_load_profile_argument(parser)
     args = parser.parse_args()
     setup_logging(args)
+    if args.speedup and args.events_per_second:
+        parser.error("use either --speedup or --events_per_second")
+    if args.workers and (args.speedup or args.events_per_second):
+        parser.error("--workers can't be used with --speedup or --events_per_second")
+    if args.workers and args.output_directory and not args.json_output:
+        parser.error("--output_directory requires -j with --workers")
+
+    if args.sort_file:
+        if args.sort_file == "-":
+            input_file = sys.stdin
+        else:
+            input_file = open(args.sort_file, "r")
+        event_count = sort_events(
+            input_file,
+            output_file=sys.stdout,
+            output_directory=args.output_directory,
+            run_size=args.run_size * 1024 * 1024,
+        )
+        logging.info("sorted %d events", event_count)
 
-    if args.test_simulator:
+    elif args.test_simulator:
+        pacer = get_pacer_from_options(args, name="simulator")
+        if pacer:
+            # real time replay needs events in event_time order
+            args.ordered = True
         # read the scope/stream from uri
-        simulator = Simulator(
+        if args.seed is None:
+            args.seed = random.randint(0, 2 ** 31)
+        logging.info("random seed %d", args.seed)
+        try:
+            load_profile = get_load_profile_from_options(args, random_seed=args.seed)
+        except ValueError as e:
+            parser.error("--load_profile: %s" % e)
+        simulator_arguments = dict(
             simulated_run_time=args.simulated_run_time,
             intake_run_time=args.intake_run_time,
             package_count=args.package_count,
-            simulated_start_time=int(time.time()),
+            simulated_start_time=args.start_time or int(time.time()),
             lost_package_count=args.lost_package_count,
             delayed_package_count=args.delayed_package_count,
+            random_seed=args.seed,
+            topology=get_topology_from_options(args),
+            load_profile=load_profile,
+            truck_departure_interval=args.truck_interval,
+            truck_unload_time=args.unload_time,
         )
-        for event in simulator.event_source():
+        if args.workers:
+            from simulator_parallel import generate_events
+
+            generate_events(
+                simulator_arguments,
+                output_file=sys.stdout,
+                workers=args.workers,
+                shard_size=args.shard_size,
+                batch=args.batch,
+                block_size=args.block_size,
+                output_directory=args.output_directory,
+                json_output=args.json_output,
+            )
+            return 0
+
+        if args.batch:
+            from simulator_batch import BatchSimulator  # requires numpy
+
+            simulator = BatchSimulator(
+                block_size=args.block_size, **simulator_arguments
+            )
+            if args.json_output and not args.ordered:
+                # skip building dicts, write json assembled from columns
+                sys.stdout.flush()
+                simulator.write_json_lines(getattr(sys.stdout, "buffer", sys.stdout))
+                return 0
+        else:
+            simulator = Simulator(**simulator_arguments)
+
+        if args.ordered:
+            event_source = simulator.ordered_event_source()
+        else:
+            event_source = simulator.event_source()
+        if pacer:
+            event_source = pacer.paced(event_source)
+        for event in event_source:
             if args.json_output:
                 sys.stdout.write("%s\n" % json.dumps(event))
+                if pacer:
+                    sys.stdout.flush()
             else:
                 print("%r" % event)
 
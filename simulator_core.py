@@ -2,106 +2,122 @@
 import time
 import random
 import logging
+import heapq
+import collections
 
-from const import SORTING_CENTER_CODES
+from topology import DEFAULT_TOPOLOGY
+from load_profile import IntakeSchedule
 
 
 SECONDS_PER_MINUTE = 60
 SECONDS_PER_HOUR = 3600
 
-TRUCK_TRAVEL_TIMES = {
-    ("A", "A"): 0,
-    ("A", "B"): 1440,
-    ("A", "C"): 1440 * 2,
-    ("A", "D"): 1440 * 5,
-    ("B", "A"): 1440,
-    ("B", "B"): 0,
-    ("B", "C"): 1440,
-    ("B", "D"): 1440 * 5,
-    ("C", "A"): 1440 * 2,
-    ("C", "B"): 1440,
-    ("C", "C"): 0,
-    ("C", "D"): 1440 * 5,
-    ("D", "A"): 1440 * 5,
-    ("D", "B"): 1440 * 5,
-    ("D", "C"): 1440 * 5,
-    ("D", "D"): 0,
-}
 
-
-class SortingCenter:
-    """information about sorting center scanner arrangement"""
-
-    # travel_time is in minutes
-    PATH_FROM = {
+def random_conveyor_paths(random_source):
+    """return path_from and path_to with randomly drawn travel times between scanners"""
+    # travel_time is in seconds
+    path_from = {
         "intake": [
             # {
             #     "next": "intake",
-            #     "travel_time": random.randint(2, 5) * SECONDS_PER_MINUTE,
+            #     "travel_time": random_source.randint(2, 5) * SECONDS_PER_MINUTE,
             # },
             {
                 "next": "weighing",
-                "travel_time": random.randint(2, 5) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(2, 5) * SECONDS_PER_MINUTE,
             },
             {
                 "next": "pre-routing",
-                "travel_time": random.randint(2, 5) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(2, 5) * SECONDS_PER_MINUTE,
             },
             {
                 "next": "routing",
-                "travel_time": random.randint(5, 10) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(5, 10) * SECONDS_PER_MINUTE,
             },
         ],
         "receiving": [
             # {
             #     "next": "receiving",
-            #     "travel_time": random.randint(2, 5) * SECONDS_PER_MINUTE,
+            #     "travel_time": random_source.randint(2, 5) * SECONDS_PER_MINUTE,
             # },
             {
                 "next": "pre-routing",
-                "travel_time": random.randint(2, 5) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(2, 5) * SECONDS_PER_MINUTE,
             },
             {
                 "next": "routing",
-                "travel_time": random.randint(5, 10) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(5, 10) * SECONDS_PER_MINUTE,
             },
         ],
     }
-    PATH_TO = {
+    path_to = {
         "output": [
             {
                 "next": "output",
-                "travel_time": random.randint(5, 15) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(5, 15) * SECONDS_PER_MINUTE,
             },
             {"next": None, "travel_time": 0,},
         ],
         "holding": [
             {
                 "next": "holding",
-                "travel_time": random.randint(5, 15) * SECONDS_PER_MINUTE,
+                "travel_time": random_source.randint(5, 15) * SECONDS_PER_MINUTE,
             },
         ],
     }
+    return path_from, path_to
+
+
+def shard_random_seed(random_seed, shard_index):
+    """return a reproducible random seed for one shard of package ids"""
+    return random_seed * 1000003 + shard_index
+
+
+# route step kinds
+STEP_INTAKE = 0
+STEP_WEIGHING = 1
+STEP_SCAN = 2
+STEP_TRUCK = 3  # holding area scan, next scan is receiving at destination
+STEP_FINAL = 4  # output scan, there is no next scan
+
+# one scan of a package on its way from origin to destination
+RouteStep = collections.namedtuple(
+    "RouteStep", "sorting_center scanner_id next_scanner_id travel_time kind"
+)
 
-    INTAKE_TIME = sum(_["travel_time"] for _ in PATH_FROM["intake"])
-    RECEIVING_TIME = sum(_["travel_time"] for _ in PATH_FROM["receiving"])
-    OUTPUT_TIME = sum(_["travel_time"] for _ in PATH_TO["output"])
-    HOLDING_TIME = sum(_["travel_time"] for _ in PATH_TO["holding"])
+# precompiled scan steps between an origin and destination sorting center
+# estimated_delivery_offset is the estimated delivery time after intake,
+# truck_travel_time is in seconds
+Route = collections.namedtuple(
+    "Route", "origin destination steps truck_travel_time estimated_delivery_offset"
+)
 
-    def __init__(self, name="A"):
+
+class SortingCenter:
+    """information about sorting center scanner arrangement"""
+
+    def __init__(self, name="A", path_from=None, path_to=None):
         self.name = name
+        if path_from is None or path_to is None:
+            path_from, path_to = random_conveyor_paths(random)
+        self.path_from = path_from
+        self.path_to = path_to
+        self.intake_time = sum(_["travel_time"] for _ in path_from["intake"])
+        self.receiving_time = sum(_["travel_time"] for _ in path_from["receiving"])
+        self.output_time = sum(_["travel_time"] for _ in path_to["output"])
+        self.holding_time = sum(_["travel_time"] for _ in path_to["holding"])
 
     def package_path(self, origin, destination):
         """yield events between origin an destination"""
         origin_scanner = "intake" if origin == self.name else "receiving"
-        for path_info in self.PATH_FROM[origin_scanner]:
+        for path_info in self.path_from[origin_scanner]:
             yield path_info
 
         if destination == self.name:
-            for path_info in self.PATH_TO["output"]:
+            for path_info in self.path_to["output"]:
                 yield path_info
         else:
-            for path_info in self.PATH_TO["holding"]:
+            for path_info in self.path_to["holding"]:
                 if path_info["next"] == "holding":
                     path_info = path_info.copy()
                     path_info["next"] = "holding_%s" % destination
@@ -121,6 +137,19 @@ class Simulator:
     e.g. if the simulated_time is 1440 minutes and the runtime is 300 seconds
     then over the course of 5 minutes events simulating one day's worth of
     package scans will be generated
+
+    the sorting center layout and selection of lost or delayed packages are
+    drawn from random_seed, a seed is generated and logged if it is None.
+    When shard_size is set, only package ids in
+    shard shard_index are generated, using a random sequence specific to
+    that shard, so shards can be generated in parallel and reproduced exactly.
+    Packages draw from the sequence in package_id order, so ordered_event_source
+    yields the same events as event_source
+
+    packages arrive evenly over intake_run_time, or according to load_profile.
+    Trucks to other sorting centers leave every truck_departure_interval
+    minutes, packages on a truck reach receiving spread over truck_unload_time
+    minutes after it arrives
     """
 
     def __init__(
@@ -131,7 +160,32 @@ class Simulator:
         simulated_start_time=0,
         delayed_package_count=0,
         lost_package_count=0,
+        random_seed=None,
+        shard_index=0,
+        shard_size=None,
+        topology=None,
+        load_profile=None,
+        truck_departure_interval=60,
+        truck_unload_time=0,
     ):
+        self.topology = topology or DEFAULT_TOPOLOGY
+        if random_seed is None:
+            # shard seeds are derived from random_seed, log it to reproduce the run
+            random_seed = random.randint(0, 2 ** 31)
+            logging.info("random seed %d", random_seed)
+        self.random_seed = random_seed
+        self.random = random.Random(random_seed)
+        if shard_size:
+            self.first_package_id = shard_index * shard_size + 1
+            self.end_package_id = min(
+                self.first_package_id + shard_size, package_count + 1
+            )
+            self.package_random_seed = shard_random_seed(random_seed, shard_index)
+        else:
+            self.first_package_id = 1
+            self.end_package_id = package_count + 1
+            self.package_random_seed = random_seed
+        self.package_random = random.Random(self.package_random_seed)
         if not simulated_start_time:
             simulated_start_time = int(time.time())
         self.simulated_start_time = simulated_start_time
@@ -142,6 +196,20 @@ class Simulator:
             float(intake_run_time * SECONDS_PER_MINUTE) / package_count
         )  # time between package creation events
         self.package_count = package_count
+        if load_profile is None:
+            self.intake_schedule = None
+        else:
+            self.intake_schedule = IntakeSchedule(
+                load_profile,
+                start_time=self.simulated_start_time,
+                intake_run_time=intake_run_time,
+                package_count=package_count,
+            )
+            logging.debug(
+                "intake peak to mean ratio %.2f", self.intake_schedule.peak_to_mean()
+            )
+        self.truck_departure_interval = truck_departure_interval * SECONDS_PER_MINUTE
+        self.truck_unload_time = truck_unload_time * SECONDS_PER_MINUTE
         logging.debug(
             "start_time %r end_time %r duration %r package_count %r seconds_per_package %r",
             self.simulated_start_time,
@@ -150,7 +218,18 @@ class Simulator:
             self.package_count,
             self.seconds_per_package,
         )
-        self.sorting_centers = {_: SortingCenter(name=_) for _ in SORTING_CENTER_CODES}
+        # sorting centers without a configured layout share one, drawn once
+        shared_conveyor_paths = random_conveyor_paths(self.random)
+        self.sorting_centers = {}
+        for sorting_center_code in self.topology.sorting_center_codes:
+            path_from, path_to = (
+                self.topology.conveyor_layout(sorting_center_code)
+                or shared_conveyor_paths
+            )
+            self.sorting_centers[sorting_center_code] = SortingCenter(
+                name=sorting_center_code, path_from=path_from, path_to=path_to
+            )
+        self.routes = self.build_routes()
         self.lost_or_delayed_package_map = self.generate_lost_or_delayed_packages(
             package_count=package_count,
             lost_package_count=lost_package_count,
@@ -161,154 +240,219 @@ class Simulator:
         """yield barcode scanning events for packages"""
         # initial naive approach is to generate all events for each package
         # individually, sort all events, then inject them into Pravega
+        # see ordered_event_source for events in event_time order
+        for package_id, event_time in self.package_intake_times():
+            for event in self.package_events(package_id, event_time):
+                yield event
 
+    def ordered_event_source(self):
+        """yield barcode scanning events for all packages in event_time order"""
+        return merge_event_sources(
+            (event_time, self.package_events(package_id, event_time))
+            for package_id, event_time in self.package_intake_times()
+        )
+
+    def package_intake_times(self):
+        """yield package_id and intake time for each package"""
         # generated packages need to be spread out over the simulated run time
-        event_time = float(self.simulated_start_time)
-        for package_id in range(1, self.package_count + 1):
-            package_id = str(package_id)
-            lost_or_delay_info = self.lost_or_delayed_package_map.get(package_id)
-            delay_offset = 0
-            for event_index, event in enumerate(
-                self.package_lifecycle(event_time=event_time, package_id=package_id)
-            ):
-                event["event_time"] += delay_offset
-                if "next_event_time" in event:
-                    event["next_event_time"] += delay_offset
-                yield event
-                if (
-                    lost_or_delay_info
-                    and lost_or_delay_info["event_index"] == event_index
-                ):
-                    logging.debug(
-                        "delay or lose package_id %r before scanner_id %r type %r",
-                        package_id,
-                        event.get("next_scanner_id"),
-                        lost_or_delay_info["type"],
-                    )
-                    # delay this package or lose it
-                    if lost_or_delay_info["type"] == "lost":
-                        # lose the package
-                        break
-                    # just delay it
-                    delay_offset = lost_or_delay_info["delay"]
-                    lost_or_delay_info = None
+        if self.intake_schedule:
+            intake_time = self.intake_schedule.intake_time
+            for package_id in range(self.first_package_id, self.end_package_id):
+                yield str(package_id), intake_time(package_id - 1)
+            return
+
+        for package_id in range(self.first_package_id, self.end_package_id):
+            yield str(package_id), (
+                self.simulated_start_time + (package_id - 1) * self.seconds_per_package
+            )
 
-            event_time += self.seconds_per_package
+    def package_events(self, package_id, event_time):
+        """yield events for one package, delayed or lost as selected"""
+        lost_or_delay_info = self.lost_or_delayed_package_map.get(package_id)
+        delay_offset = 0
+        for event_index, event in enumerate(
+            self.package_lifecycle(event_time=event_time, package_id=package_id)
+        ):
+            event["event_time"] += delay_offset
+            if "next_event_time" in event:
+                event["next_event_time"] += delay_offset
+            yield event
+            if lost_or_delay_info and lost_or_delay_info["event_index"] == event_index:
+                logging.debug(
+                    "delay or lose package_id %r before scanner_id %r type %r",
+                    package_id,
+                    event.get("next_scanner_id"),
+                    lost_or_delay_info["type"],
+                )
+                # delay this package or lose it
+                if lost_or_delay_info["type"] == "lost":
+                    # lose the package
+                    return
+                # just delay it
+                delay_offset = lost_or_delay_info["delay"]
+                lost_or_delay_info = None
 
     def package_lifecycle(self, event_time, package_id):
         """generate lifecycle of one package"""
-        origin = random.choice(SORTING_CENTER_CODES)
-        destination = random.choice(SORTING_CENTER_CODES)
-
-        current_scanner = "intake"
-        for path_info in self.sorting_centers[origin].package_path(origin, destination):
-            next_event_time = event_time + path_info["travel_time"]
-            result = {
-                "sorting_center": origin,
-                "event_time": int(event_time),
-                "package_id": package_id,
-                "scanner_id": current_scanner,
-                "next_scanner_id": path_info["next"],
-                "next_event_time": int(next_event_time),
-            }
-            if current_scanner == "intake":
-                result["declared_value"] = random.randint(10, 100)
-                result["destination"] = destination
-                result["estimated_delivery_time"] = int(
-                    self.get_travel_time(origin, destination) + event_time
+        # lifecycles are interleaved in ordered_event_source, but each one is
+        # started in package_id order. Drawing every random value before the
+        # first event keeps the draws of a package the same as in event_source
+        randint = self.package_random.randint
+        origin = self.package_random.choice(self.topology.sorting_center_codes)
+        destination = self.package_random.choice(self.topology.sorting_center_codes)
+        route = self.routes[(origin, destination)]
+        declared_value = randint(10, 100)
+        weight = randint(1, 40)
+        unload_time = self.truck_unload_time and randint(0, self.truck_unload_time)
+        # scan times are earlier than expected by up to a minute
+        early_times = [randint(0, SECONDS_PER_MINUTE) for _ in route.steps]
+
+        for step, early_time in zip(route.steps, early_times):
+            sorting_center, scanner_id, next_scanner_id, travel_time, kind = step
+            if kind == STEP_FINAL:
+                yield {
+                    "sorting_center": sorting_center,
+                    "event_time": int(event_time),
+                    "package_id": package_id,
+                    "scanner_id": scanner_id,
+                }
+            elif kind == STEP_TRUCK:
+                # the truck to the next sorting center will be loaded at the next
+                # departure, by default the top of the hour. there's no scan event
+                # for that, but that's when the truck will leave. All packages on
+                # this truck arrive at the same time and are unloaded together
+                whole, _ = divmod(event_time, self.truck_departure_interval)
+                truck_arrival_time = (
+                    self.truck_departure_interval * (whole + 1)
+                    + route.truck_travel_time
                 )
-            elif current_scanner == "weighing":
-                result["weight"] = random.randint(1, 40)
-            elif not result["next_scanner_id"]:
-                del result["next_event_time"]
-                del result["next_scanner_id"]
-            yield result
+                receiving_event_time = truck_arrival_time + unload_time
+                yield {
+                    "sorting_center": sorting_center,
+                    "event_time": int(event_time),
+                    "package_id": package_id,
+                    "scanner_id": scanner_id,
+                    "next_scanner_id": next_scanner_id,
+                    "next_event_time": int(
+                        truck_arrival_time + self.truck_unload_time
+                    ),
+                    "next_sorting_center": destination,
+                }
+                event_time = receiving_event_time
+                continue
+            else:
+                result = {
+                    "sorting_center": sorting_center,
+                    "event_time": int(event_time),
+                    "package_id": package_id,
+                    "scanner_id": scanner_id,
+                    "next_scanner_id": next_scanner_id,
+                    "next_event_time": int(event_time + travel_time),
+                }
+                if kind == STEP_INTAKE:
+                    result["declared_value"] = declared_value
+                    result["destination"] = destination
+                    result["estimated_delivery_time"] = int(
+                        route.estimated_delivery_offset + event_time
+                    )
+                elif kind == STEP_WEIGHING:
+                    result["weight"] = weight
+                yield result
+
             # set time for next actual scan, must always be less than
             # expected scan time
-            event_time = next_event_time - random.randint(0, SECONDS_PER_MINUTE)
+            event_time = event_time + travel_time - early_time
             if event_time >= self.simulated_end_time:
                 return
 
-            current_scanner = path_info["next"]
-
-        truck_travel_time = TRUCK_TRAVEL_TIMES[(origin, destination)]
-        if not truck_travel_time:
-            # package is delivered, no further routing is needed
-            return
-
-        # the truck to the next sorting center will be loaded at the top of the hour
-        # there's no scan event for that, but that's when the truck will leave
-        # for now, we do want all packages on this truck to arrive at the same
-        # time, so we do need to calculate "top of the hour"
-
-        # get current hour
-        whole, _ = divmod(event_time, SECONDS_PER_HOUR)
-
-        # top of 'next hour'
-        receiving_event_time = SECONDS_PER_HOUR * (whole + 1)
-        # add truck travel time
-        receiving_event_time += truck_travel_time * SECONDS_PER_MINUTE
-
-        # emit arriving at holding area
-        result = {
-            "sorting_center": origin,
-            "event_time": int(event_time),
-            "package_id": package_id,
-            "scanner_id": current_scanner,
-            "next_scanner_id": "receiving",
-            "next_event_time": int(receiving_event_time),
-            "next_sorting_center": destination,
+    def get_travel_time(self, origin, destination):
+        """return total estimated travel time"""
+        return self.routes[(origin, destination)].estimated_delivery_offset
+
+    def build_routes(self):
+        """return dict of Route for every (origin, destination)"""
+        return {
+            (origin, destination): Route(
+                origin=origin,
+                destination=destination,
+                steps=self.route_steps(origin, destination),
+                truck_travel_time=self.topology.truck_travel_time(origin, destination)
+                * SECONDS_PER_MINUTE,
+                estimated_delivery_offset=self.estimated_travel_time(
+                    origin, destination
+                ),
+            )
+            for origin in self.topology.sorting_center_codes
+            for destination in self.topology.sorting_center_codes
         }
 
-        yield result
-
-        event_time = receiving_event_time
-        current_scanner = "receiving"
-        for path_info in self.sorting_centers[destination].package_path(
-            origin, destination
-        ):
-            next_event_time = event_time + path_info["travel_time"]
-            result = {
-                "sorting_center": destination,
-                "event_time": int(event_time),
-                "package_id": package_id,
-                "scanner_id": current_scanner,
-                "next_scanner_id": path_info["next"],
-                "next_event_time": int(next_event_time),
-            }
-            if not result["next_scanner_id"]:
-                del result["next_event_time"]
-                del result["next_scanner_id"]
-
-            yield result
-            # set time for next actual scan, must always be less than
-            # expected scan time
-            event_time = next_event_time - random.randint(0, SECONDS_PER_MINUTE)
-            if event_time >= self.simulated_end_time:
-                return
-
+    def route_steps(self, origin, destination):
+        """return tuple of RouteStep between origin and destination"""
+        steps = []
+        current_scanner = "intake"
+        for path_info in self.sorting_centers[origin].package_path(origin, destination):
+            steps.append(
+                (origin, current_scanner, path_info["next"], path_info["travel_time"])
+            )
             current_scanner = path_info["next"]
 
-    def get_travel_time(self, origin, destination):
+        if self.topology.truck_travel_time(origin, destination):
+            # travel time of the truck step depends on when the package is loaded
+            steps.append((origin, current_scanner, "receiving", None))
+            current_scanner = "receiving"
+            for path_info in self.sorting_centers[destination].package_path(
+                origin, destination
+            ):
+                steps.append(
+                    (
+                        destination,
+                        current_scanner,
+                        path_info["next"],
+                        path_info["travel_time"],
+                    )
+                )
+                current_scanner = path_info["next"]
+
+        result = []
+        for sorting_center, scanner_id, next_scanner_id, travel_time in steps:
+            if scanner_id == "intake":
+                kind = STEP_INTAKE
+            elif scanner_id == "weighing":
+                kind = STEP_WEIGHING
+            elif travel_time is None:
+                kind = STEP_TRUCK
+            elif not next_scanner_id:
+                kind = STEP_FINAL
+            else:
+                kind = STEP_SCAN
+            result.append(
+                RouteStep(sorting_center, scanner_id, next_scanner_id, travel_time, kind)
+            )
+        return tuple(result)
+
+    def estimated_travel_time(self, origin, destination):
         """return total estimated travel time"""
         origin_sorting_center = self.sorting_centers[origin]
         destination_sorting_center = self.sorting_centers[destination]
-        if origin is destination:
+        if origin == destination:
             travel_time = (
-                origin_sorting_center.INTAKE_TIME + origin_sorting_center.OUTPUT_TIME
+                origin_sorting_center.intake_time + origin_sorting_center.output_time
             )
         else:
             travel_time = (
-                origin_sorting_center.INTAKE_TIME
-                + origin_sorting_center.HOLDING_TIME
-                + destination_sorting_center.RECEIVING_TIME
-                + destination_sorting_center.OUTPUT_TIME
-                + TRUCK_TRAVEL_TIMES[(origin, destination)] * SECONDS_PER_MINUTE
+                origin_sorting_center.intake_time
+                + origin_sorting_center.holding_time
+                + destination_sorting_center.receiving_time
+                + destination_sorting_center.output_time
+                + self.topology.truck_travel_time(origin, destination)
+                * SECONDS_PER_MINUTE
             )
-            # round up to the next hour to account for loading time on truck
-            whole, _ = divmod(travel_time, SECONDS_PER_HOUR)
+            # round up to the next departure to account for loading time on truck
+            whole, _ = divmod(travel_time, self.truck_departure_interval)
 
-            travel_time = SECONDS_PER_HOUR * (whole + 1)
+            travel_time = (
+                self.truck_departure_interval * (whole + 1) + self.truck_unload_time
+            )
 
         # and for just to be safe, add more time to travel estimate
         return travel_time + SECONDS_PER_MINUTE * 90
@@ -323,14 +467,49 @@ class Simulator:
 
         # lost packages are selected from delayed packages
         for idx, package_id in enumerate(
-            random.sample(range(1, package_count), delayed_package_count)
+            self.random.sample(range(1, package_count), delayed_package_count)
         ):
             result[str(package_id)] = {
                 "type": "lost" if idx < lost_package_count else "delayed",
                 "delay": 2 * SECONDS_PER_HOUR,
-                "event_index": random.choice(
+                "event_index": self.random.choice(
                     (3, 3, 3, 3, 1, 2, 4)
                 ),  # lose or delay most of them at routing scanner
             }
         logging.debug("delay map %r", result)
         return result
+
+
+def merge_event_sources(sources):
+    """merge event iterators into a single stream in event_time order
+
+    sources yields (start_time, events) tuples in start_time order, where
+    events is an iterator of events in event_time order whose first event
+    is at start_time. An iterator is only started once the merged
+    stream reaches its start_time, so memory is bounded by the number of
+    iterators that are in flight rather than the total number of sources
+    """
+    sources = iter(sources)
+    heap = []
+    sequence = 0  # breaks event_time ties in source order
+    pending = next(sources, None)
+    while heap or pending is not None:
+        # admit every source that may have an event at or before the heap top
+        while pending is not None and (not heap or pending[0] <= heap[0][0]):
+            events = iter(pending[1])
+            event = next(events, None)
+            if event is not None:
+                heapq.heappush(heap, (event["event_time"], sequence, event, events))
+                sequence += 1
+            pending = next(sources, None)
+
+        if not heap:
+            continue
+
+        _, event_sequence, event, events = heap[0]
+        yield event
+        event = next(events, None)
+        if event is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (event["event_time"], event_sequence, event, events))
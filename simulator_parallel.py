@@ -0,0 +1,177 @@
+"""simulator_parallel - generate simulated events with multiple processes"""
+# cpython only (multiprocessing). Package ids are split into fixed size shards,
+# each shard has its own random seed derived from the simulation seed, so the
+# output does not depend on the number of worker processes
+
+import os
+import json
+import heapq
+import random
+import shutil
+import logging
+import tempfile
+import multiprocessing
+
+from simulator_core import Simulator
+from topology import DEFAULT_TOPOLOGY
+from event_file import SORTING_CENTER_FILE_NAME
+
+SHARD_FILE_NAME = "shard-%06d-%s.json"  # % (shard index, sorting center code)
+EVENT_TIME_WIDTH = 12  # digits in the event_time sort prefix of shard file lines
+
+
+def get_simulator(simulator_arguments, batch=False, block_size=None):
+    """return a simulator for simulator_arguments"""
+    if batch:
+        from simulator_batch import BatchSimulator  # requires numpy
+
+        return BatchSimulator(block_size=block_size, **simulator_arguments)
+    return Simulator(**simulator_arguments)
+
+
+def generate_shard(shard_info):
+    """write time ordered events of one shard
+
+    events are written to one file per sorting center if split_sorting_centers
+    is set, otherwise to a single file with sorting center code "all". Lines are
+    json if json_output is set, otherwise the repr of the event
+    """
+    (
+        shard_index,
+        shard_size,
+        simulator_arguments,
+        batch,
+        block_size,
+        shard_directory,
+        split_sorting_centers,
+        json_output,
+    ) = shard_info
+    simulator = get_simulator(
+        dict(simulator_arguments, shard_index=shard_index, shard_size=shard_size),
+        batch=batch,
+        block_size=block_size,
+    )
+    if split_sorting_centers:
+        file_codes = simulator.topology.sorting_center_codes
+    else:
+        file_codes = ("all",)
+    shard_files = {
+        _: open(os.path.join(shard_directory, SHARD_FILE_NAME % (shard_index, _)), "w")
+        for _ in file_codes
+    }
+    encode = json.dumps if json_output else repr
+    event_count = 0
+    try:
+        for event in simulator.ordered_event_source():
+            # prefix each line with a fixed width event_time so that shard files
+            # can be merged without decoding the events
+            shard_file = shard_files[
+                event["sorting_center"] if split_sorting_centers else "all"
+            ]
+            shard_file.write(
+                "%0*d %s\n" % (EVENT_TIME_WIDTH, event["event_time"], encode(event))
+            )
+            event_count += 1
+    finally:
+        for shard_file in shard_files.values():
+            shard_file.close()
+    return shard_index, event_count
+
+
+def merge_shard_files(merge_info):
+    """merge time ordered shard files for one sorting center into output_file_name"""
+    shard_file_names, output_file_name = merge_info
+    shard_files = [open(_, "r") for _ in shard_file_names]
+    try:
+        with open(output_file_name, "w") as output_file:
+            write_merged_lines(shard_files, output_file)
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    return output_file_name
+
+
+def write_merged_lines(shard_files, output_file):
+    """write event_time ordered lines from shard files, without the sort prefix"""
+    for line in heapq.merge(*shard_files):
+        output_file.write(line[EVENT_TIME_WIDTH + 1 :])
+
+
+def generate_events(
+    simulator_arguments,
+    output_file,
+    workers=None,
+    shard_size=250000,
+    batch=False,
+    block_size=100000,
+    output_directory=None,
+    json_output=True,
+):
+    """generate events using worker processes
+
+    events are written in event_time order to output_file, or if output_directory
+    is set, to one file per sorting center in that directory. Events are written
+    as json lines if json_output is set, otherwise as the repr of the event
+    """
+    if simulator_arguments.get("random_seed") is None:
+        # every shard needs the same seed, log it to reproduce the run
+        simulator_arguments = dict(
+            simulator_arguments, random_seed=random.randint(0, 2 ** 31)
+        )
+        logging.info("random seed %d", simulator_arguments["random_seed"])
+    package_count = simulator_arguments["package_count"]
+    topology = simulator_arguments.get("topology") or DEFAULT_TOPOLOGY
+    shard_count = (package_count + shard_size - 1) // shard_size
+    shard_directory = tempfile.mkdtemp(prefix="simulator-shards-")
+    pool = multiprocessing.Pool(workers)
+    try:
+        shard_infos = [
+            (
+                shard_index,
+                shard_size,
+                simulator_arguments,
+                batch,
+                block_size,
+                shard_directory,
+                bool(output_directory),
+                json_output,
+            )
+            for shard_index in range(shard_count)
+        ]
+        for shard_index, event_count in pool.imap_unordered(
+            generate_shard, shard_infos
+        ):
+            logging.debug("shard %d generated %d events", shard_index, event_count)
+
+        def shard_file_names(sorting_center_code):
+            return [
+                os.path.join(
+                    shard_directory, SHARD_FILE_NAME % (_, sorting_center_code)
+                )
+                for _ in range(shard_count)
+            ]
+
+        if output_directory:
+            # sorting centers are merged in parallel
+            for output_file_name in pool.imap_unordered(
+                merge_shard_files,
+                [
+                    (
+                        shard_file_names(_),
+                        os.path.join(output_directory, SORTING_CENTER_FILE_NAME % _),
+                    )
+                    for _ in topology.sorting_center_codes
+                ],
+            ):
+                logging.debug("wrote %s", output_file_name)
+        else:
+            shard_files = [open(_, "r") for _ in shard_file_names("all")]
+            try:
+                write_merged_lines(shard_files, output_file)
+            finally:
+                for shard_file in shard_files:
+                    shard_file.close()
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(shard_directory)
@@ -1,14 +1,26 @@
 #!/bin/bash
 # run all sorting centers at the same time
+# optionally pass a topology config file, e.g. ./sort-all.bash topology-64.json
+# set CODEC=binary if events were imported with --codec binary
 export CLASSPATH=`pwd`/jar/\*:/home/bkc/src/3rdParty/pravega-client-0.9.0/\* 
 SCOPE=test
-COMMON_ARGS="-r -u tcp://192.168.198.4:9090 --scope $SCOPE --rs localhost --wait_for_events --mark 1000 -l debug"
+COMMON_ARGS="-r -u tcp://192.168.198.4:9090 --scope $SCOPE --rs localhost --wait_for_events --mark 1000 -l debug --codec ${CODEC:-json}"
+TOPOLOGY_ARGS=""
+if [ -n "$1" ]; then
+    TOPOLOGY_ARGS="--topology $1"
+fi
+SORTING_CENTER_CODES=(`python topology.py -c $TOPOLOGY_ARGS`)
+LAST_SORTING_CENTER_CODE=${SORTING_CENTER_CODES[${#SORTING_CENTER_CODES[@]}-1]}
 
-echo "starting 4 sorting-center processors"
-jython sorting_center.py $COMMON_ARGS -s A &
-jython sorting_center.py $COMMON_ARGS -s B & 
-jython sorting_center.py $COMMON_ARGS -s C & 
-jython sorting_center.py $COMMON_ARGS -s D --report_lost_packages &
+echo "starting ${#SORTING_CENTER_CODES[@]} sorting-center processors"
+for SORTING_CENTER_CODE in "${SORTING_CENTER_CODES[@]}"; do
+    if [ "$SORTING_CENTER_CODE" = "$LAST_SORTING_CENTER_CODE" ]; then
+        # one process reports lost packages
+        jython sorting_center.py $COMMON_ARGS $TOPOLOGY_ARGS -s $SORTING_CENTER_CODE --report_lost_packages &
+    else
+        jython sorting_center.py $COMMON_ARGS $TOPOLOGY_ARGS -s $SORTING_CENTER_CODE &
+    fi
+done
 
 wait
 echo "processing completed"
@@ -2,7 +2,6 @@
 
 import sys
 import argparse
-import json
 import logging
 import cgitb
 import itertools
@@ -10,6 +9,8 @@ import uuid
 import operator
 import time
 import datetime
+import collections
+import threading
 
 from io.pravega.client.stream.impl import UTF8StringSerializer
 from io.pravega.client.stream import Stream
@@ -17,76 +18,228 @@ from io.pravega.client.stream import Stream
 from pravega_interface import (
     streamConfiguration,
     streamManager,
+    streamSegmentCount,
     eventStreamClientFactory,
     eventWriter,
     readerGroupManager,
     readerGroup,
-    Reader,
     keyValueTable,
     keyValueTableFactory,
     keyValueTableConfiguration,
     keyValueTableManager,
+    keyFamilyEntries,
+    PayloadCodec,
 )
 
 from redis_util import add_redis_argparse_argument, get_redis_server_from_options
 
 from util import setup_logging, add_logging_argument
+from event_codec import JsonCodec, add_codec_argument, get_codec_from_options
+from deadline_index import DeadlineIndex, save_snapshot, load_snapshot
+from kvt_cache import KeyValueTableCache, CACHE_SIZE, FLUSH_SIZE
+from streamcut_index import streamCutIndex, parse_streamcut
+from stage_threads import StageThreads, STAGE_QUEUE_SIZE, END_OF_STAGE
+from stream_reader import prefetchingReader, Checkpoint, is_end_of_stream
+from metrics import (
+    REGISTRY,
+    Throughput,
+    counted,
+    add_metrics_argument,
+    serve_metrics_from_options,
+)
+from checkpoint import (
+    Checkpoints,
+    checkpointReaderGroup,
+    CHECKPOINT_INTERVAL,
+    CHECKPOINT_SCANNER_ID,
+    checkpoint_marker,
+)
+from topology import (
+    add_topology_argument,
+    get_topology_from_options,
+    DEFAULT_TOPOLOGY,
+)
 from const import (
-    SORTING_CENTER_CODES,
-    SORTING_CENTER_TO_STREAM_NAME,
     REDIS_PACKAGE_NEXT_EVENT_KEY_NAME,
-    REDIS_CLOCK_SYNC_KEY_NAME,
+    REDIS_WATERMARK_KEY_NAME,
+    REDIS_WATERMARK_WAITING_KEY_NAME,
+    REDIS_WATERMARK_WAKE_KEY_NAME,
     PACKAGE_ATTRIBUTES_KVT_NAME,
     PACKAGE_EVENTS_KVT_NAME,
-    PUBLIC_SCANNER_EVENTS,
     TROUBLE_EVENT_STREAM_NAME,
+    INPUT_STREAM_SEGMENT_COUNT,
     MINIMUM_LATE_PACKAGE_SECONDS,
     REDIS_LATE_PACKAGE_HASH_NAME,
     REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
 )
 
-READ_TIMEOUT = 2000
 DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY = (
     60  # how many seconds (simulated time) between checking for delayed events
 )
-SLEEP_THIS_PROCESS_WHEN_TIME_SYNC_DIFFERENCE_EXCEEDS = 90
-SLEEP_PROCESS_TIME = 0.001
-DEBUG_TIME_SYNC = False
+WATERMARK_WAIT_TIMEOUT = 10  # wall-clock seconds between checks of a waiting center
+READER_SKEW = 90  # seconds of event_time a reader thread may run ahead of the others
+READER_SKEW_SLEEP = 0.001  # wall-clock seconds a reader ahead sleeps at each vote
+REDIS_BATCH_SIZE = 1000  # package updates sent to redis in one pipeline
+KVT_IN_FLIGHT = 0  # kvt requests issued ahead for upcoming events, 0 waits for each
+SNAPSHOT_INTERVAL = 60.0  # wall-clock seconds between local deadline snapshots
+EXTRACT_GRACE_PERIOD = 6 * 3600  # seconds a package is looked for after it was due
+BATCH_SIZE = 0  # events passed through the stages at once, 0 for one at a time
+BATCH_TIME = 100  # milliseconds a batch waits for more events
+PACKAGE_ATTRIBUTE_SCANNER_IDS = ("intake", "weighing", "output")
+
+# publish the low watermark of a sorting center, the event_time up to which it
+# has processed its events, and wake sorting centers waiting for the global
+# watermark, the lowest of all. Then find packages expected in this sorting
+# center that have become late by its watermark and mark them as late, in one
+# atomic round trip. Wake keys are derived from the sorting center codes
+# KEYS watermarks, next package event of the sorting center, late packages,
+# next package scanner, waiting sorting centers
+# ARGV watermark, sorting_center_code, MINIMUM_LATE_PACKAGE_SECONDS, wake key
+# returns global watermark, its sorting center, then package_id,
+# expected_event_time and next_scanner_id for each newly late package
+DELAYED_PACKAGE_SWEEP_SCRIPT = """
+local watermark = tonumber(ARGV[1])
+redis.call("ZADD", KEYS[1], watermark, ARGV[2])
+local earliest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+local global_watermark = math.floor(tonumber(earliest[2]))
+local result = {global_watermark, earliest[1]}
+local woken = redis.call("ZRANGEBYSCORE", KEYS[5], 0, global_watermark)
+for idx = 1, #woken do
+    redis.call("RPUSH", string.format(ARGV[4], woken[idx]), global_watermark)
+end
+if #woken > 0 then
+    redis.call("ZREMRANGEBYSCORE", KEYS[5], 0, global_watermark)
+end
+local late = redis.call(
+    "ZRANGEBYSCORE", KEYS[2], 0, watermark - tonumber(ARGV[3]), "WITHSCORES")
+for idx = 1, #late, 2 do
+    local package_id = late[idx]
+    if redis.call("SADD", KEYS[3], package_id) == 1 then
+        table.insert(result, package_id)
+        table.insert(result, late[idx + 1])
+        table.insert(result, redis.call("HGET", KEYS[4], package_id))
+        redis.call("ZREM", KEYS[2], package_id)
+    end
+end
+return result
+"""
+
+# register a sorting center to be woken when the global watermark reaches a
+# watermark, unless it already has
+# KEYS watermarks, waiting sorting centers, wake key of the sorting center
+# ARGV sorting_center_code, watermark
+# returns global watermark and its sorting center
+WATERMARK_WAIT_SCRIPT = """
+local earliest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+local watermark = math.floor(tonumber(earliest[2]))
+if watermark < tonumber(ARGV[2]) then
+    redis.call("DEL", KEYS[3])
+    redis.call("ZADD", KEYS[2], tonumber(ARGV[2]), ARGV[1])
+end
+return {watermark, earliest[1]}
+"""
 
 cgitb.enable(format="text")
 logger = None
+throughput = Throughput("sorting_center")
 
 
 def iterable_stream(
-    uri, scope, stream_name, serializer, reader_name=None, wait_for_events=False
+    uri,
+    scope,
+    stream_name,
+    codec,
+    reader_name=None,
+    wait_for_events=False,
+    reader_group_name=None,
+    start_stream_cut=None,
+    batch_size=0,
+    batch_time=BATCH_TIME,
+    stream_end=None,
 ):
-    """iterate events from a stream"""
-    if reader_name is None:
-        reader_name = str(uuid.uuid4()).replace("-", "")
-    with readerGroupManager(uri, scope) as reader_group_manager, readerGroup(
-        reader_group_manager, scope, stream_name
-    ) as reader_group, eventStreamClientFactory(uri, scope) as client_factory, Reader(
-        reader_group, client_factory, serializer, reader_name=reader_name
+    """iterate events from a stream, decoded by codec
+
+    events are read ahead by a PrefetchingReader, see stream_reader. Readers
+    sharing reader_group_name divide the stream segments between them, and
+    stop once one of them read the end-of-stream event if they share
+    stream_end, a threading.Event. A new reader group starts reading at
+    start_stream_cut, if set. Checkpoints of the reader group are yielded as
+    marker events
+
+    with batch_size, lists of up to batch_size events are yielded instead. A
+    batch is yielded batch_time milliseconds after its first event was read
+    at the latest. It ends with the first event of a delayed package check
+    interval, the check follows that event as without batches, and a
+    checkpoint marker is a batch of its own
+    """
+    with prefetchingReader(
+        uri,
+        scope,
+        stream_name,
+        codec,
+        reader_name=reader_name,
+        reader_group_name=reader_group_name,
+        start_stream_cut=start_stream_cut,
+        wait_for_events=wait_for_events,
+        end_of_stream=is_end_of_stream,
+        stream_end=stream_end,
+        name="%s reader" % stream_name,
     ) as reader:
-        have_read_an_event = False
+        event_time = None
+        batch = []
+        batch_deadline = None
         while True:
-            event_read = reader.readNextEvent(READ_TIMEOUT)
-            event = event_read.getEvent()
-            if event is None:
-                if reader_group.getMetrics().unreadBytes():
-                    # still more to read, retry
+            timeout = None
+            if batch:
+                # wait no longer than the batch may
+                timeout = max(0, batch_deadline - time.time())
+            item = reader.get(timeout)
+            if item is None:
+                # batch_time has passed
+                yield batch
+                batch = []
+                continue
+            if item is END_OF_STAGE:
+                if batch:
+                    yield batch
+                logger.debug("all events have been read")
+                return
+            if isinstance(item, Checkpoint):
+                # all events before the checkpoint have been yielded
+                marker = checkpoint_marker(item.name, event_time)
+                if not batch_size:
+                    yield marker
                     continue
-                elif not have_read_an_event and wait_for_events:
-                    # need to keep retrying until we get at least one event
-                    logger.debug("waiting for events")
+                if batch:
+                    yield batch
+                    batch = []
+                yield [marker]
+                continue
+
+            for event in item:
+                previous_event_time = event_time
+                event_time = event["event_time"]
+                if not batch_size:
+                    yield event
                     continue
-                else:
-                    # nothing left to read
-                    logger.debug("all events have been read")
-                    return
 
-            yield json.loads(event)
-            have_read_an_event = True
+                if not batch:
+                    batch_deadline = time.time() + batch_time / 1000.0
+                batch.append(event)
+                if (
+                    len(batch) >= batch_size
+                    or time.time() >= batch_deadline
+                    or previous_event_time is not None
+                    and check_interval(event_time)
+                    != check_interval(previous_event_time)
+                ):
+                    yield batch
+                    batch = []
+
+
+def check_interval(event_time):
+    """return the delayed package check interval of event_time"""
+    return event_time // DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY
 
 
 def process_sorting_center_events(
@@ -98,17 +251,64 @@ def process_sorting_center_events(
     wait_for_events=False,
     mark_event_index_frequency=0,
     report_lost_packages=False,
+    topology=DEFAULT_TOPOLOGY,
+    codec=None,
+    redis_batch_size=REDIS_BATCH_SIZE,
+    local_deadlines=None,
+    cache_size=CACHE_SIZE,
+    cache_flush_size=FLUSH_SIZE,
+    kvt_in_flight=KVT_IN_FLIGHT,
+    segments=INPUT_STREAM_SEGMENT_COUNT,
+    readers=1,
+    connect_redis=None,
+    reader_group_name=None,
+    checkpoints=None,
+    watermark_skew=None,
+    batch_size=BATCH_SIZE,
+    batch_time=BATCH_TIME,
+    stage_threads=False,
+    stage_queue_size=STAGE_QUEUE_SIZE,
 ):
-    """process events from stream"""
-    serializer = UTF8StringSerializer()
+    """process events from stream, codec is a PayloadCodec (default json)
+
+    next expected events are kept in redis, or in local_deadlines
+    (LocalNextEventTimes) for a sorting center running standalone. With redis,
+    the sorting center waits when it is more than watermark_skew seconds
+    ahead of the others, by default maximum_watermark_skew(topology).
+
+    with more than one reader, the segments of the input stream are divided
+    between reader threads that each run the pipeline. Each thread needs its
+    own redis connection from connect_redis, and a segment of its own:
+    ValueError if the input stream has fewer segments than readers
+
+    with checkpoints (Checkpoints), the reader group reader_group_name is reset
+    to the last checkpoint and local_deadlines are restored from it, then
+    checkpoints are taken while processing
+
+    with batch_size, the stages process batches of up to batch_size events
+    read within batch_time milliseconds, see iterable_stream. With
+    stage_threads, the stages of each reader run on threads of their own,
+    see sorting_center_pipeline
+    """
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    if readers > 1 and not local_deadlines and connect_redis is None:
+        raise ValueError("parallel readers need connect_redis")
+    if local_deadlines:
+        if local_deadlines.sorting_center_code is None:
+            local_deadlines.sorting_center_code = sorting_center_code
+        sweep = local_deadlines.sweep
+    else:
+        if watermark_skew is None:
+            watermark_skew = maximum_watermark_skew(topology)
+        sweep = DelayedPackageSweep(redis, watermark_skew)
     trouble_stream_name = TROUBLE_EVENT_STREAM_NAME
-    stream_configuration = streamConfiguration(scaling_policy=1)
-    input_stream_name = SORTING_CENTER_TO_STREAM_NAME[sorting_center_code]
+    input_stream_name = topology.stream_name(sorting_center_code)
 
     with streamManager(uri=uri) as stream_manager:
         stream_manager.createScope(scope)
         created = stream_manager.createStream(
-            scope, trouble_stream_name, stream_configuration
+            scope, trouble_stream_name, streamConfiguration(scaling_policy=1)
         )
         logger.debug(
             "stream %s/%s %s",
@@ -117,7 +317,7 @@ def process_sorting_center_events(
             "created" if created else "already exists",
         )
         created = stream_manager.createStream(
-            scope, input_stream_name, stream_configuration
+            scope, input_stream_name, streamConfiguration(scaling_policy=segments)
         )
         logging.debug(
             "stream %s/%s %s",
@@ -125,81 +325,458 @@ def process_sorting_center_events(
             input_stream_name,
             "created" if created else "already exists",
         )
+        if readers > 1:
+            # a reader without a segment never votes, so no sweep would run
+            segment_count = streamSegmentCount(
+                stream_manager, scope, input_stream_name
+            )
+            if readers > segment_count:
+                raise ValueError(
+                    "%d readers need at least as many segments, stream %s has %d"
+                    % (readers, input_stream_name, segment_count)
+                )
+        if reader_group_name is None:
+            reader_group_name = str(uuid.uuid4()).replace("-", "")
+        start_stream_cut = None
+        if checkpoints:
+            stream_cut, state = checkpoints.load()
+            if stream_cut:
+                start_stream_cut = parse_streamcut(stream_cut)
+            if state and local_deadlines:
+                local_deadlines.restore(state)
         with eventStreamClientFactory(
             uri, scope
         ) as event_stream_client_factory, eventWriter(
-            event_stream_client_factory, trouble_stream_name, serializer
-        ) as trouble_stream:
-            # input stream must already exist
-            logger.debug("begin reading from stream %r", input_stream_name)
-            input_event_stream = iterable_stream(
-                uri,
-                scope,
-                input_stream_name,
-                serializer,
-                wait_for_events=wait_for_events,
-            )
-            # read each scan event
-            # write hourly window times back to sorting-center specific timestamp stream
-            # always update redis sorted set with next expected  event time
-            # detect packages that are late and report them to trouble stream
-            # if its from intake scanner - send package_id, destination, eta and value to central service via kvt
-            # if its from output scanner - mark package as delivered in kvt
-            # if its weighing scanner - update central service kvt, add weight
-            # if its intake, holding, receiving or outlet - add event to package specific stream TODO
-
-            pipeline = detect_delayed_packages(
-                input_event_stream=update_next_event_time(
-                    input_event_stream=record_public_tracking_events(
-                        input_event_stream=record_intake_and_weight_and_output(
-                            input_event_stream=save_streamcut_timestamps(
-                                input_event_stream
-                            ),
-                            uri=uri,
-                            scope=scope,
-                            trouble_stream=trouble_stream,
-                            sorting_center_code=sorting_center_code,
-                        ),
-                        uri=uri,
-                        scope=scope,
-                    ),
-                    redis=redis,
-                ),
+            event_stream_client_factory, trouble_stream_name, codec.serializer
+        ) as trouble_stream, readerGroupManager(
+            uri, scope
+        ) as reader_group_manager, readerGroup(
+            reader_group_manager,
+            scope,
+            input_stream_name,
+            reader_group_name,
+            start_stream_cut,
+            reset=checkpoints is not None,
+        ) as reader_group, streamCutIndex(
+            uri, scope, sorting_center_code, reader_group
+        ) as streamcut_index, checkpointReaderGroup(
+            checkpoints,
+            reader_group,
+            readers,
+            local_deadlines.state if local_deadlines else dict,
+        ):
+            pipeline_arguments = dict(
+                uri=uri,
+                scope=scope,
                 trouble_stream=trouble_stream,
-                redis=redis,
                 sorting_center_code=sorting_center_code,
+                topology=topology,
+                codec=codec,
+                cache_size=cache_size,
+                cache_flush_size=cache_flush_size,
+                kvt_in_flight=kvt_in_flight,
+                streamcut_index=streamcut_index,
+                checkpoints=checkpoints,
+                batched=bool(batch_size),
+                stage_queue_size=stage_queue_size if stage_threads else 0,
             )
-
-            if maximum_event_count:
-                for _ in itertools.izip(range(10), pipeline):
-                    logger.debug("%r", _)
+            # input stream must already exist
+            logger.debug("begin reading from stream %r", input_stream_name)
+            if readers > 1:
+                event_time, last_event_time = process_with_parallel_readers(
+                    input_stream_name,
+                    reader_group_name,
+                    readers,
+                    sweep,
+                    connect_redis=connect_redis,
+                    local_deadlines=local_deadlines,
+                    redis_batch_size=redis_batch_size,
+                    wait_for_events=wait_for_events,
+                    mark_event_index_frequency=mark_event_index_frequency,
+                    batch_size=batch_size,
+                    batch_time=batch_time,
+                    pipeline_arguments=pipeline_arguments,
+                )
+                if last_event_time is not None:
+                    # the end of stream marker reaches one reader, sweep once
+                    # more at the time of the last event of any reader
+                    report_delayed_packages(
+                        sweep,
+                        trouble_stream,
+                        last_event_time,
+                        sorting_center_code,
+                        codec,
+                    )
             else:
-                # process all events by completely consuming the generator
-                for idx, event in enumerate(pipeline):
-                    if event.get("scanner_id") != "end-of-stream":
-                        event_time = event["event_time"]
-                    if (
-                        idx
-                        and mark_event_index_frequency
-                        and not (idx % mark_event_index_frequency)
-                    ):
-                        logger.debug("event # %d", idx)
+                input_event_stream = iterable_stream(
+                    uri,
+                    scope,
+                    input_stream_name,
+                    codec,
+                    wait_for_events=wait_for_events,
+                    reader_group_name=reader_group_name,
+                    batch_size=batch_size,
+                    batch_time=batch_time,
+                )
+                pipeline = sorting_center_pipeline(
+                    input_event_stream,
+                    redis=redis,
+                    next_event_times=next_event_time_store(
+                        redis, sorting_center_code, local_deadlines, redis_batch_size
+                    ),
+                    sweep=sweep,
+                    **pipeline_arguments
+                )
+                event_time, last_event_time = consume_events(
+                    pipeline,
+                    maximum_event_count,
+                    mark_event_index_frequency,
+                    batched=bool(batch_size),
+                )
 
-            if report_lost_packages and redis:
-                report_lost_packages_to_stream(trouble_stream, redis, event_time)
+            if local_deadlines:
+                local_deadlines.save()
+            if report_lost_packages:
+                if local_deadlines:
+                    late_package_ids = sorted(local_deadlines.late_package_ids)
+                else:
+                    late_package_ids = redis.smembers(REDIS_LATE_PACKAGE_HASH_NAME)
+                report_lost_packages_to_stream(
+                    trouble_stream, late_package_ids, event_time, codec
+                )
 
     return 0
 
 
-def report_lost_packages_to_stream(stream, redis, event_time):
-    """append lost package information to redis"""
-    for package_id in redis.smembers(REDIS_LATE_PACKAGE_HASH_NAME):
+def sorting_center_pipeline(
+    input_event_stream,
+    uri,
+    scope,
+    trouble_stream,
+    sorting_center_code,
+    topology,
+    codec,
+    redis,
+    next_event_times,
+    sweep,
+    cache_size=CACHE_SIZE,
+    cache_flush_size=FLUSH_SIZE,
+    kvt_in_flight=KVT_IN_FLIGHT,
+    streamcut_index=None,
+    checkpoints=None,
+    batched=False,
+    stage_queue_size=0,
+):
+    """return generator of events passed through all sorting center stages
+
+    if batched, input_event_stream yields lists of events and so does the
+    generator, each stage handles a batch at once. With stage_queue_size,
+    stages run on threads of their own, connected by queues of that size
+    """
+    # read each scan event
+    # write hourly window times back to sorting-center specific timestamp stream
+    # always update redis sorted set with next expected  event time
+    # detect packages that are late and report them to trouble stream
+    # if its from intake scanner - send package_id, destination, eta and value to central service via kvt
+    # if its from output scanner - mark package as delivered in kvt
+    # if its weighing scanner - update central service kvt, add weight
+    # if its intake, holding, receiving or outlet - add event to package specific stream TODO
+    # with stage_queue_size, the reader and both kvt stages run on threads of
+    # their own and the redis stages on the thread reading the pipeline.
+    # Updating next event times, detecting delayed packages and checkpoints
+    # share a thread: sweeps see the updates of all events before them and
+    # none after, they share a redis connection and the state captured at a
+    # checkpoint is that of its marker
+    if stage_queue_size:
+        stage_threads = StageThreads(
+            stage_queue_size, name="%s stages" % sorting_center_code
+        )
+    else:
+        stage_threads = None
+    input_event_stream = save_streamcut_timestamps(
+        input_event_stream, streamcut_index, batched
+    )
+    input_event_stream = count_stage_events(input_event_stream, "reader", batched)
+    if stage_threads:
+        input_event_stream = stage_threads.start("reader", input_event_stream)
+    input_event_stream = record_intake_and_weight_and_output(
+        input_event_stream=input_event_stream,
+        uri=uri,
+        scope=scope,
+        trouble_stream=trouble_stream,
+        sorting_center_code=sorting_center_code,
+        codec=codec,
+        cache_size=cache_size,
+        cache_flush_size=cache_flush_size,
+        maximum_in_flight=kvt_in_flight,
+        batched=batched,
+    )
+    input_event_stream = count_stage_events(
+        input_event_stream, "package_attributes", batched
+    )
+    if stage_threads:
+        input_event_stream = stage_threads.start(
+            "package_attributes", input_event_stream
+        )
+    input_event_stream = record_public_tracking_events(
+        input_event_stream=input_event_stream,
+        uri=uri,
+        scope=scope,
+        public_scanner_ids=topology.public_scanner_ids,
+        codec=codec,
+        maximum_in_flight=kvt_in_flight,
+        batched=batched,
+    )
+    input_event_stream = count_stage_events(
+        input_event_stream, "public_tracking", batched
+    )
+    if stage_threads:
+        input_event_stream = stage_threads.start(
+            "public_tracking", input_event_stream
+        )
+    input_event_stream = update_next_event_time(
+        input_event_stream=input_event_stream,
+        redis=redis,
+        next_event_times=next_event_times,
+        batched=batched,
+    )
+    input_event_stream = count_stage_events(
+        input_event_stream, "next_event_time", batched
+    )
+    input_event_stream = detect_delayed_packages(
+        input_event_stream=input_event_stream,
+        trouble_stream=trouble_stream,
+        sweep=sweep,
+        sorting_center_code=sorting_center_code,
+        codec=codec,
+        next_event_times=next_event_times,
+        batched=batched,
+    )
+    input_event_stream = count_stage_events(
+        input_event_stream, "delayed_packages", batched
+    )
+    return complete_checkpoints(
+        input_event_stream=input_event_stream,
+        checkpoints=checkpoints,
+        trouble_stream=trouble_stream,
+        batched=batched,
+    )
+
+
+def count_stage_events(input_event_stream, stage, batched=False):
+    """return input_event_stream, its events counted in metrics for stage"""
+    return counted(
+        input_event_stream,
+        REGISTRY.counter(
+            "sorting_center_stage_events_total",
+            "events passed on by a pipeline stage",
+            stage=stage,
+        ),
+        batched,
+    )
+
+
+def next_event_time_store(
+    redis, sorting_center_code, local_deadlines, redis_batch_size
+):
+    """return where update_next_event_time sends updates, None for redis directly"""
+    if local_deadlines:
+        return local_deadlines
+    if redis_batch_size:
+        return NextEventTimeBatch(
+            redis, sorting_center_code, batch_size=redis_batch_size
+        )
+    return None
+
+
+def consume_events(
+    pipeline, maximum_event_count=None, mark_event_index_frequency=0, batched=False
+):
+    """process all events of pipeline, batches of events if batched
+
+    return event_time of the last scan event and of the last event including
+    the end of stream marker, None if there were none
+    """
+    if batched:
+        pipeline = itertools.chain.from_iterable(pipeline)
+    event_time = last_event_time = None
+    if maximum_event_count:
+        for _ in itertools.izip(range(10), pipeline):
+            logger.debug("%r", _)
+    else:
+        # process all events by completely consuming the generator
+        for idx, event in enumerate(pipeline):
+            scanner_id = event.get("scanner_id")
+            if scanner_id == CHECKPOINT_SCANNER_ID:
+                continue
+            last_event_time = event["event_time"]
+            if scanner_id != "end-of-stream":
+                event_time = last_event_time
+                throughput.add(event_time)
+            if (
+                idx
+                and mark_event_index_frequency
+                and not (idx % mark_event_index_frequency)
+            ):
+                logger.debug("event # %d", idx)
+    return event_time, last_event_time
+
+
+def process_with_parallel_readers(
+    input_stream_name,
+    reader_group_name,
+    readers,
+    sweep,
+    connect_redis,
+    local_deadlines,
+    redis_batch_size,
+    wait_for_events,
+    mark_event_index_frequency,
+    batch_size,
+    batch_time,
+    pipeline_arguments,
+):
+    """run the pipeline in a thread per reader, all readers in reader_group_name
+
+    events are routed to segments by package_id, so all events of a package
+    are read by the same reader, in order. return latest event times as
+    consume_events
+    """
+    uri = pipeline_arguments["uri"]
+    scope = pipeline_arguments["scope"]
+    codec = pipeline_arguments["codec"]
+    coordinator = SweepCoordinator(sweep, readers)
+    # set by the reader of the end-of-stream event. It is in one segment only,
+    # readers stop once it is set and the reader group has nothing left unread
+    stream_end = threading.Event()
+    results = []
+    errors = []
+
+    def run_reader(reader_name):
+        try:
+            redis = None if local_deadlines else connect_redis()
+            pipeline = sorting_center_pipeline(
+                iterable_stream(
+                    uri,
+                    scope,
+                    input_stream_name,
+                    codec,
+                    reader_name=reader_name,
+                    wait_for_events=wait_for_events,
+                    reader_group_name=reader_group_name,
+                    batch_size=batch_size,
+                    batch_time=batch_time,
+                    stream_end=stream_end,
+                ),
+                redis=redis,
+                next_event_times=next_event_time_store(
+                    redis,
+                    pipeline_arguments["sorting_center_code"],
+                    local_deadlines,
+                    redis_batch_size,
+                ),
+                sweep=coordinator.reader_sweep(reader_name),
+                **pipeline_arguments
+            )
+            results.append(
+                consume_events(
+                    pipeline,
+                    mark_event_index_frequency=mark_event_index_frequency,
+                    batched=bool(batch_size),
+                )
+            )
+            coordinator.finish(reader_name)
+        except Exception as error:
+            # keep its vote, so its packages aren't reported late by the others
+            logger.exception("reader %s failed", reader_name)
+            errors.append(error)
+
+    threads = [
+        threading.Thread(
+            target=run_reader,
+            args=("%s-%d" % (reader_group_name, idx),),
+            name="reader-%d" % idx,
+        )
+        for idx in range(readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    event_times = [_[0] for _ in results if _[0] is not None]
+    last_event_times = [_[1] for _ in results if _[1] is not None]
+    return (
+        max(event_times) if event_times else None,
+        max(last_event_times) if last_event_times else None,
+    )
+
+
+class SweepCoordinator:
+    """delayed package sweep shared by the reader threads of a sorting center
+
+    every reader votes with its own event_time. The sweep runs once each time
+    the earliest reader reaches a new check interval, so packages of a reader
+    that is behind are not reported late early. There is no sweep before
+    every reader voted, e.g. after restoring deadlines from a checkpoint, so
+    every reader needs a segment of its own. Readers that finished don't
+    vote. A reader more than READER_SKEW seconds
+    ahead of the earliest sleeps at each vote, otherwise it would scan its
+    late packages before the sweep reaches them
+    """
+
+    def __init__(self, sweep, reader_count):
+        self.sweep = sweep
+        self.reader_count = reader_count  # readers that haven't finished
+        self.lock = threading.Lock()
+        self.reader_times = {}  # reader name: event_time
+        self.checked_interval = None
+
+    def reader_sweep(self, reader_name):
+        """return sweep function for one reader"""
+
+        def sweep(event_time, sorting_center_code):
+            return self.vote(reader_name, event_time, sorting_center_code)
+
+        return sweep
+
+    def vote(self, reader_name, event_time, sorting_center_code):
+        """return earliest reader event_time, sorting_center_code and newly late packages"""
+        with self.lock:
+            self.reader_times[reader_name] = event_time
+            earliest_event_time = min(self.reader_times.values())
+            interval = earliest_event_time // DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY
+            if (
+                interval == self.checked_interval
+                or len(self.reader_times) < self.reader_count
+            ):
+                result = earliest_event_time, sorting_center_code, []
+            else:
+                self.checked_interval = interval
+                result = self.sweep(earliest_event_time, sorting_center_code)
+        if event_time - earliest_event_time > READER_SKEW:
+            # give the readers behind a chance to catch up
+            time.sleep(READER_SKEW_SLEEP)
+        return result
+
+    def finish(self, reader_name):
+        """stop counting a reader that has no more events"""
+        with self.lock:
+            self.reader_times.pop(reader_name, None)
+            self.reader_count -= 1
+
+
+def report_lost_packages_to_stream(stream, late_package_ids, event_time, codec):
+    """append lost package information to trouble stream"""
+    for package_id in late_package_ids:
         logger.debug("lost package %s", package_id)
         # write to trouble stream
         stream.noteTime(event_time)  # this turned out to not be useful
         stream.writeEvent(
             "A",
-            json.dumps(
+            codec.encode_event(
                 {
                     "event_time": event_time,
                     "event_type": "lost_package",
@@ -209,8 +786,123 @@ def report_lost_packages_to_stream(stream, redis, event_time):
         )
 
 
-def update_next_event_time(input_event_stream, redis=None):
-    """save next expected event time into redis"""
+class NextEventTimeBatch:
+    """next expected event updates for packages, sent to redis in one pipeline
+
+    only the last update for each package_id is sent. Updates are sent when
+    batch_size packages are pending, or when flushed
+    """
+
+    def __init__(self, redis, sorting_center_code, batch_size=REDIS_BATCH_SIZE):
+        self.redis = redis
+        self.sorting_center_code = sorting_center_code
+        self.batch_size = batch_size
+        # package_id: (next_event_time, next_scanner_id, next_sorting_center)
+        self.pending = {}
+
+    def update(
+        self,
+        package_id,
+        next_event_time,
+        next_scanner_id=None,
+        next_sorting_center=None,
+    ):
+        """set next expected event of package_id, next_event_time None if there is none"""
+        if next_event_time and next_scanner_id is None:
+            # keep next scanner id of an earlier update in this batch
+            previous = self.pending.get(package_id)
+            if previous and previous[0]:
+                next_scanner_id = previous[1]
+        self.pending[package_id] = (
+            next_event_time,
+            next_scanner_id,
+            next_sorting_center or self.sorting_center_code,
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """send pending updates to redis"""
+        if not self.pending:
+            return
+
+        pipeline = self.redis.pipelined()
+        finished_package_ids = []
+        moved_package_ids = []  # now expected in another sorting center
+        for package_id, (
+            next_event_time,
+            next_scanner_id,
+            next_sorting_center,
+        ) in self.pending.items():
+            if next_event_time:
+                # insert member with next_event_time as score
+                pipeline.zadd(
+                    REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % next_sorting_center,
+                    next_event_time,
+                    package_id,
+                )
+                if next_scanner_id:
+                    pipeline.hset(
+                        REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
+                        package_id,
+                        next_scanner_id,
+                    )
+                if next_sorting_center != self.sorting_center_code:
+                    moved_package_ids.append(package_id)
+            else:
+                finished_package_ids.append(package_id)
+        if finished_package_ids or moved_package_ids:
+            # remove from next events of this sorting center
+            pipeline.zrem(
+                REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % self.sorting_center_code,
+                finished_package_ids + moved_package_ids,
+            )
+        if finished_package_ids:
+            pipeline.hdel(REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME, finished_package_ids)
+        # remove these package_ids from late package hash
+        pipeline.srem(REDIS_LATE_PACKAGE_HASH_NAME, list(self.pending))
+        pipeline.sync()
+        self.pending.clear()
+
+
+def update_next_event_time(
+    input_event_stream, redis=None, next_event_times=None, batched=False
+):
+    """save next expected event time into redis
+
+    if next_event_times is set, updates go to it instead of being sent to redis
+    one event at a time, e.g. a NextEventTimeBatch or LocalNextEventTimes. If
+    batched, the updates of a batch sent to redis directly share a pipeline
+    """
+    if batched:
+        for batch in input_event_stream:
+            if next_event_times:
+                for event in batch:
+                    if event["scanner_id"] == CHECKPOINT_SCANNER_ID:
+                        next_event_times.flush()
+                    else:
+                        store_next_event_time(next_event_times, event)
+            elif redis:
+                pipeline = redis.pipelined()
+                for event in batch:
+                    if event["scanner_id"] != CHECKPOINT_SCANNER_ID:
+                        send_next_event_time(pipeline, event)
+                pipeline.sync()
+            yield batch
+        if next_event_times:
+            next_event_times.flush()
+        return
+
+    if next_event_times:
+        for event in input_event_stream:
+            if event["scanner_id"] == CHECKPOINT_SCANNER_ID:
+                next_event_times.flush()
+            else:
+                store_next_event_time(next_event_times, event)
+            yield event
+        next_event_times.flush()
+        return
+
     if not redis:
         for event in input_event_stream:
             # yield from not supported in jython
@@ -218,43 +910,97 @@ def update_next_event_time(input_event_stream, redis=None):
         return
 
     for event in input_event_stream:
-        package_id = event["package_id"]
-        next_event_time = event.get("next_event_time")
+        if event["scanner_id"] != CHECKPOINT_SCANNER_ID:
+            send_next_event_time(redis, event)
+        yield event
 
-        if next_event_time:
-            # insert member with next_event_time as score
-            redis.zadd(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME, next_event_time, package_id)
-            if "next_scanner_id" in event:
-                redis.hset(
-                    REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
-                    package_id,
-                    "%s/%s"
-                    % (
-                        event.get("next_sorting_center", event["sorting_center"]),
-                        event["next_scanner_id"],
-                    ),
-                )
-            # remove this package_id from late package hash
-            redis.srem(REDIS_LATE_PACKAGE_HASH_NAME, package_id)
-        else:
-            # remove from next events
-            redis.zrem(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME, package_id)
-            # remove from next scanner id
-            redis.hdel(REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME, package_id)
-            # remove this package_id from late package hash
-            redis.srem(REDIS_LATE_PACKAGE_HASH_NAME, package_id)
 
-        yield event
+def store_next_event_time(next_event_times, event):
+    """update next expected event of the package of event in next_event_times"""
+    next_event_time = event.get("next_event_time")
+    next_sorting_center = event.get("next_sorting_center", event["sorting_center"])
+    if next_event_time and "next_scanner_id" in event:
+        next_scanner_id = "%s/%s" % (next_sorting_center, event["next_scanner_id"])
+    else:
+        next_scanner_id = None
+    next_event_times.update(
+        event["package_id"], next_event_time, next_scanner_id, next_sorting_center
+    )
+
+
+def send_next_event_time(redis, event):
+    """send next expected event of the package of event to redis, or a redis pipeline"""
+    package_id = event["package_id"]
+    next_event_time = event.get("next_event_time")
+    sorting_center = event["sorting_center"]
+    next_sorting_center = event.get("next_sorting_center", sorting_center)
+
+    if next_event_time:
+        # insert member with next_event_time as score, in the next events
+        # of the sorting center where it is expected
+        redis.zadd(
+            REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % next_sorting_center,
+            next_event_time,
+            package_id,
+        )
+        if next_sorting_center != sorting_center:
+            redis.zrem(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % sorting_center, package_id)
+        if "next_scanner_id" in event:
+            redis.hset(
+                REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
+                package_id,
+                "%s/%s" % (next_sorting_center, event["next_scanner_id"]),
+            )
+        # remove this package_id from late package hash
+        redis.srem(REDIS_LATE_PACKAGE_HASH_NAME, package_id)
+    else:
+        # remove from next events
+        redis.zrem(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % sorting_center, package_id)
+        # remove from next scanner id
+        redis.hdel(REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME, package_id)
+        # remove this package_id from late package hash
+        redis.srem(REDIS_LATE_PACKAGE_HASH_NAME, package_id)
 
 
 def detect_delayed_packages(
-    input_event_stream, trouble_stream, redis, sorting_center_code
+    input_event_stream,
+    trouble_stream,
+    sweep,
+    sorting_center_code,
+    codec,
+    next_event_times=None,
+    batched=False,
 ):
-    """check redis for delayed events, report them to another stream"""
+    """check for delayed events with sweep, report them to another stream
+
+    sweep is a DelayedPackageSweep or LocalNextEventTimes.sweep, pending
+    updates in next_event_times are flushed before checking. If batched, the
+    check is after a batch ending with the first event of a check interval
+    """
+    if batched:
+        last_interval = None
+        for batch in input_event_stream:
+            yield batch
+            event = batch[-1]
+            if event["scanner_id"] == CHECKPOINT_SCANNER_ID:
+                continue
+            event_time = event["event_time"]
+            interval = check_interval(event_time)
+            if last_interval is not None and interval != last_interval:
+                if next_event_times:
+                    next_event_times.flush()
+                report_delayed_packages(
+                    sweep, trouble_stream, event_time, sorting_center_code, codec
+                )
+            last_interval = interval
+        return
+
     last_event_seconds = 0
     for event in input_event_stream:
         event_time = event["event_time"]
         yield event
+        if event["scanner_id"] == CHECKPOINT_SCANNER_ID:
+            continue
         if not last_event_seconds:
             last_event_seconds = divmod(
                 event_time, DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY
@@ -266,105 +1012,346 @@ def detect_delayed_packages(
                 last_event_seconds = divmod(
                     event_time, DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY
                 )
+                if next_event_times:
+                    next_event_times.flush()
                 report_delayed_packages(
-                    redis, trouble_stream, event_time, sorting_center_code
+                    sweep, trouble_stream, event_time, sorting_center_code, codec
                 )
 
 
-def report_delayed_packages(redis, stream, event_time, sorting_center_code):
-    """ask redis for package ids whose next event should have occurred by now"""
-    packages_to_remove = []
-
-    # simulation requires the 'earliest current event time' to be synchronized
-    # among all the sorting centers, otherwise one process runs ahead of the others
-    # it will detect delayed packages that haven't had a chance to be processed
-    # in other sorting centers
-
-    # vote on current time
-    redis.zadd(REDIS_CLOCK_SYNC_KEY_NAME, event_time, sorting_center_code)
-    earlier_event_times = list(
-        redis.zrangeByScoreWithScores(REDIS_CLOCK_SYNC_KEY_NAME, 0, event_time)
-    )
-    if earlier_event_times:
-        earliest_event_time = earlier_event_times[0]
-        time_difference = event_time - int(earliest_event_time.score)
-        if time_difference > SLEEP_THIS_PROCESS_WHEN_TIME_SYNC_DIFFERENCE_EXCEEDS:
-            # give other processes a chance to catch up
-            if DEBUG_TIME_SYNC:
-                logger.debug(
-                    "sort center %r is at time %r, time difference %r, sleeping",
-                    earliest_event_time.element,
-                    int(earliest_event_time.score),
-                    time_difference,
-                )
-            time.sleep(SLEEP_PROCESS_TIME)
-        event_time = int(earliest_event_time.score)
+def complete_checkpoints(
+    input_event_stream, checkpoints, trouble_stream, batched=False
+):
+    """take checkpoints when they are due, wait at checkpoint markers for the other readers
 
-    for delayed_package_info in list(
-        redis.zrangeByScoreWithScores(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME, 0, event_time)
-    ):
-        package_id = delayed_package_info.element
-        expected_event_time = int(delayed_package_info.score)
-        if event_time - expected_event_time < MINIMUM_LATE_PACKAGE_SECONDS:
-            # not actually late yet
-            continue
+    events before a marker have passed all stages, trouble events are flushed
+    before the local state is captured. If batched, markers are batches of
+    their own
+    """
+    if not checkpoints:
+        for event in input_event_stream:
+            yield event
+        return
 
-        if redis.sadd(REDIS_LATE_PACKAGE_HASH_NAME, package_id):
-            next_scanner_id = (
-                redis.hget(REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME, package_id) or None
+    failed = True
+    try:
+        for item in input_event_stream:
+            event = item[-1] if batched else item
+            if event["scanner_id"] == CHECKPOINT_SCANNER_ID:
+                trouble_stream.flush()
+                checkpoints.reached(event)
+            else:
+                checkpoints.poll()
+            yield item
+        failed = False
+    finally:
+        checkpoints.finish(failed)
+
+
+class DelayedPackageSweep:
+    """runs DELAYED_PACKAGE_SWEEP_SCRIPT, loaded into redis once
+
+    packages are late by the watermark of the sorting center where their next
+    event is expected, only that sorting center can scan them. With
+    maximum_skew, a sorting center more than maximum_skew seconds ahead of the
+    global watermark blocks until the sorting centers behind it catch up, it
+    is woken by the sweep that moves the global watermark
+    """
+
+    def __init__(self, redis, maximum_skew=None):
+        self.redis = redis
+        self.maximum_skew = maximum_skew
+        self.sha = redis.scriptLoad(DELAYED_PACKAGE_SWEEP_SCRIPT)
+        self.wait_sha = redis.scriptLoad(WATERMARK_WAIT_SCRIPT)
+
+    def __call__(self, event_time, sorting_center_code):
+        """publish event_time as watermark, return it, sorting_center_code and newly late packages
+
+        newly late packages are (package_id, expected_event_time, next_scanner_id)
+        """
+        global_watermark, late_packages = self.publish(event_time, sorting_center_code)
+        if (
+            self.maximum_skew is not None
+            and event_time - global_watermark > self.maximum_skew
+        ):
+            self.wait(sorting_center_code, event_time - self.maximum_skew)
+            # packages sent here by the others meanwhile
+            late_packages.extend(self.publish(event_time, sorting_center_code)[1])
+        return event_time, sorting_center_code, late_packages
+
+    def publish(self, watermark, sorting_center_code):
+        """publish watermark, return global watermark and newly late packages"""
+        result = list(
+            self.redis.evalsha(
+                self.sha,
+                [
+                    REDIS_WATERMARK_KEY_NAME,
+                    REDIS_PACKAGE_NEXT_EVENT_KEY_NAME % sorting_center_code,
+                    REDIS_LATE_PACKAGE_HASH_NAME,
+                    REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
+                    REDIS_WATERMARK_WAITING_KEY_NAME,
+                ],
+                [
+                    str(watermark),
+                    sorting_center_code,
+                    str(MINIMUM_LATE_PACKAGE_SECONDS),
+                    REDIS_WATERMARK_WAKE_KEY_NAME,
+                ],
             )
-            logger.warn(
-                "delayed package %s expected %s late %s at %s",
-                package_id,
-                datetime.datetime.fromtimestamp(expected_event_time).strftime(
-                    "%m-%d %H:%M"
-                ),
-                datetime.timedelta(seconds=event_time - expected_event_time),
-                next_scanner_id,
+        )
+        late_packages = [
+            (result[idx], int(float(result[idx + 1])), result[idx + 2] or None)
+            for idx in range(2, len(result), 3)
+        ]
+        return int(result[0]), late_packages
+
+    def wait(self, sorting_center_code, watermark):
+        """block until the global watermark reaches watermark"""
+        wake_key = REDIS_WATERMARK_WAKE_KEY_NAME % sorting_center_code
+        start_time = time.time()
+        while True:
+            global_watermark, earliest_sorting_center = self.redis.evalsha(
+                self.wait_sha,
+                [
+                    REDIS_WATERMARK_KEY_NAME,
+                    REDIS_WATERMARK_WAITING_KEY_NAME,
+                    wake_key,
+                ],
+                [sorting_center_code, str(watermark)],
             )
+            global_watermark = int(global_watermark)
+            if global_watermark >= watermark:
+                return
+
+            if self.redis.blpop(WATERMARK_WAIT_TIMEOUT, wake_key) is None:
+                logger.info(
+                    "waited %.0fs for sorting center %s at watermark %s",
+                    time.time() - start_time,
+                    earliest_sorting_center,
+                    global_watermark,
+                )
 
-            # write to trouble stream
-            stream.noteTime(event_time)  # this turned out to not be useful
-            stream.writeEvent(
-                sorting_center_code,
-                json.dumps(
-                    {
-                        "event_time": event_time,
-                        "event_type": "delayed_package",
-                        "package_id": package_id,
-                        "expected_event_time": expected_event_time,
-                        "sorting_center": sorting_center_code,
-                        "next_scanner_id": next_scanner_id,
-                    }
-                ),
-            )
-            packages_to_remove.append(package_id)
 
-    if packages_to_remove:
-        # remove these packages from the 'late' list so they don't report over and over
-        redis.zrem(REDIS_PACKAGE_NEXT_EVENT_KEY_NAME, packages_to_remove)
+def maximum_watermark_skew(topology):
+    """return seconds a sorting center may be ahead of the global watermark
+
+    a package's events in the next sorting center are at least a truck trip
+    after its events in this one. A sorting center ahead by less never updates
+    the package before the sorting center it came from, watermarks are
+    published once per check interval. None if there is one sorting center
+    """
+    travel_time = topology.minimum_truck_travel_time()
+    if travel_time is None:
+        return None
+    return max(0, travel_time * 60 - 2 * DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY)
+
+
+class LocalNextEventTimes:
+    """next expected events of packages in process, for a standalone sorting center
+
+    same interface as NextEventTimeBatch and DelayedPackageSweep, without
+    redis. There is no watermark shared with other sorting centers, packages
+    leaving for another sorting center are no longer checked. Late packages
+    are reported once, those not seen again are the lost packages at the end
+    of the stream. If snapshot_file
+    is set, state is loaded from it at start and saved to it every
+    snapshot_interval wall-clock seconds, so a restarted process keeps its
+    pending deadlines
+    """
+
+    def __init__(
+        self,
+        snapshot_file=None,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+        sorting_center_code=None,
+    ):
+        self.sorting_center_code = sorting_center_code
+        self.deadlines = DeadlineIndex(
+            bucket_width=DELAYED_PACKAGE_EVENT_CHECK_FREQUENCY
+        )
+        self.late_package_ids = set()
+        self.lock = threading.Lock()  # shared by reader threads
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_time = time.time()
+        if snapshot_file:
+            self.load()
+
+    def update(
+        self,
+        package_id,
+        next_event_time,
+        next_scanner_id=None,
+        next_sorting_center=None,
+    ):
+        """set next expected event of package_id, next_event_time None if there is none
+
+        packages expected next in another sorting center are no longer
+        checked, that sorting center checks them
+        """
+        with self.lock:
+            if next_event_time and next_sorting_center in (
+                None,
+                self.sorting_center_code,
+            ):
+                if next_scanner_id is None:
+                    next_scanner_id = self.deadlines.get(package_id, (None, None))[1]
+                self.deadlines.schedule(package_id, next_event_time, next_scanner_id)
+            else:
+                self.deadlines.cancel(package_id)
+            self.late_package_ids.discard(package_id)
+
+    def flush(self):
+        """updates take effect immediately, save a snapshot when it is due"""
+        if (
+            self.snapshot_file
+            and time.time() - self.snapshot_time >= self.snapshot_interval
+        ):
+            self.save()
+
+    def sweep(self, event_time, sorting_center_code):
+        """return event_time, sorting_center_code and newly late packages"""
+        with self.lock:
+            expired = self.deadlines.expire(event_time - MINIMUM_LATE_PACKAGE_SECONDS)
+            late_packages = []
+            for expected_event_time, package_id, next_scanner_id in expired:
+                if package_id in self.late_package_ids:
+                    # already reported, e.g. before a restore
+                    continue
+                self.late_package_ids.add(package_id)
+                late_packages.append(
+                    (package_id, int(expected_event_time), next_scanner_id)
+                )
+        return event_time, sorting_center_code, late_packages
+
+    def state(self):
+        """return deadlines and late packages as json state"""
+        with self.lock:
+            return {
+                "deadlines": list(self.deadlines.items()),
+                "late_package_ids": list(self.late_package_ids),
+            }
+
+    def restore(self, state):
+        """add deadlines and late packages from json state"""
+        with self.lock:
+            for package_id, next_event_time, next_scanner_id in state["deadlines"]:
+                self.deadlines.schedule(package_id, next_event_time, next_scanner_id)
+            self.late_package_ids.update(state["late_package_ids"])
+
+    def save(self):
+        """save deadlines and late packages to snapshot_file"""
+        if not self.snapshot_file:
+            return
+        state = self.state()
+        self.snapshot_time = time.time()
+        save_snapshot(self.snapshot_file, state)
+        logger.debug(
+            "saved %d deadlines to %s", len(self.deadlines), self.snapshot_file
+        )
+
+    def load(self):
+        """load deadlines and late packages from snapshot_file, if it exists"""
+        state = load_snapshot(self.snapshot_file)
+        if state is None:
+            return
+        self.restore(state)
+        logger.info(
+            "loaded %d deadlines and %d late packages from %s",
+            len(self.deadlines),
+            len(self.late_package_ids),
+            self.snapshot_file,
+        )
+
+
+def report_delayed_packages(sweep, stream, event_time, sorting_center_code, codec):
+    """ask redis for package ids whose next event should have occurred by now"""
+
+    # the sweep publishes event_time as this sorting center's watermark and
+    # returns packages expected here that are late by it, already marked as
+    # late and removed from the next event set by the sweep script. Sorting
+    # centers don't run too far ahead of each other, so packages sent here by
+    # another sorting center have been added to the set before they are due
+    event_time, sorting_center_code, late_packages = sweep(
+        event_time, sorting_center_code
+    )
+
+    for package_id, expected_event_time, next_scanner_id in late_packages:
+        logger.warn(
+            "delayed package %s expected %s late %s at %s",
+            package_id,
+            datetime.datetime.fromtimestamp(expected_event_time).strftime(
+                "%m-%d %H:%M"
+            ),
+            datetime.timedelta(seconds=event_time - expected_event_time),
+            next_scanner_id,
+        )
+
+        # write to trouble stream
+        stream.noteTime(event_time)  # this turned out to not be useful
+        stream.writeEvent(
+            sorting_center_code,
+            codec.encode_event(
+                {
+                    "event_time": event_time,
+                    "event_type": "delayed_package",
+                    "package_id": package_id,
+                    "expected_event_time": expected_event_time,
+                    "sorting_center": sorting_center_code,
+                    "next_scanner_id": next_scanner_id,
+                }
+            ),
+        )
 
 
-def save_streamcut_timestamps(input_event_stream):
-    """save streamcuts every hour somewhere so we can rewind the stream"""
-    # to make it more efficient to extract events for a specific package_id in the future
+def save_streamcut_timestamps(
+    input_event_stream, streamcut_index=None, batched=False
+):
+    """save streamcuts every hour in streamcut_index so we can rewind the stream"""
+    # to make it more efficient to extract events for a specific package_id
     # we can rewind to the probable location of the first tracking event
     # then read forward.
-    # due to short-time on the hackathon, I'm not going to actually implement this
-    # to rewind a stream, we need a StreamCut, which can be created by
-    # reader_group.generateStreamCuts  We can then save the streamCut by serializing it
-    # posting back to another stream or kvt or wherever.
-    for event_read in input_event_stream:
-        # when event time rolls over to the 'next' hour
-        # create a StreamCut and save it for future use
-        yield event_read
+    if batched:
+        for batch in input_event_stream:
+            if streamcut_index:
+                for event in batch:
+                    mark_streamcut_timestamp(streamcut_index, event)
+            yield batch
+        return
+
+    for event in input_event_stream:
+        if streamcut_index:
+            mark_streamcut_timestamp(streamcut_index, event)
+        yield event
+
+
+def mark_streamcut_timestamp(streamcut_index, event):
+    """when event time rolls over to the 'next' hour save the StreamCut of the reader group"""
+    if event.get("scanner_id") not in ("end-of-stream", CHECKPOINT_SCANNER_ID):
+        streamcut_index.mark(event["event_time"])
 
 
 def record_intake_and_weight_and_output(
-    input_event_stream, uri, scope, trouble_stream, sorting_center_code
+    input_event_stream,
+    uri,
+    scope,
+    trouble_stream,
+    sorting_center_code,
+    codec,
+    cache_size=CACHE_SIZE,
+    cache_flush_size=FLUSH_SIZE,
+    maximum_in_flight=KVT_IN_FLIGHT,
+    batched=False,
 ):
-    """save attributes about the package in kvt table that is shared between sorting centers"""
-    serializer = UTF8StringSerializer()  # cannot get kvt to work with JavaSerializer
+    """save attributes about the package in kvt table that is shared between sorting centers
+
+    if cache_size is set, records are cached and written behind by a
+    KeyValueTableCache instead of a blocking get and put for every event.
+    With maximum_in_flight, records of that many upcoming events are read
+    ahead, events are still applied in order. If batched, the records of each
+    batch are read together, see record_package_attributes
+    """
+    key_serializer = UTF8StringSerializer()  # cannot get kvt to work with JavaSerializer
     kvt_table_name = PACKAGE_ATTRIBUTES_KVT_NAME
     with keyValueTableManager(uri) as kvt_manager:
         key_value_table_configuration = keyValueTableConfiguration()
@@ -379,39 +1366,187 @@ def record_intake_and_weight_and_output(
         )
         with keyValueTableFactory(uri, scope) as kvt_factory:
             with keyValueTable(
-                kvt_factory, kvt_table_name, serializer, serializer
+                kvt_factory, kvt_table_name, key_serializer, codec.serializer
             ) as kvt_table:
-                for event in input_event_stream:
-                    scanner_id = event["scanner_id"]
-                    if scanner_id not in ("intake", "weighing", "output"):
-                        yield event
-                        continue
-
-                    # need to update or create kvt entry
-                    package_id = event["package_id"]
-                    kvt_entry = kvt_table.get(None, package_id).join()
-                    value_data = json.loads(kvt_entry.getValue()) if kvt_entry else {}
-                    if scanner_id == "weighing":
-                        value_data["weight"] = event["weight"]
-                    elif scanner_id == "output":
-                        value_data["delivered_time"] = event["event_time"]
-                        report_late_delivery(
-                            package_id, value_data, trouble_stream, sorting_center_code
+                if cache_size:
+                    cache = KeyValueTableCache(
+                        kvt_table,
+                        codec.encode_package_attributes,
+                        codec.decode,
+                        cache_size=cache_size,
+                        flush_size=cache_flush_size,
+                        name="%s cache %s" % (kvt_table_name, sorting_center_code),
+                    )
+                    if maximum_in_flight and not batched:
+                        input_event_stream = read_ahead(
+                            input_event_stream,
+                            maximum_in_flight,
+                            prefetch_package_attributes(cache),
                         )
-                    else:
-                        value_data["intake_time"] = event["event_time"]
-                        value_data["destination"] = event["destination"]
-                        value_data["origin"] = event["sorting_center"]
-                        value_data["declared_value"] = event["declared_value"]
-                        value_data["estimated_delivery_time"] = event[
-                            "estimated_delivery_time"
-                        ]
+                else:
+                    cache = None
+                try:
+                    if batched:
+                        for batch in input_event_stream:
+                            record_package_attributes(
+                                batch,
+                                kvt_table,
+                                cache,
+                                trouble_stream,
+                                sorting_center_code,
+                                codec,
+                            )
+                            yield batch
+                        return
+
+                    for event in input_event_stream:
+                        scanner_id = event["scanner_id"]
+                        if scanner_id not in PACKAGE_ATTRIBUTE_SCANNER_IDS:
+                            if scanner_id == CHECKPOINT_SCANNER_ID and cache:
+                                cache.flush(wait=True)
+                            elif cache:
+                                # don't hold updates while no package attributes change
+                                cache.flush_if_due()
+                            yield event
+                            continue
+
+                        # need to update or create kvt entry
+                        package_id = event["package_id"]
+                        if cache:
+                            value_data = dict(cache.get(package_id))
+                        else:
+                            kvt_entry = kvt_table.get(None, package_id).join()
+                            value_data = (
+                                codec.decode(kvt_entry.getValue()) if kvt_entry else {}
+                            )
+                        fields = package_attribute_fields(event)
+                        value_data.update(fields)
+                        if scanner_id == "output":
+                            report_late_delivery(
+                                package_id,
+                                value_data,
+                                trouble_stream,
+                                sorting_center_code,
+                                codec,
+                            )
+
+                        if cache:
+                            cache.update(package_id, fields)
+                        else:
+                            kvt_table.put(
+                                None,
+                                package_id,
+                                codec.encode_package_attributes(value_data),
+                            ).join()
+                        yield event
+                finally:
+                    if cache:
+                        cache.close()
+
+
+def package_attribute_fields(event):
+    """return package attributes recorded for an intake, weighing or output event"""
+    scanner_id = event["scanner_id"]
+    if scanner_id == "weighing":
+        return {"weight": event["weight"]}
+    if scanner_id == "output":
+        return {"delivered_time": event["event_time"]}
+    return {
+        "intake_time": event["event_time"],
+        "destination": event["destination"],
+        "origin": event["sorting_center"],
+        "declared_value": event["declared_value"],
+        "estimated_delivery_time": event["estimated_delivery_time"],
+    }
+
+
+def record_package_attributes(
+    batch, kvt_table, cache, trouble_stream, sorting_center_code, codec
+):
+    """save package attributes of a batch of events
+
+    with a cache, the records of the batch are prefetched before the first
+    update. Without, each record is read and written once for the whole
+    batch, all reads and then all writes in flight at the same time
+    """
+    events = [_ for _ in batch if _["scanner_id"] in PACKAGE_ATTRIBUTE_SCANNER_IDS]
+    if cache:
+        cache.flush_if_due()
+        for event in events:
+            cache.prefetch(event["package_id"])
+        for event in events:
+            package_id = event["package_id"]
+            fields = package_attribute_fields(event)
+            if event["scanner_id"] == "output":
+                value_data = dict(cache.get(package_id))
+                value_data.update(fields)
+                report_late_delivery(
+                    package_id, value_data, trouble_stream, sorting_center_code, codec
+                )
+            cache.update(package_id, fields)
+        if batch[-1]["scanner_id"] == CHECKPOINT_SCANNER_ID:
+            cache.flush(wait=True)
+        return
 
-                    kvt_table.put(None, package_id, json.dumps(value_data)).join()
-                    yield event
+    reads = collections.OrderedDict()
+    for event in events:
+        package_id = event["package_id"]
+        if package_id not in reads:
+            reads[package_id] = kvt_table.get(None, package_id)
+    records = {}
+    for package_id, future in reads.items():
+        kvt_entry = future.join()
+        records[package_id] = codec.decode(kvt_entry.getValue()) if kvt_entry else {}
+    for event in events:
+        package_id = event["package_id"]
+        value_data = records[package_id]
+        value_data.update(package_attribute_fields(event))
+        if event["scanner_id"] == "output":
+            report_late_delivery(
+                package_id, value_data, trouble_stream, sorting_center_code, codec
+            )
+    writes = [
+        kvt_table.put(None, package_id, codec.encode_package_attributes(value_data))
+        for package_id, value_data in records.items()
+    ]
+    for future in writes:
+        future.join()
+
+
+def read_ahead(input_event_stream, maximum_in_flight, prefetch):
+    """yield events maximum_in_flight events after calling prefetch(event) for them"""
+    window = collections.deque()
+    for event in input_event_stream:
+        prefetch(event)
+        window.append(event)
+        if len(window) > maximum_in_flight:
+            yield window.popleft()
+    while window:
+        yield window.popleft()
+
+
+def prefetch_package_attributes(cache):
+    """return prefetch function for events that update package attributes"""
+
+    def prefetch(event):
+        if event["scanner_id"] in PACKAGE_ATTRIBUTE_SCANNER_IDS:
+            cache.prefetch(event["package_id"])
 
+    return prefetch
 
-def report_late_delivery(package_id, value_data, trouble_stream, sorting_center_code):
+
+def completed_events(in_flight, maximum_in_flight):
+    """yield events from deque of (event, future) beyond maximum_in_flight, once complete"""
+    while len(in_flight) > maximum_in_flight:
+        event, future = in_flight.popleft()
+        if future is not None:
+            future.join()
+        yield event
+
+
+def report_late_delivery(
+    package_id, value_data, trouble_stream, sorting_center_code, codec
+):
     """if this package was delivered late, report it"""
     if "estimated_delivery_time" not in value_data:
         return
@@ -430,7 +1565,7 @@ def report_late_delivery(package_id, value_data, trouble_stream, sorting_center_
         trouble_stream.noteTime(event_time)
         trouble_stream.writeEvent(
             sorting_center_code,
-            json.dumps(
+            codec.encode_event(
                 {
                     "event_time": event_time,
                     "event_type": "late_delivery",
@@ -442,12 +1577,31 @@ def report_late_delivery(package_id, value_data, trouble_stream, sorting_center_
         )
 
 
-def record_public_tracking_events(input_event_stream, uri, scope):
-    """save public package events in kvt table that is shared between sorting centers"""
+def public_tracking_event_key(event_time):
+    """return kvt key of a public tracking event within its package key family"""
+    return "%012d" % event_time
+
+
+def record_public_tracking_events(
+    input_event_stream,
+    uri,
+    scope,
+    public_scanner_ids,
+    codec,
+    maximum_in_flight=KVT_IN_FLIGHT,
+    batched=False,
+):
+    """save public package events in kvt table that is shared between sorting centers
+
+    each event is written once, in the package_id key family under a key
+    derived from event_time. Writes don't read the table and repeating one
+    is harmless. Up to maximum_in_flight writes are sent before waiting for
+    the oldest, events are yielded in order once their write completed. If
+    batched, the writes of a batch are sent together instead
+    """
     # used to show public tracking results to customer
-    serializer = UTF8StringSerializer()  # cannot get kvt to work with JavaSerializer
+    key_serializer = UTF8StringSerializer()  # cannot get kvt to work with JavaSerializer
     kvt_table_name = PACKAGE_EVENTS_KVT_NAME
-    sorted_event_key = operator.itemgetter("event_time")
     with keyValueTableManager(uri) as kvt_manager:
         key_value_table_configuration = keyValueTableConfiguration()
         created = kvt_manager.createKeyValueTable(
@@ -461,56 +1615,147 @@ def record_public_tracking_events(input_event_stream, uri, scope):
         )
         with keyValueTableFactory(uri, scope) as kvt_factory:
             with keyValueTable(
-                kvt_factory, kvt_table_name, serializer, serializer
+                kvt_factory, kvt_table_name, key_serializer, codec.serializer
             ) as kvt_table:
+                if batched:
+                    for batch in input_event_stream:
+                        writes = [
+                            put_public_tracking_event(kvt_table, event, codec)
+                            for event in batch
+                            if event["scanner_id"] in public_scanner_ids
+                        ]
+                        for future in writes:
+                            future.join()
+                        yield batch
+                    return
+
+                in_flight = collections.deque()
                 for event in input_event_stream:
                     scanner_id = event["scanner_id"]
-                    if scanner_id not in PUBLIC_SCANNER_EVENTS:
-                        yield event
-                        continue
-
-                    # need to update or create kvt entry
-                    package_id = event["package_id"]
-                    event_time = event["event_time"]
-                    kvt_entry = kvt_table.get(None, package_id).join()
-                    value_data = json.loads(kvt_entry.getValue()) if kvt_entry else []
-                    event_times = [_["event_time"] for _ in value_data]
-                    if event_time not in event_times:
-                        # add this event to list
-                        value_data.append(
-                            {
-                                "event_time": event_time,
-                                "sorting_center": event["sorting_center"],
-                                "scanner_id": event["scanner_id"],
-                            }
-                        )
-                        kvt_table.put(
-                            None,
-                            package_id,
-                            json.dumps(sorted(value_data, key=sorted_event_key)),
-                        ).join()
-                    yield event
+                    if scanner_id in public_scanner_ids:
+                        future = put_public_tracking_event(kvt_table, event, codec)
+                    else:
+                        future = None
+                    in_flight.append((event, future))
+                    for completed_event in completed_events(
+                        in_flight,
+                        0 if scanner_id == CHECKPOINT_SCANNER_ID else maximum_in_flight,
+                    ):
+                        yield completed_event
+                for completed_event in completed_events(in_flight, 0):
+                    yield completed_event
+
+
+def put_public_tracking_event(kvt_table, event, codec):
+    """return future of the write of a public tracking event"""
+    event_time = event["event_time"]
+    return kvt_table.put(
+        event["package_id"],
+        public_tracking_event_key(event_time),
+        codec.encode_package_events(
+            [
+                {
+                    "event_time": event_time,
+                    "sorting_center": event["sorting_center"],
+                    "scanner_id": event["scanner_id"],
+                }
+            ]
+        ),
+    )
+
+
+def read_public_tracking_events(uri, scope, package_id, codec=None):
+    """return public events of package_id, ordered by event_time"""
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    key_serializer = UTF8StringSerializer()
+    package_events = []
+    with keyValueTableFactory(uri, scope) as kvt_factory:
+        with keyValueTable(
+            kvt_factory, PACKAGE_EVENTS_KVT_NAME, key_serializer, codec.serializer
+        ) as kvt_table:
+            for entry in keyFamilyEntries(kvt_table, package_id):
+                package_events.extend(codec.decode(entry.getValue()))
+    package_events.sort(key=operator.itemgetter("event_time"))
+    return package_events
+
+
+def package_arrival_time(uri, scope, sorting_center_code, package_id, codec=None):
+    """return time package_id was first seen in a sorting center, from its public events
+
+    None if the package has no public events in the sorting center
+    """
+    arrival_times = [
+        _["event_time"]
+        for _ in read_public_tracking_events(uri, scope, package_id, codec)
+        if _["sorting_center"] == sorting_center_code
+    ]
+    return min(arrival_times) if arrival_times else None
 
 
 def extract_sorting_center_events_by_package_id(
-    uri, scope, sorting_center_code, package_id
+    uri,
+    scope,
+    sorting_center_code,
+    package_id,
+    topology=DEFAULT_TOPOLOGY,
+    codec=None,
+    start_time=None,
 ):
-    """yield events for only this package_id, used by cli for debugging"""
-    # if we were saving StreamCuts, then we could look up the package_id from master kvt to
-    # find initial import timestamp for this sorting center, then configure
-    # this ReaderGroup to start at that StreamCut
-
-    serializer = UTF8StringSerializer()
+    """yield events for only this package_id, used by cli for debugging
+
+    reading starts at the hourly StreamCut for start_time, by default the time
+    the package arrived in the sorting center according to its public tracking
+    events. Without those, the stream is read from the start
+    """
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    if start_time is None:
+        start_time = package_arrival_time(
+            uri, scope, sorting_center_code, package_id, codec
+        )
+        logger.debug("package %s arrived at %s", package_id, start_time)
     with streamManager(uri=uri) as stream_manager:
         # input stream must already exist
-        input_stream_name = SORTING_CENTER_TO_STREAM_NAME[sorting_center_code]
-        logger.debug("begin reading from stream %r", input_stream_name)
-        input_event_stream = iterable_stream(uri, scope, input_stream_name, serializer)
-        for event in filter_events_by_package_id(input_event_stream, package_id):
+        input_event_stream = read_events_from_time(
+            uri, scope, sorting_center_code, start_time, topology, codec
+        )
+        for event in follow_package_events(
+            input_event_stream, package_id, sorting_center_code, start_time
+        ):
+            yield event
+
+
+def read_events_from_time(
+    uri,
+    scope,
+    sorting_center_code,
+    start_time=None,
+    topology=DEFAULT_TOPOLOGY,
+    codec=None,
+):
+    """yield events of a sorting center input stream from start_time on
+
+    reading starts at the StreamCut saved for the hour of start_time, or at the
+    start of the stream if there is none
+    """
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    input_stream_name = topology.stream_name(sorting_center_code)
+    start_stream_cut = None
+    if start_time is not None:
+        with streamCutIndex(uri, scope, sorting_center_code) as streamcut_index:
+            start_stream_cut = streamcut_index.find(start_time)
+    logger.debug(
+        "begin reading from stream %r %s",
+        input_stream_name,
+        "at streamcut" if start_stream_cut else "from the start",
+    )
+    for event in iterable_stream(
+        uri, scope, input_stream_name, codec, start_stream_cut=start_stream_cut
+    ):
+        if start_time is None or event["event_time"] >= start_time:
             yield event
-            if event.get("scanner_id") == "output":
-                # just to speed it up
-                break
 
 
 def filter_events_by_package_id(input_stream, package_id):
@@ -521,6 +1766,34 @@ def filter_events_by_package_id(input_stream, package_id):
         yield event
 
 
+def follow_package_events(
+    input_stream, package_id, sorting_center_code, expected_event_time=None
+):
+    """yield events for package_id until its last event in the sorting center
+
+    also stops when the stream is EXTRACT_GRACE_PERIOD past the next event
+    expected for the package, e.g. because it was lost
+    """
+    for event in input_stream:
+        if (
+            expected_event_time is not None
+            and event["event_time"] > expected_event_time + EXTRACT_GRACE_PERIOD
+        ):
+            return
+
+        if event.get("package_id") != package_id:
+            continue
+        yield event
+        expected_event_time = event.get("next_event_time")
+        if (
+            not expected_event_time
+            or event.get("next_sorting_center", sorting_center_code)
+            != sorting_center_code
+        ):
+            # output, or loaded on a truck to another sorting center
+            return
+
+
 def get_argument_parser():
 
     parser = argparse.ArgumentParser()
@@ -538,11 +1811,25 @@ def get_argument_parser():
         "-p", "--package_id", help="extract events for only this package (testing only)"
     )
 
+    parser.add_argument(
+        "-t",
+        "--tracking",
+        help="with --package_id, show public tracking events of the package",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--start_time",
+        type=int,
+        help="with --package_id, read events from this event_time on (seconds since the epoch), default is when the package arrived",
+        default=None,
+    )
+
     parser.add_argument(
         "-s",
         "--sorting_center_code",
-        choices=SORTING_CENTER_CODES,
-        help="the sorting center code (one of %r)" % SORTING_CENTER_CODES,
+        help="the sorting center code (one of the topology sorting centers)",
         default=None,
     )
 
@@ -575,6 +1862,121 @@ def get_argument_parser():
         default=False,
     )
 
+    parser.add_argument(
+        "--redis_batch_size",
+        type=int,
+        help="send redis updates for this many packages at once (0 = every event)",
+        default=REDIS_BATCH_SIZE,
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="pass up to this many events through each pipeline stage at once (0 = one event at a time)",
+        default=BATCH_SIZE,
+    )
+
+    parser.add_argument(
+        "--batch_time",
+        type=int,
+        help="with --batch_size, milliseconds a batch waits for more events",
+        default=BATCH_TIME,
+    )
+
+    parser.add_argument(
+        "--stage_threads",
+        action="store_true",
+        help="run the reader, the kvt stages and the redis stages on threads of their own",
+    )
+
+    parser.add_argument(
+        "--stage_queue_size",
+        type=int,
+        help="with --stage_threads, events (or batches) queued between two stages",
+        default=STAGE_QUEUE_SIZE,
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        help="package attribute records cached in this process (0 = read and write the kvt for every event)",
+        default=CACHE_SIZE,
+    )
+
+    parser.add_argument(
+        "--cache_flush_size",
+        type=int,
+        help="write cached package attribute updates for this many packages at once",
+        default=FLUSH_SIZE,
+    )
+
+    parser.add_argument(
+        "--kvt_in_flight",
+        type=int,
+        help="issue kvt requests for up to this many upcoming events before waiting (0 = wait for each request)",
+        default=KVT_IN_FLIGHT,
+    )
+
+    parser.add_argument(
+        "--segments",
+        type=int,
+        help="create the input stream with this many segments, if it doesn't exist",
+        default=INPUT_STREAM_SEGMENT_COUNT,
+    )
+
+    parser.add_argument(
+        "--readers",
+        type=int,
+        help="read the input stream with this many reader threads, each running the whole pipeline, at most one per segment",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--local_deadlines",
+        help="keep next expected events in this process instead of redis (standalone sorting center)",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--snapshot_file",
+        help="with --local_deadlines, restore pending deadlines from and save them to this file",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--snapshot_interval",
+        type=float,
+        help="seconds between snapshots of local deadlines",
+        default=SNAPSHOT_INTERVAL,
+    )
+
+    parser.add_argument(
+        "--watermark_skew",
+        type=int,
+        help="seconds of event_time this sorting center may be ahead of the slowest one before it waits (default: shortest truck trip)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--reader_group",
+        help="name of the input stream reader group, default a new random name (sorting-center-CODE with --checkpoint_file)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--checkpoint_file",
+        help="checkpoint the reader group and save local state to this file, resume from it at start",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--checkpoint_interval",
+        type=float,
+        help="seconds between checkpoints",
+        default=CHECKPOINT_INTERVAL,
+    )
+
     parser.add_argument(
         "-w",
         "--wait_for_events",
@@ -592,8 +1994,19 @@ def main():
     parser = get_argument_parser()
     add_logging_argument(parser)
     add_redis_argparse_argument(parser)
+    add_topology_argument(parser)
+    add_codec_argument(parser)
+    add_metrics_argument(parser)
     args = parser.parse_args()
     setup_logging(args)
+    serve_metrics_from_options(args)
+    topology = get_topology_from_options(args)
+    codec = PayloadCodec(get_codec_from_options(args, topology))
+    if args.sorting_center_code and args.sorting_center_code not in topology.index:
+        parser.error(
+            "sorting center code must be one of %s"
+            % ",".join(topology.sorting_center_codes)
+        )
     if args.sorting_center_code:
         logger = logging.getLogger("Sort Center %s" % args.sorting_center_code)
     else:
@@ -602,6 +2015,28 @@ def main():
     if all((args.sorting_center_code, args.scope, args.uri, args.run)):
         # run the sorting center process
         redis = get_redis_server_from_options(args)
+        if args.local_deadlines:
+            local_deadlines = LocalNextEventTimes(
+                snapshot_file=args.snapshot_file,
+                snapshot_interval=args.snapshot_interval,
+                sorting_center_code=args.sorting_center_code,
+            )
+        elif redis:
+            local_deadlines = None
+        else:
+            parser.error("running a sorting center needs --rs or --local_deadlines")
+        if args.checkpoint_file:
+            if args.snapshot_file:
+                parser.error("--checkpoint_file includes local deadlines, use one")
+            checkpoints = Checkpoints(
+                args.checkpoint_file, interval=args.checkpoint_interval
+            )
+            reader_group_name = args.reader_group or (
+                "sorting-center-%s" % args.sorting_center_code
+            )
+        else:
+            checkpoints = None
+            reader_group_name = args.reader_group
         return process_sorting_center_events(
             uri=args.uri,
             scope=args.scope,
@@ -611,7 +2046,30 @@ def main():
             wait_for_events=args.wait_for_events,
             mark_event_index_frequency=args.mark_event_index_frequency,
             report_lost_packages=args.report_lost_packages,
+            topology=topology,
+            codec=codec,
+            redis_batch_size=args.redis_batch_size,
+            local_deadlines=local_deadlines,
+            cache_size=args.cache_size,
+            cache_flush_size=args.cache_flush_size,
+            kvt_in_flight=args.kvt_in_flight,
+            segments=args.segments,
+            readers=args.readers,
+            connect_redis=lambda: get_redis_server_from_options(args),
+            reader_group_name=reader_group_name,
+            checkpoints=checkpoints,
+            watermark_skew=args.watermark_skew,
+            batch_size=args.batch_size,
+            batch_time=args.batch_time,
+            stage_threads=args.stage_threads,
+            stage_queue_size=args.stage_queue_size,
         )
+    elif all((args.tracking, args.scope, args.uri, args.package_id)):
+        # public tracking history of a single package
+        for event in read_public_tracking_events(
+            uri=args.uri, scope=args.scope, package_id=args.package_id, codec=codec
+        ):
+            print("%r" % event)
     elif all((args.sorting_center_code, args.scope, args.uri, args.package_id)):
         # test retrieving events for a single package
         for event in extract_sorting_center_events_by_package_id(
@@ -619,6 +2077,9 @@ def main():
             scope=args.scope,
             sorting_center_code=args.sorting_center_code,
             package_id=args.package_id,
+            topology=topology,
+            codec=codec,
+            start_time=args.start_time,
         ):
             print("%r" % event)
 
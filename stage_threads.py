@@ -0,0 +1,201 @@
+"""stage_threads - run the stages of a pipeline on threads of their own"""
+# to be used from jython
+#
+# a stage is a generator reading events from the stage before it. Started on a
+# stage thread, the stage and all stages before it that aren't on a thread of
+# their own run on that thread. Its events are passed to the next stage through
+# a bounded queue, in order, so the events of a package stay in order. When the
+# queue is full the stage thread waits, a full queue is in front of the slowest
+# stage.
+#
+# when a stage ends, e.g. at the end of the stream, the events still queued are
+# passed on before the next stage sees the end. When a stage fails its
+# exception is raised in the next stage and the stage threads before it stop.
+# When the next stage stops reading, the stage thread stops at its next event
+# and closes its stage. Queue depths of all stage threads are kept in metrics
+
+import sys
+import time
+import logging
+import threading
+import weakref
+import collections
+import Queue
+
+from metrics import REGISTRY
+
+STAGE_QUEUE_SIZE = 1000  # events (or batches) queued between two stages
+PUT_TIMEOUT = 1.0  # wall-clock seconds between checks whether the reader stopped
+REPORT_INTERVAL = 60.0  # wall-clock seconds between queue depth reports
+
+END_OF_STAGE = object()
+
+live_stage_threads = weakref.WeakSet()
+live_stage_threads_lock = threading.Lock()
+
+
+class StageFailure:
+    """exception of a stage, queued for the next stage"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StageThread:
+    """a stage running on its own thread, its events read from a bounded queue"""
+
+    def __init__(self, name, input_event_stream, stage_threads):
+        self.name = name
+        self.input_event_stream = input_event_stream
+        self.stage_threads = stage_threads
+        self.queue = Queue.Queue(stage_threads.queue_size)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def run(self):
+        """pass events of the stage to the queue until it ends or the reader stopped"""
+        try:
+            for event in self.input_event_stream:
+                if not self.put(event):
+                    return
+            self.put(END_OF_STAGE)
+        except:  # java exceptions too
+            error = sys.exc_info()[1]
+            if not self.stage_threads.failed(self, error):
+                self.stage_threads.logger.exception("stage %s failed", self.name)
+            self.put(StageFailure(error))
+        finally:
+            close = getattr(self.input_event_stream, "close", None)
+            if close:
+                close()
+
+    def put(self, item):
+        """queue item, return False if the reader stopped meanwhile"""
+        while not self.stopped:
+            try:
+                self.queue.put(item, True, PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def events(self):
+        """yield events of the stage, in order"""
+        try:
+            while True:
+                item = self.get()
+                if item is END_OF_STAGE:
+                    return
+                yield item
+                self.stage_threads.report()
+        finally:
+            self.stopped = True
+
+    def get(self, timeout=None):
+        """return next event, None if there is none within timeout seconds
+
+        END_OF_STAGE after the last event, once the stage has been closed
+        """
+        try:
+            item = self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+        if item is END_OF_STAGE:
+            self.thread.join()
+        elif isinstance(item, StageFailure):
+            raise item.error
+        return item
+
+    def stop(self, timeout=None):
+        """stop the stage thread at its next event, wait up to timeout seconds for it"""
+        self.stopped = True
+        self.thread.join(timeout)
+
+    def depth(self):
+        """return events waiting in the queue"""
+        return self.queue.qsize()
+
+
+class StageThreads:
+    """stages of a pipeline running on threads of their own
+
+    queue depths are logged every report_interval wall-clock seconds
+    """
+
+    def __init__(
+        self,
+        queue_size=STAGE_QUEUE_SIZE,
+        report_interval=REPORT_INTERVAL,
+        name="stages",
+    ):
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self.stages = []
+        self.errors = []  # exceptions of failed stages
+        self.lock = threading.Lock()
+        self.report_time = time.time()
+        with live_stage_threads_lock:
+            live_stage_threads.add(self)
+
+    def start(self, name, input_event_stream):
+        """run input_event_stream on a new thread, return iterable of its events"""
+        return self.start_thread(name, input_event_stream).events()
+
+    def start_thread(self, name, input_event_stream):
+        """run input_event_stream on a new thread, return its StageThread"""
+        stage = StageThread(name, input_event_stream, self)
+        self.stages.append(stage)
+        stage.thread.start()
+        return stage
+
+    def failed(self, stage, error):
+        """stop the stages before a failed stage, return True if error came from one"""
+        with self.lock:
+            for earlier_stage in self.stages[: self.stages.index(stage)]:
+                earlier_stage.stopped = True
+            if any(error is _ for _ in self.errors):
+                return True
+            self.errors.append(error)
+            return False
+
+    def depths(self):
+        """return (stage name, events waiting for the next stage) of each stage"""
+        return [(stage.name, stage.depth()) for stage in self.stages]
+
+    def report(self):
+        """log queue depths when they are due"""
+        now = time.time()
+        if now - self.report_time < self.report_interval:
+            return
+        self.report_time = now
+        self.logger.info(
+            "queued events %s (of %d)",
+            ", ".join("%s %d" % _ for _ in self.depths()),
+            self.queue_size,
+        )
+
+
+def queue_depths():
+    """return (labels, events queued) of each stage, summed over stage threads"""
+    with live_stage_threads_lock:
+        stage_threads_list = list(live_stage_threads)
+    depths = collections.OrderedDict()
+    for stage_threads in stage_threads_list:
+        for stage, depth in stage_threads.depths():
+            key = (stage_threads.name, stage)
+            depths[key] = depths.get(key, 0) + depth
+    return [
+        ({"pipeline": pipeline, "stage": stage}, depth)
+        for (pipeline, stage), depth in depths.items()
+    ]
+
+
+REGISTRY.collector(
+    "stage_queue_depth",
+    "gauge",
+    "events (or batches) queued for the next stage",
+    queue_depths,
+)
@@ -0,0 +1,240 @@
+"""stream_reader - read events of a pravega stream ahead, on a thread of their own"""
+# to be used from jython
+#
+# a prefetch thread reads events into a bounded buffer while the events before
+# them are processed. Events that can be read without waiting are read and
+# decoded in chunks of up to chunk_size. When there is nothing to read, a read
+# waits MINIMUM_READ_TIMEOUT, twice as long each time nothing arrives, up to
+# READ_TIMEOUT. Checkpoints of the reader group stay in order with the events.
+#
+# a stream written by import_events ends with an end-of-stream event, in one
+# segment. Events of other segments may still be unread when it is read, so
+# the reader that reads it tells the other readers sharing stream_end, and
+# every reader then ends when a read finds nothing and nothing is left unread
+# in the reader group. A stream without one ends when nothing is left unread
+# once an event has been read. Time spent waiting for reads and decoding is
+# logged and kept in metrics
+
+import time
+import uuid
+import contextlib
+import logging
+import threading
+
+from pravega_interface import (
+    eventStreamClientFactory,
+    readerGroupManager,
+    readerGroup,
+    Reader,
+)
+from stage_threads import StageThreads, END_OF_STAGE
+from metrics import REGISTRY
+
+READ_TIMEOUT = 2000  # longest milliseconds a read waits for an event
+MINIMUM_READ_TIMEOUT = 50  # milliseconds the first read waits when idle
+CHUNK_SIZE = 100  # events decoded at once
+PREFETCH_CHUNKS = 100  # chunks read ahead
+REPORT_INTERVAL = 60.0  # wall-clock seconds between read time reports
+
+
+class Checkpoint:
+    """checkpoint of the reader group, read between events"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def is_end_of_stream(event):
+    """return True for the last event import_events writes to a stream"""
+    return event.get("scanner_id") == "end-of-stream"
+
+
+class PrefetchingReader:
+    """events of a pravega reader, read and decoded on a prefetch thread
+
+    get() returns a list of events or a Checkpoint. With end_of_stream, a
+    function of an event, the stream ends once a reader sharing stream_end
+    read that event
+    """
+
+    def __init__(
+        self,
+        reader,
+        reader_group,
+        decode,
+        wait_for_events=False,
+        end_of_stream=None,
+        stream_end=None,
+        chunk_size=CHUNK_SIZE,
+        prefetch_chunks=PREFETCH_CHUNKS,
+        report_interval=REPORT_INTERVAL,
+        name="reader",
+    ):
+        self.reader = reader
+        self.reader_group = reader_group
+        self.decode = decode
+        self.wait_for_events = wait_for_events
+        self.end_of_stream = end_of_stream
+        self.stream_end = threading.Event() if stream_end is None else stream_end
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self.logger = logging.getLogger(name)
+        self.event_count = 0
+        self.read_time = 0.0  # wall-clock seconds waiting in readNextEvent
+        self.decode_time = 0.0  # wall-clock seconds decoding
+        self.report_time = time.time()
+        self.events_read = REGISTRY.counter(
+            "stream_reader_events_total", "events read", reader=name
+        )
+        self.read_seconds = REGISTRY.counter(
+            "stream_reader_read_seconds_total",
+            "wall-clock seconds waiting for reads",
+            reader=name,
+        )
+        self.decode_seconds = REGISTRY.counter(
+            "stream_reader_decode_seconds_total",
+            "wall-clock seconds decoding events",
+            reader=name,
+        )
+        self.stage_threads = StageThreads(prefetch_chunks, report_interval, name)
+        self.prefetch_thread = self.stage_threads.start_thread(
+            "prefetch", self.prefetch()
+        )
+
+    def prefetch(self):
+        """yield chunks of decoded events and checkpoints until the stream ends"""
+        have_read_an_event = False
+        timeout = MINIMUM_READ_TIMEOUT
+        while True:
+            payloads = []
+            checkpoint = None
+            read_time = 0.0
+            while len(payloads) < self.chunk_size:
+                start = time.time()
+                event_read = self.reader.readNextEvent(0 if payloads else timeout)
+                read_time += time.time() - start
+                if event_read.isCheckpoint():
+                    checkpoint = Checkpoint(event_read.getCheckpointName())
+                    break
+                payload = event_read.getEvent()
+                if payload is None:
+                    break
+                payloads.append(payload)
+            self.read_time += read_time
+            self.read_seconds.inc(read_time)
+            if payloads:
+                yield self.decode_chunk(payloads)
+                have_read_an_event = True
+                timeout = MINIMUM_READ_TIMEOUT
+            if checkpoint is not None:
+                yield checkpoint
+                continue
+            if payloads:
+                continue
+            if self.finished(have_read_an_event):
+                self.logger.debug("all events have been read")
+                self.report(force=True)
+                return
+            timeout = min(timeout * 2, READ_TIMEOUT)
+            self.report()
+
+    def decode_chunk(self, payloads):
+        """return decoded payloads, note when the end of the stream was read"""
+        start = time.time()
+        events = [self.decode(_) for _ in payloads]
+        decode_time = time.time() - start
+        self.decode_time += decode_time
+        self.decode_seconds.inc(decode_time)
+        self.event_count += len(events)
+        self.events_read.inc(len(events))
+        if self.end_of_stream and any(self.end_of_stream(_) for _ in events):
+            self.stream_end.set()
+        self.report()
+        return events
+
+    def finished(self, have_read_an_event):
+        """return True if nothing is left to read, after a read found nothing"""
+        if self.stream_end.is_set():
+            # other segments may not have been read up to the end yet
+            return not self.reader_group.getMetrics().unreadBytes()
+        if not have_read_an_event and self.wait_for_events:
+            # need to keep waiting until we get at least one event
+            return False
+        if self.end_of_stream and have_read_an_event:
+            # the end of the stream is still to be written
+            return False
+        return not self.reader_group.getMetrics().unreadBytes()
+
+    def get(self, timeout=None):
+        """return next list of events or Checkpoint
+
+        None if there is none within timeout seconds, END_OF_STAGE after the last
+        """
+        return self.prefetch_thread.get(timeout)
+
+    def report(self, force=False):
+        """log events read and time spent reading and decoding when it is due"""
+        now = time.time()
+        if not force and now - self.report_time < self.report_interval:
+            return
+        self.report_time = now
+        self.logger.info(
+            "read %d events, %.1fs waiting for reads, %.1fs decoding, %d of %d chunks"
+            " read ahead",
+            self.event_count,
+            self.read_time,
+            self.decode_time,
+            # the prefetch thread may end before prefetch_thread is set
+            sum(depth for stage, depth in self.stage_threads.depths()),
+            self.stage_threads.queue_size,
+        )
+
+    def close(self):
+        """stop the prefetch thread, before its reader is closed"""
+        self.prefetch_thread.stop(READ_TIMEOUT / 1000.0 + 1)
+
+
+@contextlib.contextmanager
+def prefetchingReader(
+    uri,
+    scope,
+    stream_name,
+    codec,
+    reader_name=None,
+    reader_group_name=None,
+    start_stream_cut=None,
+    **kwargs
+):
+    """context manager of a PrefetchingReader of a stream, decoded by codec
+
+    readers sharing reader_group_name divide the stream segments between them.
+    A new reader group starts reading at start_stream_cut, if set. kwargs are
+    passed to PrefetchingReader
+    """
+    if reader_name is None:
+        reader_name = str(uuid.uuid4()).replace("-", "")
+    with readerGroupManager(uri, scope) as reader_group_manager, readerGroup(
+        reader_group_manager, scope, stream_name, reader_group_name, start_stream_cut
+    ) as reader_group, eventStreamClientFactory(uri, scope) as client_factory, Reader(
+        reader_group, client_factory, codec.serializer, reader_name=reader_name
+    ) as reader:
+        prefetching_reader = PrefetchingReader(
+            reader, reader_group, codec.decode, **kwargs
+        )
+        try:
+            yield prefetching_reader
+        finally:
+            prefetching_reader.close()
+
+
+def iterable_stream(uri, scope, stream_name, codec, **kwargs):
+    """iterate events from a stream, decoded by codec, see prefetchingReader"""
+    with prefetchingReader(uri, scope, stream_name, codec, **kwargs) as reader:
+        while True:
+            item = reader.get()
+            if item is END_OF_STAGE:
+                return
+            if isinstance(item, Checkpoint):
+                continue
+            for event in item:
+                yield event
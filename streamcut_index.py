@@ -0,0 +1,130 @@
+"""streamcut_index - hourly StreamCuts of sorting center input streams"""
+# to be used from jython
+#
+# when the first event of an hour is read, the reader group's StreamCut is
+# saved in a kvt, in the sorting center's key family under the hour. The
+# StreamCut holds the last positions reported by the readers, so it is at or
+# before the first event of the hour. A reader started at the StreamCut for a
+# time reads every event from that hour on, without scanning the stream from
+# the start. An hour's StreamCut is never replaced, a process restarted from a
+# checkpoint resumes in the middle of an hour and its StreamCut would be after
+# the events read before the restart
+
+import logging
+import threading
+import contextlib
+
+from java.util.concurrent import CompletionException
+from io.pravega.client.stream import StreamCut
+from io.pravega.client.stream.impl import UTF8StringSerializer
+
+from pravega_interface import (
+    keyValueTable,
+    keyValueTableFactory,
+    keyValueTableConfiguration,
+    keyValueTableManager,
+    keyFamilyEntries,
+    conditionalUpdateFailed,
+)
+from const import STREAMCUT_KVT_NAME
+
+STREAMCUT_INTERVAL = 3600  # seconds of event_time
+
+
+def streamcut_key(event_time, interval=STREAMCUT_INTERVAL):
+    """return kvt key of the interval containing event_time"""
+    return "%012d" % (event_time - event_time % interval)
+
+
+def parse_streamcut(text):
+    """return StreamCut from its text form"""
+    # from is a python keyword
+    return getattr(StreamCut, "from")(text)
+
+
+class StreamCutIndex:
+    """StreamCuts of a sorting center input stream by hour, kept in a kvt
+
+    mark can be called by several reader threads of one reader group
+    """
+
+    def __init__(
+        self,
+        kvt_table,
+        sorting_center_code,
+        reader_group=None,
+        interval=STREAMCUT_INTERVAL,
+    ):
+        self.kvt_table = kvt_table
+        self.sorting_center_code = sorting_center_code
+        self.reader_group = reader_group
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_key = None
+
+    def mark(self, event_time):
+        """save a StreamCut if event_time is the first event of an hour
+
+        the first event read after a restart is taken as the first of its hour
+        too, the StreamCut is only saved if the hour has none yet
+        """
+        key = streamcut_key(event_time, self.interval)
+        if self.last_key is not None and key <= self.last_key:
+            return
+
+        with self.lock:
+            if self.last_key is not None and key <= self.last_key:
+                return
+            self.last_key = key
+            for stream_cut in self.reader_group.getStreamCuts().values():
+                try:
+                    self.kvt_table.putIfAbsent(
+                        self.sorting_center_code, key, stream_cut.asText()
+                    ).join()
+                except CompletionException as error:
+                    if not conditionalUpdateFailed(error):
+                        raise
+                    logging.debug(
+                        "kept streamcut %s %s", self.sorting_center_code, key
+                    )
+                    continue
+                logging.debug("saved streamcut %s %s", self.sorting_center_code, key)
+
+    def find(self, event_time):
+        """return StreamCut to read events from event_time on, None to read from the start"""
+        key = streamcut_key(event_time, self.interval)
+        entry = self.kvt_table.get(self.sorting_center_code, key).join()
+        if entry is None:
+            # hour not indexed, e.g. no events, use the closest earlier hour
+            earlier = [
+                _
+                for _ in keyFamilyEntries(self.kvt_table, self.sorting_center_code)
+                if _.getKey().getKey() <= key
+            ]
+            if not earlier:
+                return None
+            entry = max(earlier, key=lambda _: _.getKey().getKey())
+        return parse_streamcut(entry.getValue())
+
+
+@contextlib.contextmanager
+def streamCutIndex(uri, scope, sorting_center_code, reader_group=None):
+    """create a StreamCutIndex for a sorting center, reader_group is needed to mark"""
+    with keyValueTableManager(uri) as kvt_manager:
+        created = kvt_manager.createKeyValueTable(
+            scope, STREAMCUT_KVT_NAME, keyValueTableConfiguration()
+        )
+        logging.debug(
+            "kvt table %s/%s %s",
+            scope,
+            STREAMCUT_KVT_NAME,
+            "created" if created else "already exists",
+        )
+        with keyValueTableFactory(uri, scope) as kvt_factory:
+            with keyValueTable(
+                kvt_factory,
+                STREAMCUT_KVT_NAME,
+                UTF8StringSerializer(),
+                UTF8StringSerializer(),
+            ) as kvt_table:
+                yield StreamCutIndex(kvt_table, sorting_center_code, reader_group)
@@ -0,0 +1,253 @@
+"""topology - sorting center codes, truck travel times and conveyor layouts"""
+# the topology can be loaded from a json config file, e.g.
+#
+# {
+#     "sorting_centers": ["A", "B"],
+#     "truck_travel_times": [[0, 1440], [1440, 0]],
+#     "conveyor_layouts": {
+#         "B": {"path_from": {...}, "path_to": {...}}
+#     }
+# }
+#
+# truck_travel_times is a matrix in minutes, indexed by position in sorting_centers.
+# conveyor_layouts is optional, it has the same structure as
+# simulator_core.random_conveyor_paths. Sorting centers without a conveyor layout
+# share a randomly drawn layout.
+
+import sys
+import json
+import math
+import random
+import argparse
+
+from const import SORTING_CENTER_CODES, SORTING_CENTER_STREAM_NAME
+
+TRUCK_TRAVEL_TIMES = {
+    ("A", "A"): 0,
+    ("A", "B"): 1440,
+    ("A", "C"): 1440 * 2,
+    ("A", "D"): 1440 * 5,
+    ("B", "A"): 1440,
+    ("B", "B"): 0,
+    ("B", "C"): 1440,
+    ("B", "D"): 1440 * 5,
+    ("C", "A"): 1440 * 2,
+    ("C", "B"): 1440,
+    ("C", "C"): 0,
+    ("C", "D"): 1440 * 5,
+    ("D", "A"): 1440 * 5,
+    ("D", "B"): 1440 * 5,
+    ("D", "C"): 1440 * 5,
+    ("D", "D"): 0,
+}
+
+PUBLIC_SCANNER_IDS = ("intake", "receiving", "output")  # plus holding_<code>
+
+
+class Topology:
+    """sorting centers and the truck travel times between them"""
+
+    def __init__(
+        self, sorting_center_codes, truck_travel_times, conveyor_layouts=None
+    ):
+        self.sorting_center_codes = tuple(sorting_center_codes)
+        self.index = {_: idx for idx, _ in enumerate(self.sorting_center_codes)}
+        if len(self.index) != len(self.sorting_center_codes):
+            raise ValueError("duplicate sorting center code")
+        if len(truck_travel_times) != len(self.sorting_center_codes) or any(
+            len(_) != len(self.sorting_center_codes) for _ in truck_travel_times
+        ):
+            raise ValueError(
+                "truck_travel_times must be a %d x %d matrix"
+                % (len(self.sorting_center_codes), len(self.sorting_center_codes))
+            )
+        self.truck_travel_times = [list(_) for _ in truck_travel_times]
+        self.conveyor_layouts = conveyor_layouts or {}
+        for sorting_center_code in self.conveyor_layouts:
+            if sorting_center_code not in self.index:
+                raise ValueError(
+                    "conveyor layout for unknown sorting center %r"
+                    % sorting_center_code
+                )
+        self.public_scanner_ids = frozenset(
+            PUBLIC_SCANNER_IDS
+            + tuple("holding_%s" % _ for _ in self.sorting_center_codes)
+        )
+
+    def __len__(self):
+        return len(self.sorting_center_codes)
+
+    def truck_travel_time(self, origin, destination):
+        """return truck travel time in minutes"""
+        return self.truck_travel_times[self.index[origin]][self.index[destination]]
+
+    def minimum_truck_travel_time(self):
+        """return shortest truck travel time between two sorting centers in minutes
+
+        None if there is only one sorting center
+        """
+        travel_times = [
+            travel_time
+            for origin, row in enumerate(self.truck_travel_times)
+            for destination, travel_time in enumerate(row)
+            if origin != destination
+        ]
+        return min(travel_times) if travel_times else None
+
+    def conveyor_layout(self, sorting_center_code):
+        """return (path_from, path_to) for a sorting center, or None to use the shared layout"""
+        layout = self.conveyor_layouts.get(sorting_center_code)
+        if layout is None:
+            return None
+        return layout["path_from"], layout["path_to"]
+
+    def stream_name(self, sorting_center_code):
+        """return name of the input stream for a sorting center"""
+        return SORTING_CENTER_STREAM_NAME % sorting_center_code
+
+    def stream_names(self):
+        """return dict of sorting center code to input stream name"""
+        return {_: self.stream_name(_) for _ in self.sorting_center_codes}
+
+    def to_json(self):
+        """return topology as a json serializable dict"""
+        result = {
+            "sorting_centers": list(self.sorting_center_codes),
+            "truck_travel_times": self.truck_travel_times,
+        }
+        if self.conveyor_layouts:
+            result["conveyor_layouts"] = self.conveyor_layouts
+        return result
+
+    @classmethod
+    def from_json(cls, config):
+        """return topology from a dict loaded from a json config file"""
+        return cls(
+            sorting_center_codes=config["sorting_centers"],
+            truck_travel_times=config["truck_travel_times"],
+            conveyor_layouts=config.get("conveyor_layouts"),
+        )
+
+    @classmethod
+    def load(cls, file_name):
+        """return topology loaded from a json config file"""
+        with open(file_name, "r") as config_file:
+            return cls.from_json(json.load(config_file))
+
+    @classmethod
+    def generate(cls, sorting_center_count, random_seed=0):
+        """return a synthetic topology with sorting_center_count centers
+
+        centers are placed at random on a map 5 truck-days across, travel time
+        is rounded up to whole days
+        """
+        random_source = random.Random(random_seed)
+        codes = sorting_center_codes(sorting_center_count)
+        locations = [(random_source.random(), random_source.random()) for _ in codes]
+        truck_travel_times = [
+            [
+                0
+                if origin == destination
+                else max(1, int(math.ceil(math.hypot(x1 - x2, y1 - y2) * 5))) * 1440
+                for destination, (x2, y2) in enumerate(locations)
+            ]
+            for origin, (x1, y1) in enumerate(locations)
+        ]
+        return cls(codes, truck_travel_times)
+
+
+def sorting_center_codes(count):
+    """return count sorting center codes, A to Z then AA, AB, ..."""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    result = []
+    length = 1
+    while len(result) < count:
+        for idx in range(len(letters) ** length):
+            code = ""
+            for _ in range(length):
+                idx, letter_index = divmod(idx, len(letters))
+                code = letters[letter_index] + code
+            result.append(code)
+            if len(result) == count:
+                break
+        length += 1
+    return result
+
+
+DEFAULT_TOPOLOGY = Topology(
+    SORTING_CENTER_CODES,
+    [
+        [TRUCK_TRAVEL_TIMES[(origin, destination)] for destination in SORTING_CENTER_CODES]
+        for origin in SORTING_CENTER_CODES
+    ],
+)
+
+
+def add_topology_argument(parser):
+    parser.add_argument(
+        "--topology",
+        dest="topology_file",
+        help="json topology config file (default is sorting centers %s)"
+        % ",".join(SORTING_CENTER_CODES),
+    )
+
+    return parser
+
+
+def get_topology_from_options(options):
+    if options.topology_file:
+        return Topology.load(options.topology_file)
+
+    return DEFAULT_TOPOLOGY
+
+
+def get_argument_parser():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-g",
+        "--generate",
+        type=int,
+        help="write a synthetic topology with this many sorting centers to stdout",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--seed", type=int, default=0, help="random seed for a synthetic topology",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--codes",
+        help="write sorting center codes to stdout, one per line",
+        action="store_true",
+        default=False,
+    )
+
+    add_topology_argument(parser)
+
+    return parser
+
+
+def main():
+    """main"""
+    parser = get_argument_parser()
+    args = parser.parse_args()
+
+    if args.generate:
+        json.dump(
+            Topology.generate(args.generate, random_seed=args.seed).to_json(),
+            sys.stdout,
+        )
+        sys.stdout.write("\n")
+    elif args.codes:
+        for sorting_center_code in get_topology_from_options(args).sorting_center_codes:
+            print(sorting_center_code)
+    else:
+        parser.print_help()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
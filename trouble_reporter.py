@@ -2,11 +2,9 @@
 
 import sys
 import argparse
-import json
 import logging
 import cgitb
 import itertools
-import uuid
 import operator
 import time
 import datetime
@@ -16,79 +14,51 @@ from io.pravega.client.stream.impl import UTF8StringSerializer
 from pravega_interface import (
     streamConfiguration,
     streamManager,
-    eventStreamClientFactory,
     eventWriter,
-    readerGroupManager,
-    readerGroup,
-    Reader,
     keyValueTable,
     keyValueTableFactory,
     keyValueTableConfiguration,
     keyValueTableManager,
+    PayloadCodec,
 )
 
+from stream_reader import iterable_stream
+from metrics import (
+    REGISTRY,
+    Throughput,
+    counted,
+    add_metrics_argument,
+    serve_metrics_from_options,
+)
 from redis_util import add_redis_argparse_argument, get_redis_server_from_options
 
 from util import setup_logging, add_logging_argument
+from topology import add_topology_argument, get_topology_from_options
+from event_codec import JsonCodec, add_codec_argument, get_codec_from_options
 from const import (
-    SORTING_CENTER_CODES,
-    SORTING_CENTER_TO_STREAM_NAME,
     REDIS_PACKAGE_NEXT_EVENT_KEY_NAME,
-    REDIS_CLOCK_SYNC_KEY_NAME,
+    REDIS_WATERMARK_KEY_NAME,
     PACKAGE_ATTRIBUTES_KVT_NAME,
     PACKAGE_EVENTS_KVT_NAME,
-    PUBLIC_SCANNER_EVENTS,
     TROUBLE_EVENT_STREAM_NAME,
     MINIMUM_LATE_PACKAGE_SECONDS,
     REDIS_LATE_PACKAGE_HASH_NAME,
     REDIS_PACKAGE_NEXT_SCANNER_ID_KEY_NAME,
 )
 
-READ_TIMEOUT = 2000
-
 
 cgitb.enable(format="text")
 logger = None
-
-
-def iterable_stream(
-    uri, scope, stream_name, serializer, reader_name=None, wait_for_events=False
-):
-    """iterate events from a stream"""
-    if reader_name is None:
-        reader_name = str(uuid.uuid4()).replace("-", "")
-    with readerGroupManager(uri, scope) as reader_group_manager, readerGroup(
-        reader_group_manager, scope, stream_name
-    ) as reader_group, eventStreamClientFactory(uri, scope) as client_factory, Reader(
-        reader_group, client_factory, serializer, reader_name=reader_name
-    ) as reader:
-        have_read_an_event = False
-        while True:
-            event_read = reader.readNextEvent(READ_TIMEOUT)
-            event = event_read.getEvent()
-            if event is None:
-                if reader_group.getMetrics().unreadBytes():
-                    # still more to read, retry
-                    continue
-                elif not have_read_an_event and wait_for_events:
-                    # need to keep retrying until we get at least one event
-                    logger.debug("waiting for events")
-                    continue
-                else:
-                    # nothing left to read
-                    logger.debug("all events have been read")
-                    return
-
-            yield json.loads(event)
-            have_read_an_event = True
+throughput = Throughput("trouble_reporter")
 
 
 def report_trouble_events(
-    uri, scope, redis=None, wait_for_events=False,
+    uri, scope, redis=None, wait_for_events=False, codec=None,
 ):
-    """process events from trouble stream"""
-    serializer = UTF8StringSerializer()
-    kvt_serializer = (
+    """process events from trouble stream, codec is a PayloadCodec (default json)"""
+    if codec is None:
+        codec = PayloadCodec(JsonCodec())
+    kvt_key_serializer = (
         UTF8StringSerializer()
     )  # cannot get kvt to work with JavaSerializer
     package_attribute_kvt_table_name = PACKAGE_ATTRIBUTES_KVT_NAME
@@ -121,17 +91,25 @@ def report_trouble_events(
                 with keyValueTable(
                     kvt_factory,
                     package_attribute_kvt_table_name,
-                    kvt_serializer,
-                    kvt_serializer,
+                    kvt_key_serializer,
+                    codec.serializer,
                 ) as package_attribute_kvt_table:
                     logger.debug("begin reading from stream %r", trouble_stream_name)
                     input_event_stream = iterable_stream(
                         uri,
                         scope,
                         trouble_stream_name,
-                        serializer,
+                        codec,
                         wait_for_events=wait_for_events,
                     )
+                    input_event_stream = counted(
+                        input_event_stream,
+                        REGISTRY.counter(
+                            "trouble_reporter_stage_events_total",
+                            "events passed on by a pipeline stage",
+                            stage="reader",
+                        ),
+                    )
 
                     # process all events by completely consuming the generator
                     for event in input_event_stream:
@@ -140,8 +118,9 @@ def report_trouble_events(
                             None, package_id
                         ).join()
                         package_attributes = (
-                            json.loads(kvt_entry.getValue()) if kvt_entry else {}
+                            codec.decode(kvt_entry.getValue()) if kvt_entry else {}
                         )
+                        throughput.add(event["event_time"])
                         yield (event, package_attributes)
 
 
@@ -217,8 +196,12 @@ def main():
     parser = get_argument_parser()
     add_logging_argument(parser)
     add_redis_argparse_argument(parser)
+    add_topology_argument(parser)
+    add_codec_argument(parser)
+    add_metrics_argument(parser)
     args = parser.parse_args()
     setup_logging(args)
+    serve_metrics_from_options(args)
     logger = logging.getLogger("Report")
 
     if all((args.scope, args.uri, args.run)):
@@ -230,6 +213,9 @@ def main():
                 scope=args.scope,
                 redis=redis,
                 wait_for_events=args.wait_for_events,
+                codec=PayloadCodec(
+                    get_codec_from_options(args, get_topology_from_options(args))
+                ),
             )
         ):
             pass